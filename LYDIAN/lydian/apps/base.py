@@ -8,7 +8,7 @@
 Base class for all Apps on the platform.
 '''
 
-import collections
+import collections.abc
 
 class BaseApp(object):
 
@@ -26,6 +26,6 @@ class BaseApp(object):
 def exposify(cls):
     for key in dir(cls):
         val = getattr(cls, key)
-        if isinstance(val, collections.Callable) and not key.startswith("_"):
+        if isinstance(val, collections.abc.Callable) and not key.startswith("_"):
             setattr(cls, "exposed_%s" % (key,), val)
     return cls
\ No newline at end of file
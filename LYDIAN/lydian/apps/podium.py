@@ -61,6 +61,8 @@ class Podium(BaseApp):
         """
         self._primary = True
         self._ep_hosts = {}
+        # Journal sequence (of endpoint changes) synced upto, per host.
+        self._ep_seqs = {}
         self._ep_username = username or config.get_param('ENDPOINT_USERNAME')
         self._ep_password = password or config.get_param('ENDPOINT_PASSWORD')
         self.rules_app = rules.RulesApp()
@@ -175,6 +177,7 @@ class Podium(BaseApp):
         eps = [k for k, v in self._ep_hosts.items() if v == hostip]
         for ep in eps:
             self._ep_hosts.pop(ep)
+        self._ep_seqs.pop(hostip, None)
 
     def _add_endpoints(self, client, hostip):
         for iface, ips in client.interface.get_interface_ips_map().items():
@@ -306,6 +309,9 @@ class Podium(BaseApp):
 
         trule = TrafficRule()
         for key, value in intent.items():
+            if key not in TrafficRule.SCHEMA:
+                log.warning("Ignoring unknown field %s of intent", key)
+                continue
             setattr(trule, key, value)
         trule.fill()
         return trule
@@ -412,14 +418,10 @@ class Podium(BaseApp):
                 client.controller.unregister_traffic(rules)
                 client.results.delete_record(reqid)
 
-        trules = self.get_rules_by_reqid(reqid)
-
         host_rules = collections.defaultdict(list)
-        for trule in trules:
-            ruleid = getattr(trule, 'ruleid')
-            src_ip = getattr(trule, 'src')
-            hostip = self.get_ep_host(src_ip)
-            host_rules[hostip].append(ruleid)
+        for src_ip, ruleids in self.rules_app.group_ruleids(
+                'src', reqid=reqid).items():
+            host_rules[self.get_ep_host(src_ip)].extend(ruleids)
 
         args = [(host, (host, rules), {})
                 for host, rules in host_rules.items()]
@@ -448,13 +450,11 @@ class Podium(BaseApp):
     def unregister_traffic(self, reqid):
         """ Stop traffic, delete rules and result records"""
         results = self._traffic_op(reqid, op_type='unregister')
-        self.rules_app.delete(reqid=reqid)
+        self.rules_app.delete_rules(self.rules_app.get_ruleids(reqid=reqid))
         return results
 
     def get_rules_by_reqid(self, reqid):
-        trules = [trule for rule_id, trule in self.rules.items()
-                  if getattr(trule, 'reqid') == reqid]
-        return trules
+        return self.rules_app.get_rules(reqid=reqid)
 
     def get_host_result(self, host_ip, reqid, duration=None, **kwargs):
         if duration is not None:
@@ -482,9 +482,8 @@ class Podium(BaseApp):
         return results
 
     def get_results(self, reqid, duration=None, **kwargs):
-        trules = self.get_rules_by_reqid(reqid)
-        hostips = set([self.get_ep_host(rule.src)
-                      for rule in trules if rule.src])
+        hostips = set([self.get_ep_host(src) for src in
+                       self.rules_app.group_ruleids('src', reqid=reqid) if src])
         results = self._get_results(hostips, reqid, duration=duration,
                                     **kwargs)
         return results
@@ -613,6 +612,42 @@ class Podium(BaseApp):
         args = [(h, (h,), {}) for h in hostips]
         return ThreadPool(self._discover_interfaces, args)
 
+    def _sync_endpoints(self, hostip):
+        """ Applies endpoint changes of a host since last sync. """
+        with LydianClient(hostip) as client:
+            seq, changes, full = client.controller.get_endpoint_changes(
+                self._ep_seqs.get(hostip, 0))
+        if full:
+            eps = [k for k, v in self._ep_hosts.items()
+                   if v == hostip and k != hostip]
+            for ep in eps:
+                self._ep_hosts.pop(ep)
+        for op, ip in changes:
+            if op == 'add':
+                self._ep_hosts[ip] = hostip
+            elif ip != hostip and self._ep_hosts.get(ip) == hostip:
+                self._ep_hosts.pop(ip)
+        self._ep_seqs[hostip] = seq
+        return len(changes)
+
+    def sync_endpoints(self, hostips=None):
+        """
+        Syncs endpoints of hosts (all the nodes, if not provided) with
+        interfaces / namespaces added or removed there since last sync.
+        Endpoints keep track of their changes, so only those are fetched.
+        Returns {hostip : number of changes} of hosts synced.
+
+        Parameters
+        ------------
+        hostips: list
+            List of hostips.
+        """
+        hostips = hostips or list(self.nodes)
+        if isinstance(hostips, str):
+            hostips = hostips.split(',')
+        args = [(h, (h,), {}) for h in hostips]
+        return ThreadPool(self._sync_endpoints, args)
+
 
 def get_podium():
     global _podium
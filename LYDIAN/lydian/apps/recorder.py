@@ -13,6 +13,7 @@ import lydian.common.errors as errors
 from lydian.apps import config
 from lydian.apps.base import BaseApp, exposify
 from lydian.common.core import Subscribe
+from lydian.common.db import add_missing_columns
 from lydian.traffic.core import TrafficRecord
 from sql30 import db
 
@@ -49,7 +50,29 @@ class TrafficRecordDB(db.Model):
         'expected': 'text',
         'result': 'text',
         'latency': 'float',
-        'error': 'text'
+        'error': 'text',
+        'sent': 'int',
+        'received': 'int',
+        'lost': 'int',
+        'reordered': 'int',
+        'duplicates': 'int',
+        'jitter': 'float',
+        'connect_time': 'float',
+        'ttfb': 'float',
+        'total_time': 'float',
+        'send_delay': 'float',
+        'transferred': 'int',
+        'goodput': 'float',
+        'cps': 'float',
+        'failures': 'text',
+        'latency_p50': 'float',
+        'latency_p90': 'float',
+        'latency_p99': 'float',
+        'latency_max': 'float',
+        'forward_delay': 'float',
+        'reverse_delay': 'float',
+        'server_time': 'float',
+        'clock_offset': 'float'
     }
 
     DB_SCHEMA = {
@@ -77,6 +100,8 @@ class TrafficRecorder(TrafficRecordDB, Subscribe):
         db_name = db_file or self.DB_NAME
         TrafficRecordDB.__init__(self, db_name=db_name)
         Subscribe.__init__(self)
+        # Traffic database may be created by an older version.
+        add_missing_columns(self, self._get_schema(self.TABLE))
         self._fields = self._get_fields(self.TABLE)
 
     @property
@@ -12,13 +12,17 @@ in the system at a given point of time. Rules at endpoints would only
 be related to that endpoint host.
 '''
 
+import collections
 import logging
 import os
+import sqlite3
+import threading
 
 from sql30 import db
 
 from lydian.apps.base import BaseApp, exposify
 from lydian.apps import config
+from lydian.common.db import add_missing_columns
 from lydian.traffic.core import TrafficRule
 
 log = logging.getLogger(__name__)
@@ -51,13 +55,22 @@ class RulesDB(db.Model):
 class RulesApp(RulesDB, BaseApp):
     TYPES_MAP = {'int': int, 'float': float, 'text': str}
 
+    # Fields rules are looked up by, in cache as well as in database.
+    INDEXES = ('reqid', 'src', 'state')
+
     def __init__(self, db_file=None):
 
         db_name = db_file or self.DB_NAME
 
         super(RulesApp, self).__init__(db_name=db_name)
         self._rules = {}    # represents local cache.
+        # field : {value : set of ruleids}, for fields in INDEXES.
+        self._indexes = {x: collections.defaultdict(set) for x in self.INDEXES}
+        self._lock = threading.Lock()   # guards indexes
         self.table = self.TABLE
+        # Rules database may be created by an older version.
+        add_missing_columns(self, self._get_schema(self.table))
+        self._create_indexes()
         self.load_from_db()
 
     @property
@@ -67,6 +80,75 @@ class RulesApp(RulesDB, BaseApp):
     def get(self, ruleid):
         return self._rules.get(ruleid)
 
+    def _create_indexes(self):
+        for field in self.INDEXES:
+            self.cursor.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' %
+                                (self.table, field, self.table, field))
+        self.commit()
+
+    def _index(self, trule, fields=None):
+        for field in fields or self.INDEXES:
+            self._indexes[field][getattr(trule, field, None)].add(trule.ruleid)
+
+    def _unindex(self, trule, fields=None):
+        for field in fields or self.INDEXES:
+            index = self._indexes[field]
+            value = getattr(trule, field, None)
+            index[value].discard(trule.ruleid)
+            if not index[value]:
+                index.pop(value)
+
+    def _set_rule(self, trule):
+        """ Adds (or replaces) rule in local cache. """
+        with self._lock:
+            curr = self._rules.get(trule.ruleid)
+            if curr is not None:
+                self._unindex(curr)
+            self._rules[trule.ruleid] = trule
+            self._index(trule)
+
+    def _pop_rule(self, ruleid):
+        with self._lock:
+            trule = self._rules.pop(ruleid, None)
+            if trule is not None:
+                self._unindex(trule)
+        return trule
+
+    def _set_state(self, trule, state):
+        with self._lock:
+            self._unindex(trule, fields=('state',))
+            trule.state = state
+            self._index(trule, fields=('state',))
+
+    def get_ruleids(self, **kwargs):
+        """
+        Returns set of ids of rules matching all of kwargs, which must be
+        fields in INDEXES. e.g. get_ruleids(reqid=reqid, state='ACTIVE')
+        """
+        ruleids = None
+        with self._lock:
+            for field, value in kwargs.items():
+                matched = self._indexes[field].get(value, set())
+                ruleids = matched if ruleids is None else ruleids & matched
+                if not ruleids:
+                    break
+            return set(ruleids or ())
+
+    def get_rules(self, **kwargs):
+        """ Returns rules matching kwargs. See get_ruleids. """
+        trules = (self._rules.get(x) for x in self.get_ruleids(**kwargs))
+        return [x for x in trules if x is not None]
+
+    def group_ruleids(self, field, **kwargs):
+        """
+        Returns {value of field : [ruleids]} of rules matching kwargs.
+        e.g. group_ruleids('src', reqid=reqid)
+        """
+        groups = collections.defaultdict(list)
+        for trule in self.get_rules(**kwargs):
+            groups[getattr(trule, field, None)].append(trule.ruleid)
+        return groups
+
     def add(self, trule, save_to_db=True):
         """
         Adds a rule in local cache and database and returns
@@ -74,7 +156,7 @@ class RulesApp(RulesDB, BaseApp):
         """
         if save_to_db:
             self.save_to_db([trule])
-        self._rules[trule.ruleid] = trule
+        self._set_rule(trule)
 
     def add_rules(self, trules):
         """ Adds multiple rules. """
@@ -88,19 +170,23 @@ class RulesApp(RulesDB, BaseApp):
             db.table = self.table
             for ruleid in ruleids:
                 db.delete(ruleid=ruleid)
-                if ruleid in self._rules:
-                    self._rules.pop(ruleid)
+                self._pop_rule(ruleid)
 
     def load_from_db(self):
         """ Loads rules from DB to local file."""
         records = self.read(include_header=True)
         fields = list(records[0])
+        unknown = [x for x in fields if x not in TrafficRule.__slots__]
+        if unknown:
+            log.warning("Ignoring unknown rule fields : %s", unknown)
         for index, rule in enumerate(records):
             if not index:
                 continue  # first record is a header
             trule = TrafficRule()
 
             for key, val in zip(fields, list(rule)):
+                if key in unknown:
+                    continue
                 if val is not None and val != '':
                     try:
                         ktype = TrafficRule.SCHEMA.get(key, None)
@@ -114,28 +200,36 @@ class RulesApp(RulesDB, BaseApp):
             ruleid = getattr(trule, 'ruleid', None)
             if not ruleid:
                 log.error("Skipped Invalid rule with no ruleid : %s",
-                           trule.__dict__)
-            self._rules[ruleid] = trule
+                           trule.as_dict())
+                continue
+            self._set_rule(trule)
+
+    def _upsert_query(self):
+        """ Returns query to insert a rule, or update it if it exists. """
+        fields = list(TrafficRule.SCHEMA)
+        query = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            self.table, ','.join(fields), ','.join(['?'] * len(fields)))
+        if sqlite3.sqlite_version_info < (3, 24, 0):
+            # No UPSERT. ruleid is the only constraint so replace is same.
+            return query.replace('INSERT', 'INSERT OR REPLACE', 1)
+        return query + ' ON CONFLICT(ruleid) DO UPDATE SET %s' % ','.join(
+            '%s=excluded.%s' % (x, x) for x in fields if x != 'ruleid')
 
     def save_to_db(self, trules):
         """
-        Save local cache to database file.
+        Save rules to database file, in one transaction.
         """
+        rows = []
+        for trule in trules:
+            if not getattr(trule, 'ruleid', None):
+                log.error("Skipped Invalid rule with no ruleid : %s",
+                           trule.as_dict())
+                continue
+            rows.append([getattr(trule, x, None) for x in TrafficRule.SCHEMA])
+        if not rows:
+            return
         with RulesDB() as db:
-            db.table = self.table
-            curr_rule_ids = [x[0] for x in db.read()]  # first value is ruleid
-            for trule in trules:
-                ruleid = getattr(trule, 'ruleid', None)
-                if not ruleid:
-                    log.error("Skipped Invalid rule with no ruleid : %s",
-                               trule.__dict__)
-                    continue
-                _rule = trule.as_dict()
-                _rule = {k: v for k, v in _rule.items() if k in TrafficRule.SCHEMA}
-                if ruleid in curr_rule_ids:
-                    db.update(condition={'ruleid': ruleid}, **_rule)
-                else:
-                    db.write(**_rule)
+            db.cursor.executemany(self._upsert_query(), rows)
 
     def disable(self, ruleid):
         """ Disables a rule. """
@@ -143,7 +237,7 @@ class RulesApp(RulesDB, BaseApp):
             log.error("Invalid rule to disable : %s", ruleid)
             return
 
-        self._rules[ruleid].state = self.INACTIVE
+        self._set_state(self._rules[ruleid], self.INACTIVE)
         where = {'ruleid': ruleid}
         with RulesDB() as db:
             db.table = self.table
@@ -155,7 +249,7 @@ class RulesApp(RulesDB, BaseApp):
             log.error("Invalid rule to enable : %s", ruleid)
             return
 
-        self._rules[ruleid].state = self.ACTIVE
+        self._set_state(self._rules[ruleid], self.ACTIVE)
         where = {'ruleid': ruleid}
         with RulesDB() as db:
             db.table = self.table
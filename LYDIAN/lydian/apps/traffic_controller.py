@@ -8,19 +8,25 @@
 Traffic Controller App handles all the pre processing and post processing
 work for Traffic Generation.
 '''
+import collections
 import pickle
 import logging
+import threading
+import time
 
+from lydian.apps import config
 from lydian.apps.base import BaseApp, exposify
 
 import lydian.traffic.core as core
+import lydian.traffic.task as task
 
 from lydian.utils.network_utils import get_ns_manager, get_interface_manager, \
     NAMESPACE_INTERFACE_NAME_PREFIXES
 
 from lydian.traffic.manager import ClientManager, ServerManager
 from lydian.utils import parallel
-from lydian.utils.common import get_mgmt_ifname, get_host_name
+from lydian.utils.netwatch import NetworkWatcher
+from lydian.utils.common import get_mgmt_ifname, get_host_name, is_linux
 from lydian.utils.nsenter import fdcloseall
 
 
@@ -50,8 +56,23 @@ class TrafficControllerApp(BaseApp):
         # or server.
         ifname = get_mgmt_ifname()
         self._host = self._if_mgr.get_interface(ifname)['address']
+        # Endpoints (as published to primary) and journal of their changes
+        # (seq, op, ip), so that primary can sync only what changed.
+        self._endpoints = set()
+        # Starts from current time (ms) so that sequences seen before a
+        # restart are older than journal and lead to a full sync.
+        self._ep_seq = int(time.time() * 1000)
+        self._ep_journal = collections.deque(
+            maxlen=config.get_param('ENDPOINT_JOURNAL_SIZE', 4096))
+        self._ep_lock = threading.Lock()
         self._update_endpoints_map()
 
+        # Rediscovers interfaces / namespaces as they change.
+        self._watcher = None
+        if is_linux() and config.get_param('NETWORK_WATCHER', True):
+            self._watcher = NetworkWatcher(self._on_network_change)
+            self._watcher.start()
+
         self._client_mgr = ClientManager(self._recore_queue)
         self._server_mgr = ServerManager()
 
@@ -69,28 +90,55 @@ class TrafficControllerApp(BaseApp):
         return self.traffic_tools[trule.tool]
 
     def _update_endpoints_map(self):
-        self._ep_map = {}
+        # Built aside and replaced at once as rules keep looking it up.
+        ep_map = {}
+        endpoints = set()
 
         # Update Interfaces on this host
         host_target = core.VMHost(name=get_host_name(),
                                   ip=self.host)
 
         # To support local traffic.
-        self._ep_map['127.0.0.1'] = host_target
-        self._ep_map['::1'] = host_target
+        ep_map['127.0.0.1'] = host_target
+        ep_map['::1'] = host_target
 
         for ifname in self._if_mgr.get_all_interfaces():
             if not any([ifname.startswith(x) for x in NAMESPACE_INTERFACE_NAME_PREFIXES]):
                 continue
             ips = self._if_mgr.get_ips_by_interface(ifname)
             for ip in ips:
-                self._ep_map[ip] = host_target
+                ep_map[ip] = host_target
+            endpoints.update(ips)
 
         # Update Namespaces on this host.
         for ns_name, ns_interfaces in self._ns_mgr.get_namespace_interface_map().items():
             ns_target = core.NSHost(name=ns_name, ip=self.host)
             for interface in ns_interfaces:
-                self._ep_map[interface.address] = ns_target
+                ep_map[interface.address] = ns_target
+        endpoints.update(self._ns_mgr.get_all_namespaces_ips())
+
+        self._ep_map = ep_map
+        self._record_endpoints(endpoints)
+
+    def _record_endpoints(self, endpoints):
+        """ Journals endpoints added / removed since last update. """
+        with self._ep_lock:
+            changes = [('add', ip) for ip in endpoints - self._endpoints]
+            changes += [('remove', ip) for ip in self._endpoints - endpoints]
+            for op, ip in changes:
+                self._ep_seq += 1
+                self._ep_journal.append((self._ep_seq, op, ip))
+            self._endpoints = endpoints
+        if changes:
+            log.info("Endpoints changed : %s", changes)
+
+    def _on_network_change(self, host, namespaces):
+        """ Rediscovers what network watcher reported changed. """
+        if host:
+            self._if_mgr.discover_interfaces()
+        if namespaces:
+            self._ns_mgr.update_namespaces(namespaces)
+        self._update_endpoints_map()
 
     def discover_interfaces(self):
         """ Re/Discovers insterfaces """
@@ -98,7 +146,28 @@ class TrafficControllerApp(BaseApp):
         self._ns_mgr.discover_namespaces()
         self._update_endpoints_map()
 
-    def _add_rule_info(self, trule):
+    def get_endpoint_changes(self, since=0):
+        """
+        Returns (pickled) (seq, changes, full) where changes are [(op, ip)]
+        (op as 'add' / 'remove') of endpoints since journal sequence
+        'since'. If 'since' is 0 or too old to be in journal, changes are
+        all the current endpoints (as 'add') and full is True.
+        """
+        with self._ep_lock:
+            seq = self._ep_seq
+            oldest = self._ep_journal[0][0] if self._ep_journal else seq + 1
+            if since and oldest - 1 <= since <= seq:
+                changes = [(op, ip) for _seq, op, ip in self._ep_journal
+                           if _seq > since]
+                return pickle.dumps((seq, changes, False))
+            changes = [('add', ip) for ip in sorted(self._endpoints)]
+        return pickle.dumps((seq, changes, True))
+
+    def _add_rule_info(self, trule, ramp=False):
+        """
+        Adds traffic tasks of rule on this host. ramp is True if rule is
+        one of many added together, so that start of clients is spread.
+        """
         trule.src_target = self._ep_map.get(trule.src)
         trule.dst_target = self._ep_map.get(trule.dst)
         trule.src_host = self.host if trule.src_target else None
@@ -125,17 +194,20 @@ class TrafficControllerApp(BaseApp):
 
             # Add client on this host if needed.
             if trule.src_host:
-                self._client_mgr.add_task(trule)
+                self._client_mgr.add_task(trule, ramp)
 
-    def _get_traffic_rule(self, rule):
+    def _get_traffic_rule(self, rule, ramp=False):
         """ Rule config. """
         log.info("Processing rule : %s", rule)
         trule = core.TrafficRule()
 
         for key, val in rule.items():
+            if key not in trule.SCHEMA:
+                log.warning("Ignoring unknown field %s of rule", key)
+                continue
             setattr(trule, key, val)
 
-        self._add_rule_info(trule)
+        self._add_rule_info(trule, ramp)
         return trule
 
     def register_traffic(self, traffic_rules=None):
@@ -147,9 +219,10 @@ class TrafficControllerApp(BaseApp):
             pass    # unpickled data.
         log.info("Registering Traffic : %r", traffic_rules)
         _trules = []
+        ramp = len(traffic_rules) > 1
         for rule in traffic_rules:
             # create a rule and add it to database.
-            trule = self._get_traffic_rule(rule)
+            trule = self._get_traffic_rule(rule, ramp)
             _trules.append(trule)
 
         self.rules.add_rules(_trules)
@@ -202,45 +275,101 @@ class TrafficControllerApp(BaseApp):
             self._client_mgr.stop(trule)
             # Disable the trule
             self.rules.disable(ruleid)
-            # Servers are not stopped as other traffic rules still might
-            # need them. TODO : Do reference counting.
+            # Servers are kept running on stop. Server of a rule is
+            # released once it is unregistered and stopped when no
+            # other rule uses it (see ServerManager.remove_task).
+
+    def _split_rules(self, ruleids, enabled):
+        """
+        Returns (internal rules, other ruleids) of rules. Rules which are
+        external, unknown or already in 'enabled' state are left to be
+        handled one by one.
+        """
+        trules, others = [], []
+        for ruleid in ruleids:
+            trule = self.rules.rules.get(ruleid, None)
+            if not trule or trule.external or trule.enabled == enabled:
+                others.append(ruleid)
+            else:
+                trules.append(trule)
+        return trules, others
+
+    @staticmethod
+    def _log_report(op, report, expected):
+        failed = {k: v for k, v in report.items() if v not in expected}
+        if failed:
+            log.error("Unable to %s traffic for : %s", op, failed)
 
     def start(self, rules):
         if not isinstance(rules, list):
             rules = [rules]
-        args = [(ruleid, (ruleid,), {}) for ruleid in rules]
+        trules, others = self._split_rules(rules, enabled=True)
+        for trule in trules:
+            self.rules.enable(trule.ruleid)
+        # Clients are started together, rest one by one.
+        report = self._client_mgr.start_many(
+            [x for x in trules if getattr(x, 'src_host', None)])
+        self._log_report('start', report,
+                         (task.TrafficTask.STARTED, task.TrafficTask.RUNNING))
+        args = [(ruleid, (ruleid,), {}) for ruleid in others]
         parallel.ThreadPool(self._start, args)
 
     def stop(self, rules, blocking=True):
         if not isinstance(rules, list):
             rules = [rules]
-        args = [(ruleid, (ruleid,), {}) for ruleid in rules]
-        if blocking:
-            parallel.ThreadPool(self._stop, args)
-        else:
-            # NOTE : Pre-mature exit can lead to zombie threads and can cause
-            # eventual degradation of resources at endpoints. For this reason
-            # stop and other operations are blocking.
-            parallel.ThreadPool(self._stop, args)
+        # NOTE : Pre-mature exit can lead to zombie threads and can cause
+        # eventual degradation of resources at endpoints. For this reason
+        # stop and other operations are blocking.
+        trules, others = self._split_rules(rules, enabled=False)
+        # Clients are signalled together and waited for within one
+        # deadline, rather than one after other.
+        report = self._client_mgr.stop_many(
+            [x for x in trules if getattr(x, 'src_host', None)])
+        self._log_report('stop', report, (task.TrafficTask.DONE,))
+        for trule in trules:
+            self.rules.disable(trule.ruleid)
+        args = [(ruleid, (ruleid,), {}) for ruleid in others]
+        parallel.ThreadPool(self._stop, args)
+
+    def _remove_server(self, ruleid):
+        """ Releases server of a rule, if run on this host. """
+        trule = self.rules.rules.get(ruleid, None)
+        if not trule or trule.external or not trule.dst_host or \
+                not getattr(trule, 'dst_target', None):
+            return
+        self._server_mgr.remove_task(trule)
 
     def unregister_traffic(self, rules):
         """ Stop traffic and delete rules from db"""
         if not isinstance(rules, list):
             rules = [rules]
         self.stop(rules)
+        for ruleid in rules:
+            self._remove_server(ruleid)
         self.rules.delete_rules(rules)
 
+    def get_server_counters(self, rules=None):
+        """
+        Returns (pickled) counters of traffic servers on this host, or of
+        the ones serving the rules, if provided. e.g. to know if server
+        saw the requests of a failing rule at all.
+        """
+        if rules and not isinstance(rules, list):
+            rules = [rules]
+        return pickle.dumps(self._server_mgr.get_counters(rules))
+
     def _resume_active_rules(self):
-        active_rules = [rule for ruleid, rule in self.rules.rules.items()
-                        if rule.state == self.rules.ACTIVE]
+        active_rules = self.rules.get_rules(state=self.rules.ACTIVE)
         log.info("Restarting traffic on rules : %s",
                  ','.join([x.ruleid for x in active_rules]))
 
         # Starting all ACTIVE rules
         for trule in active_rules:
-            self._add_rule_info(trule)
+            self._add_rule_info(trule, ramp=True)
 
     def close(self):
+        if self._watcher:
+            self._watcher.stop()
         self._client_mgr.close()
         self._server_mgr.close()
         fdcloseall()  # Closes all the namespace related file descriptors
@@ -87,6 +87,15 @@ class NamespaceConstants(Constants):
     # Namespace Configs
     NAMESPACE_DIR = '/var/run/netns'
     NAMESPACE_INTERFACE_NAME_PREFIXES = ["nsx-vtep", "veth", "eth", "vmk"]
+    # Namespaces whose interfaces are discovered in parallel.
+    NAMESPACE_DISCOVERY_WORKERS = int(os.environ.get('NAMESPACE_DISCOVERY_WORKERS', 8))
+
+    # Watch (linux) interfaces / namespaces for changes and rediscover only
+    # what changed. Changes within debounce (seconds) are handled together.
+    NETWORK_WATCHER = os.environ.get('NETWORK_WATCHER', True)
+    NETWORK_WATCH_DEBOUNCE = float(os.environ.get('NETWORK_WATCH_DEBOUNCE', 0.05))
+    # Endpoint changes kept for incremental sync (by primary).
+    ENDPOINT_JOURNAL_SIZE = int(os.environ.get('ENDPOINT_JOURNAL_SIZE', 4096))
 
 
 class TrafficConstants(Constants):
@@ -101,6 +110,53 @@ class TrafficConstants(Constants):
     # offsetting of clock synchronization issue (to some extent).
     TRAFFIC_STATS_QUERY_LATENCY = int(os.environ.get('TRAFFIC_STATS_QUERY_LATENCY', 15))
 
+    # Stream like traffic (e.g. UDP probe stream) reports aggregated stats
+    # once every these many seconds (or rule interval, if larger).
+    TRAFFIC_STATS_REPORT_INTERVAL = int(os.environ.get('TRAFFIC_STATS_REPORT_INTERVAL', 1))
+
+    # Pings of a rule are fired on schedule without waiting for earlier
+    # ones to finish. Upto these many pings of a rule can be outstanding.
+    TRAFFIC_MAX_INFLIGHT_PINGS = int(os.environ.get('TRAFFIC_MAX_INFLIGHT_PINGS', 64))
+
+    # Server clock offset (for one way delays) is estimated from these many
+    # recent timestamped replies. 0 if clocks are synchronized (e.g. PTP).
+    TRAFFIC_CLOCK_OFFSET_WINDOW = int(os.environ.get('TRAFFIC_CLOCK_OFFSET_WINDOW', 16))
+
+    # Size of (reused) buffer from which throughput traffic is sent.
+    TRAFFIC_THROUGHPUT_BUFFER_SIZE = int(os.environ.get('TRAFFIC_THROUGHPUT_BUFFER_SIZE',
+                                                        256 * 1024))
+
+    # Listen backlog of traffic (TCP) servers.
+    TRAFFIC_SERVER_BACKLOG = int(os.environ.get('TRAFFIC_SERVER_BACKLOG', 1024))
+
+    # Processes serving a traffic server port (SO_REUSEPORT), unless
+    # specified in rule.
+    TRAFFIC_SERVER_WORKERS = int(os.environ.get('TRAFFIC_SERVER_WORKERS', 1))
+
+    # Processes running traffic clients, rules sharded among them by
+    # ruleid. 1 to run them in service process itself.
+    TRAFFIC_CLIENT_WORKERS = int(os.environ.get('TRAFFIC_CLIENT_WORKERS', 1))
+
+    # Traffic servers count requests per source IP for upto these many
+    # sources. Rest are counted together.
+    TRAFFIC_SERVER_MAX_SOURCES = int(os.environ.get('TRAFFIC_SERVER_MAX_SOURCES', 1024))
+
+    # UDP servers read upto these many datagrams per readiness event.
+    TRAFFIC_UDP_RECV_BATCH = int(os.environ.get('TRAFFIC_UDP_RECV_BATCH', 64))
+    # Socket buffer sizes (bytes) of UDP servers. 0 for system default.
+    TRAFFIC_UDP_RCVBUF = int(os.environ.get('TRAFFIC_UDP_RCVBUF', 4 * 1024 * 1024))
+    TRAFFIC_UDP_SNDBUF = int(os.environ.get('TRAFFIC_UDP_SNDBUF', 4 * 1024 * 1024))
+
+    # Largest body HTTP servers send for a /bytes/<n> request.
+    TRAFFIC_HTTP_MAX_RESPONSE_SIZE = int(os.environ.get('TRAFFIC_HTTP_MAX_RESPONSE_SIZE',
+                                                        1024 * 1024 * 1024))
+
+    # Traffic clients are not started all at once. Start of each one is
+    # delayed randomly within ramp window (seconds) and not more than
+    # these many are started in a second.
+    TRAFFIC_START_RAMP_WINDOW = float(os.environ.get('TRAFFIC_START_RAMP_WINDOW', 2))
+    TRAFFIC_MAX_STARTS_PER_SEC = int(os.environ.get('TRAFFIC_MAX_STARTS_PER_SEC', 1000))
+
 
 class RecorderConstants(Constants):
     _NAME = "Data Recording"
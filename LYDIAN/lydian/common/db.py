@@ -4,10 +4,36 @@
 # The full license information can be found in LICENSE.txt
 # in the root directory of this project.
 
+import logging
+
 from sql30 import db
 
 from lydian.apps import config
 
+log = logging.getLogger(__name__)
+
+
+def add_missing_columns(model, schema):
+    """
+    Adds columns of table schema which are missing in its table, as
+    created by an older version, to database of model. Returns list of
+    columns added.
+    """
+    tbl = schema['name']
+    model.cursor.execute('PRAGMA table_info(%s)' % tbl)
+    columns = [x[1] for x in model.cursor.fetchall()]
+    added = [x for x in schema['fields'] if x not in columns]
+    for column in added:
+        model.cursor.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                             (tbl, column, schema['fields'][column]))
+        log.info("Added column %s to table %s", column, tbl)
+    if added:
+        model.commit()
+    # Added columns are at the end. Writes (by position) must follow table.
+    schema['col_order'] = [x for x in columns if x in schema['fields']] + \
+        added
+    return added
+
 
 class LydianDB(db.Model):
 
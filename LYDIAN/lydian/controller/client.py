@@ -301,6 +301,12 @@ class TrafficControllerManager(Manager):
     def discover_interfaces(self):
         self._client.controller.discover_interfaces()
 
+    def get_server_counters(self, rules=None):
+        return pickle.loads(self._client.controller.get_server_counters(rules))
+
+    def get_endpoint_changes(self, since=0):
+        return pickle.loads(self._client.controller.get_endpoint_changes(since))
+
 
 class MockTrafficManager(Manager):
 
@@ -4,19 +4,117 @@
 # The full license information can be found in LICENSE.txt
 # in the root directory of this project.
 
+import asyncio
+import collections
+import errno
 import json
 import logging
+import math
 import socket
+import struct
 import time
 
 from urllib.request import urlopen
 
-from lydian.traffic.connection import Connection
-from lydian.utils.common import is_ipv6_address, is_py3
+from lydian.apps import config
+from lydian.traffic.connection import Connection, time_ns
+from lydian.utils.common import is_ipv6_address, is_py3, parse_size
 
 log = logging.getLogger(__name__)
 
-LATENCY_RESOLUTION = 1000   # Save Latency in milliseconds.
+NS_PER_MS = 1000000
+
+# time.perf_counter_ns is available only on python 3.7+
+perf_counter_ns = getattr(time, 'perf_counter_ns', None) or \
+    (lambda: int(time.perf_counter() * 1000000000))
+
+
+class PingTimer(object):
+
+    def __init__(self):
+        """
+        Captures phases of a ping on monotonic (perf counter) clock in
+        nanoseconds. Phases are connect (handshake), time to first byte
+        (from request sent till first byte of reply) and total time.
+        """
+        self.start = perf_counter_ns()
+        self.connected = None
+        self.sent = None
+        self.first_byte = None
+        self.end = None
+        self.one_way = {}   # One way delays, if server timestamped reply.
+
+    def mark_connected(self):
+        self.connected = perf_counter_ns()
+
+    def mark_sent(self):
+        self.sent = perf_counter_ns()
+
+    def mark_first_byte(self):
+        if self.first_byte is None:
+            self.first_byte = perf_counter_ns()
+
+    def stop(self):
+        self.end = perf_counter_ns()
+
+    @staticmethod
+    def _ms(start, end):
+        if start is None or end is None:
+            return None
+        return round((end - start) / NS_PER_MS, 3)
+
+    @property
+    def latency(self):
+        """ Total time (ms), as reported in latency. """
+        return round((self.end - self.start) / NS_PER_MS, 2)
+
+    @property
+    def rtt(self):
+        """ Time (ms) from connection established (if any) till end. """
+        return round((self.end - (self.connected or self.start)) /
+                     NS_PER_MS, 2)
+
+    def as_record(self):
+        record = {
+            'connect_time': self._ms(self.start, self.connected),
+            'ttfb': self._ms(self.sent, self.first_byte),
+            'total_time': self._ms(self.start, self.end)
+            }
+        record.update(self.one_way)
+        return record
+
+
+class ClockOffset(object):
+
+    def __init__(self):
+        """
+        Running estimate of server clock offset from client clock, as in
+        NTP : offset = ((t2 - t1) + (t3 - t4)) / 2 where t1 / t4 are client
+        send / receive times and t2 / t3 are server receive / send times.
+        It is exact only for a symmetric path, so offset of the sample with
+        the least round trip delay in recent window is used.
+
+        With no window (TRAFFIC_CLOCK_OFFSET_WINDOW 0) clocks are taken as
+        synchronized (e.g. by PTP) and offset is 0. Then, and only then,
+        a constant asymmetry of path shows up in one way delays.
+        """
+        window = config.get_param('TRAFFIC_CLOCK_OFFSET_WINDOW', 16)
+        self._samples = collections.deque(maxlen=window) if window else None
+        self.offset = 0     # in nanoseconds.
+
+    def one_way(self, t1, t2, t3, t4):
+        """ Returns one way delays (ms) of an exchange (times in ns). """
+        if self._samples is not None:
+            self._samples.append(((t4 - t1) - (t3 - t2),
+                                  ((t2 - t1) + (t3 - t4)) / 2))
+            self.offset = min(self._samples)[1]
+        return {
+            'forward_delay': round((t2 - t1 - self.offset) / NS_PER_MS, 3),
+            'reverse_delay': round((t4 - t3 + self.offset) / NS_PER_MS, 3),
+            'server_time': round((t3 - t2) / NS_PER_MS, 3),
+            'clock_offset': round(self.offset / NS_PER_MS, 3)
+            }
+
 
 class PingValidationError(Exception):
     pass
@@ -26,12 +124,14 @@ class Client(Connection):
 
     CONNECTION_TIMEOUT = 1.8
     FREQUENCY = 30       # 30 pings per minute.
+    MAX_FREQUENCY = 60000   # 1000 pings per second.
     PAYLOAD = 'Rampur!!'
     PING_INTERVAL = 2   # default request rate is 30ppm
 
     def __init__(self, server, port, verbose=False, handler=None,
                  interval=None, ipv6=None, payload=None, tries=None,
-                 sockettimeout=None, frequency=30, attempts=None):
+                 sockettimeout=None, frequency=30, attempts=None,
+                 persistent=None, timestamps=None):
         """
         A simple TCP client which binds to a specified host and port.
         """
@@ -45,21 +145,28 @@ class Client(Connection):
         self._tries = tries or None
         self._sockettimeout = sockettimeout or self.CONNECTION_TIMEOUT
         self.attempts = attempts or 1
+        # Keep a connection open across pings (where protocol allows).
+        self.persistent = str(persistent).lower() in ('1', 'true')
+        # Ask server to timestamp replies, for one way delays.
+        self.timestamps = str(timestamps).lower() in ('1', 'true')
+        self._clock = ClockOffset()
 
         # Set frequency
         try:
             assert isinstance(frequency, int)
-            assert 1 <= frequency <= 60, "Invalid frequency"
+            assert 1 <= frequency <= self.MAX_FREQUENCY, "Invalid frequency"
             self._frequency = frequency or 30
         except Exception as err:
             self._frequency = self.FREQUENCY
             log.error("Invalid frequency %s, ignored. Default 30 shall be"
                       " used.", frequency)
 
-        # Set ping interval. Takes precedence over frequency.
+        # Set ping interval (seconds, can be fractional). Takes precedence
+        # over frequency.
         try:
-            self.interval = int(interval)
-        except (ValueError, TypeError) as err:
+            self.interval = float(interval)
+            assert self.interval >= 0, "Invalid interval"
+        except (AssertionError, ValueError, TypeError) as err:
             _ = err
             self.interval = 60 / self.frequency
 
@@ -85,9 +192,21 @@ class Client(Connection):
         """ Number of pings per minute (PPM). Default is 30"""
         return self._frequency
 
+    @property
+    def serial(self):
+        """ True if a ping must not overlap with the previous one. """
+        return False
+
+    @property
+    def max_inflight(self):
+        """ Number of pings which can be outstanding at a time. """
+        if self.serial or not self.interval:
+            return 1
+        return config.get_param('TRAFFIC_MAX_INFLIGHT_PINGS', 64)
+
     ping_count = tries
 
-    def echo_validator(self, payload, data, latency, error=None):
+    def echo_validator(self, payload, data, latency, error=None, **stats):
         """
         Ping Validator
         """
@@ -98,22 +217,52 @@ class Client(Connection):
             _ = error
             raise PingValidationError()
 
-    def recv_all(self):
+    def recv_all(self, timer=None):
         fragments = []
         while True:
             chunk = self.socket.recv(self.MAX_PAYLOAD_SIZE)
+            if timer:
+                timer.mark_first_byte()
             if not chunk:
                 break
             fragments.append(chunk)
         return b''.join(fragments)
 
-    def start(self, payload=None, tries=None):
-        if not self.stopped():
-            log.info("Traffic client alredy running for server - %s:%s",
-                     self.server, self.port)
-            return
-        self.clear_event()
-        payload = payload or self.payload
+    async def arecv_exactly(self, sock, size, timer=None):
+        loop = asyncio.get_event_loop()
+        data = bytearray()
+        while len(data) < size:
+            chunk = await self._await(loop.sock_recv(sock, size - len(data)))
+            if timer:
+                timer.mark_first_byte()
+            if not chunk:
+                raise ConnectionResetError("Connection closed by server")
+            data.extend(chunk)
+        return bytes(data)
+
+    async def arecv_all(self, sock, timer=None):
+        loop = asyncio.get_event_loop()
+        fragments = []
+        while True:
+            chunk = await self._await(loop.sock_recv(sock,
+                                                     self.MAX_PAYLOAD_SIZE))
+            if timer:
+                timer.mark_first_byte()
+            if not chunk:
+                break
+            fragments.append(chunk)
+        return b''.join(fragments)
+
+    def _await(self, coro):
+        """ Bounds an awaitable socket operation with socket timeout. """
+        return asyncio.wait_for(coro, self.sockettimeout)
+
+    def _error(self, err):
+        if isinstance(err, asyncio.TimeoutError):
+            return 'timed out'     # same as socket.timeout
+        return '%s' % err
+
+    def _get_tries(self, tries):
         tries = tries or self.tries
         try:
             tries = int(tries) if tries is not None else None
@@ -122,7 +271,20 @@ class Client(Connection):
                 log.error("tries %s is invalid. Client will run forever."
                           " Error: %s", tries, err)
             tries = None
+        return tries
+
+    def start(self, payload=None, tries=None):
+        if not self.stopped():
+            log.info("Traffic client alredy running for server - %s:%s",
+                     self.server, self.port)
+            return
+        self.clear_event()
+        payload = payload or self.payload
+        tries = self._get_tries(tries)
 
+        # Pings are sent at fixed deadlines (start + n * interval) so that
+        # latency of a ping doesn't shift the next one.
+        deadline = time.monotonic()
         while not self.is_event_set():
             if tries is not None:
                 if not tries:
@@ -131,38 +293,277 @@ class Client(Connection):
                     tries -= 1
             self.ping(payload)
             if self.interval:
-                time.sleep(self.interval)
+                deadline += self.interval
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    async def arun(self, payload=None, tries=None):
+        """
+        Coroutine counterpart of start(). It is run by a TrafficEngine
+        alongwith clients of other rules.
+
+        Pings are fired at absolute deadlines (start + n * interval) on
+        the event loop timer, without waiting for earlier pings to
+        finish, so rate doesn't drift with latency or timeouts. How late
+        each ping was sent is reported as send_delay. With 0 interval,
+        pings are sent back to back (max_inflight at a time).
+
+        Stop event must be cleared by caller before scheduling it.
+        """
+        payload = payload or self.payload
+        tries = self._get_tries(tries)
+
+        loop = asyncio.get_event_loop()
+        max_inflight = self.max_inflight
+        inflight = set()
+        deadline = loop.time()
+        try:
+            while not self.is_event_set():
+                if tries is not None:
+                    if not tries:
+                        break
+                    else:
+                        tries -= 1
+                stats = {}
+                if self.interval:
+                    delay = deadline - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if len(inflight) >= max_inflight:
+                    # Too many pings outstanding. Send is delayed (and
+                    # reported so) until one of them is done.
+                    done, _ = await asyncio.wait(
+                        inflight, return_when=asyncio.FIRST_COMPLETED)
+                    inflight.difference_update(done)
+                if self.interval:
+                    stats['send_delay'] = round(
+                        (loop.time() - deadline) * 1000, 3)
+                    deadline += self.interval
+                ping = asyncio.ensure_future(self.aping(payload, **stats))
+                inflight.add(ping)
+                ping.add_done_callback(inflight.discard)
+            if inflight:
+                await asyncio.wait(inflight)
+            if not self.is_event_set():
+                await self._adrain()    # Ran out of tries.
+        finally:
+            for ping in inflight:
+                ping.cancel()
+            self._release()
+            self.set_event()
+
+    def _release(self):
+        """ Releases resources held across pings. """
+        pass
+
+    async def _adrain(self):
+        """
+        Waits for replies still due once all the pings are sent (e.g. of
+        a probe stream), upto socket timeout. Not waited for on stop.
+        """
+        pass
+
+    @property
+    def report_window(self):
+        """ Seconds over which stream like traffic is reported. """
+        return max(self.interval or 0,
+                   config.get_param('TRAFFIC_STATS_REPORT_INTERVAL', 1))
+
+    async def _areport(self, report):
+        """ Calls report once every report window. """
+        while True:
+            await asyncio.sleep(self.report_window)
+            report()
 
     def ping(self, payload):
         raise NotImplementedError("Ping not implemented in %s" %
                                   self.__class__.__name__)
 
+    async def aping(self, payload, **stats):
+        raise NotImplementedError("Async ping not implemented in %s" %
+                                  self.__class__.__name__)
+
     def _prepare_payload(self, payload):
         return payload.encode('utf-8') if is_py3() else payload
 
+    def _add_timestamps(self, payload):
+        """ Returns request asking server to timestamp reply, if enabled. """
+        return self.TS_MAGIC + payload if self.timestamps else payload
+
+    def _strip_timestamps(self, data):
+        """
+        Returns reply without server timestamps and the timestamps
+        (receive, send), if any.
+        """
+        size = len(self.TS_MAGIC) + self.TS_TRAILER.size
+        if not self.timestamps or not isinstance(data, bytes) or \
+                len(data) < size or not data.startswith(self.TS_MAGIC):
+            return data, None
+        stamps = self.TS_TRAILER.unpack(data[-self.TS_TRAILER.size:])
+        return data[len(self.TS_MAGIC):-self.TS_TRAILER.size], stamps
+
+    def _one_way(self, sent, received, stamps):
+        """
+        Returns one way delays for request sent and reply received at
+        (perf counter ns) times, given server timestamps.
+        """
+        if not stamps or sent is None or received is None:
+            return {}
+        wall = time_ns() - perf_counter_ns()    # perf counter to wall clock
+        return self._clock.one_way(sent + wall, stamps[0], stamps[1],
+                                   received + wall)
+
+    def _read_timestamps(self, data, timer):
+        """ Returns reply without timestamps and one way delays. """
+        data, stamps = self._strip_timestamps(data)
+        return data, self._one_way(timer.sent, timer.first_byte, stamps)
+
+
+class ConnectionStats(object):
+
+    def __init__(self):
+        """
+        Statistics of connections opened (e.g. in a CPS storm) over a
+        report window.
+        """
+        self.reset()
+
+    def reset(self):
+        self.started = perf_counter_ns()
+        self.sent = 0           # connections attempted
+        self.received = 0       # connections which completed exchange
+        self.failures = collections.Counter()   # errno name : count
+        self.latencies = []     # in ms.
+        self.send_delay = None  # max delay (ms) of a connection behind schedule.
+
+    def add(self, latency=None, failure=None):
+        if failure:
+            self.failures[failure] += 1
+        else:
+            self.received += 1
+            self.latencies.append(latency)
+
+    def update_send_delay(self, send_delay):
+        if send_delay is not None:
+            self.send_delay = max(self.send_delay or 0, send_delay)
+
+    @staticmethod
+    def percentile(values, pct):
+        """ Nearest rank percentile of sorted values. """
+        index = int(math.ceil(pct / 100.0 * len(values))) - 1
+        return values[max(index, 0)]
+
+    @property
+    def failed(self):
+        return sum(self.failures.values())
+
+    @property
+    def latency(self):
+        """ Average latency (ms) of connections in the window. """
+        if not self.latencies:
+            return 0
+        return round(sum(self.latencies) / len(self.latencies), 2)
+
+    def as_record(self):
+        elapsed = (perf_counter_ns() - self.started) / 1e9
+        record = {
+            'sent': self.sent,
+            'received': self.received,
+            'cps': round(self.received / elapsed, 2) if elapsed else None,
+            'failures': json.dumps(dict(self.failures)) if self.failures
+                        else None,
+            'send_delay': self.send_delay
+            }
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            record['latency_p50'] = self.percentile(latencies, 50)
+            record['latency_p90'] = self.percentile(latencies, 90)
+            record['latency_p99'] = self.percentile(latencies, 99)
+            record['latency_max'] = latencies[-1]
+        return record
+
 
 class TCPClient(Client):
 
-    def _create_socket(self):
+    THROUGHPUT = 'throughput'
+    THROUGHPUT_SIZE = 1024 * 1024   # Bytes streamed when not specified.
+    CPS = 'cps'
+
+    def __init__(self, *args, mode=None, packet=None, duration=None,
+                 concurrency=None, cps=None, **kwargs):
         """
-        Returns a simple TCP server socket.
+        mode 'throughput' streams packet bytes (e.g. '10M') or streams for
+        duration seconds, whichever is specified (or ends first), to a
+        sink server in every ping.
+
+        mode 'cps' opens new connections at cps connections per second
+        (as fast as possible if not set) with upto concurrency of them in
+        flight. Connections are reported once every report window.
+        """
+        super(TCPClient, self).__init__(*args, **kwargs)
+        self._conn = None           # Persistent connection.
+        self._conn_lock = None      # Serializes pings on persistent connection.
+
+        self.mode = (mode or '').lower() or None
+        self.duration = float(duration) if duration else None
+        try:
+            self.packet = parse_size(packet) if packet else None
+        except ValueError as err:
+            log.error("Invalid packet size %s, ignored : %r", packet, err)
+            self.packet = None
+        if self.mode == self.THROUGHPUT and not (self.packet or
+                                                 self.duration):
+            self.packet = self.THROUGHPUT_SIZE
+        self._bulk_buffer = None
+
+        self.concurrency = int(concurrency or 1)
+        if self.mode == self.CPS:
+            # Rate is set by cps. Interval of rule, if any, is ignored.
+            self.interval = 1.0 / float(cps) if cps else 0
+        self._storm = ConnectionStats()
+        self._storm_payload = None
+        self._reporter = None
+
+    @property
+    def serial(self):
+        # Throughput streams of a rule are not run in parallel.
+        return self.mode == self.THROUGHPUT
+
+    @property
+    def max_inflight(self):
+        if self.mode == self.CPS:
+            return self.concurrency
+        return super(TCPClient, self).max_inflight
+
+    def _new_socket(self):
+        """
+        Returns a simple TCP client socket.
         """
         sock_type = socket.AF_INET6 if self.ipv6 else socket.AF_INET
-        self.socket = socket.socket(sock_type, socket.SOCK_STREAM)
-        self.socket.settimeout(self.sockettimeout)
+        sock = socket.socket(sock_type, socket.SOCK_STREAM)
+        sock.settimeout(self.sockettimeout)
+        return sock
+
+    def _create_socket(self):
+        self.socket = self._new_socket()
 
     def send_and_recv(self, payload, recv_method):
         attempts = self.attempts
-        data, latency, error = None, 0, None
+        data, latency, error, phases = None, 0, None, {}
         while attempts:
+            timer = None
             try:
                 attempts -= 1
                 self._create_socket()
-                start_time = time.time()
+                timer = PingTimer()
                 self.socket.connect((self.server, self.port))
+                timer.mark_connected()
                 self.socket.send(payload)
-                data = recv_method()
-                latency = round((time.time() - start_time) * LATENCY_RESOLUTION, 2)
+                timer.mark_sent()
+                data = recv_method(timer=timer)
+                timer.stop()
+                latency = timer.latency
                 if self.verbose:
                     msg = "Ping to %s:%s PASS. Payload / data - %s/%s" % (
                            self.server, self.port, payload, data)
@@ -181,47 +582,429 @@ class TCPClient(Client):
             finally:
                 # close socket connection
                 self.socket_close()
+                if timer:
+                    timer.end = timer.end or perf_counter_ns()
+                    phases = timer.as_record()
 
-        return data, latency, error
+        return data, latency, error, phases
+
+    async def asend_and_recv(self, payload, recv_method):
+        """
+        Coroutine counterpart of send_and_recv(). Socket is local to the
+        call (and not self.socket) as pings of a client may overlap.
+        """
+        loop = asyncio.get_event_loop()
+        attempts = self.attempts
+        data, latency, error, phases = None, 0, None, {}
+        while attempts:
+            sock, timer = None, None
+            try:
+                attempts -= 1
+                sock = self._new_socket()
+                sock.setblocking(False)
+                timer = PingTimer()
+                await self._await(loop.sock_connect(sock,
+                                                    (self.server, self.port)))
+                timer.mark_connected()
+                await self._await(loop.sock_sendall(sock, payload))
+                timer.mark_sent()
+                data = await recv_method(sock, timer=timer)
+                timer.stop()
+                data, timer.one_way = self._read_timestamps(data, timer)
+                latency = timer.latency
+                if self.verbose:
+                    msg = "Ping to %s:%s PASS. Payload / data - %s/%s" % (
+                           self.server, self.port, payload, data)
+                    log.info(msg)
+                break   # finally is still executed.
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                error = self._error(err)
+                if self.verbose:
+                    msg = ("Ping to %s:%s FAIL. Payload / data - %s/%s ."
+                           " ERROR - %s") % (
+                           self.server, self.port, payload, data, error)
+                    log.info(msg)
+                    if attempts:
+                        count = self.attempts - attempts + 1
+                        log.debug('Retrying attempt %s/%s', count, self.attempts)
+            finally:
+                if sock:
+                    sock.close()
+                if timer:
+                    timer.end = timer.end or perf_counter_ns()
+                    phases = timer.as_record()
+
+        return data, latency, error, phases
+
+    def _release(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+        if self._reporter:
+            self._reporter.cancel()
+            self._reporter = None
+            self._report_storm()    # Report last (partial) window.
+
+    async def _aconnect(self):
+        """ Opens persistent connection to server. """
+        loop = asyncio.get_event_loop()
+        sock = self._new_socket()
+        sock.setblocking(False)
+        try:
+            await self._await(loop.sock_connect(sock, (self.server, self.port)))
+        except BaseException:
+            sock.close()
+            raise
+        self._conn = sock
+
+    async def arecv_frame(self, sock, timer=None):
+        header = await self.arecv_exactly(sock, self.FRAME_HEADER.size,
+                                          timer=timer)
+        return await self.arecv_exactly(sock, self.frame_length(header))
+
+    async def asend_and_recv_persistent(self, payload, recv_method):
+        """
+        Sends payload over persistent connection and reads the reply with
+        recv_method. Connection is (re)opened only when needed, so latency
+        is the round trip time of the payload alone. Connect time is
+        reported only by the ping which (re)opened the connection.
+        """
+        loop = asyncio.get_event_loop()
+        if self._conn_lock is None:
+            self._conn_lock = asyncio.Lock()
+        attempts = self.attempts
+        data, latency, error, phases = None, 0, None, {}
+        while attempts:
+            timer = None
+            try:
+                attempts -= 1
+                async with self._conn_lock:
+                    timer = PingTimer()
+                    if not self._conn:
+                        await self._aconnect()
+                        timer.mark_connected()
+                    await self._await(loop.sock_sendall(self._conn, payload))
+                    timer.mark_sent()
+                    data = await recv_method(self._conn, timer=timer)
+                    timer.stop()
+                    data, timer.one_way = self._read_timestamps(data, timer)
+                    latency = timer.rtt
+                if self.verbose:
+                    msg = "Ping to %s:%s PASS. Payload / data - %s/%s" % (
+                           self.server, self.port, payload, data)
+                    log.info(msg)
+                break
+            except asyncio.CancelledError:
+                self._release()
+                raise
+            except Exception as err:
+                # Connection state is unknown. Reconnect on next ping.
+                self._release()
+                data, error = None, self._error(err)
+                if self.verbose:
+                    msg = ("Ping to %s:%s FAIL. Payload / data - %s/%s ."
+                           " ERROR - %s") % (
+                           self.server, self.port, payload, data, error)
+                    log.info(msg)
+                    if attempts:
+                        count = self.attempts - attempts + 1
+                        log.debug('Retrying attempt %s/%s', count, self.attempts)
+            finally:
+                if timer:
+                    timer.end = timer.end or perf_counter_ns()
+                    phases = timer.as_record()
+
+        return data, latency, error, phases
 
     def ping(self, payload):
         try:
             payload = self._prepare_payload(payload)
-            data, latency, error = self.send_and_recv(payload, recv_method=self.recv_all)
-            self._handler(payload, data, latency, error)
+            data, latency, error, phases = self.send_and_recv(
+                payload, recv_method=self.recv_all)
+            self._handler(payload, data, latency, error, **phases)
         except Exception as err:
             if self.verbose:
                 log.info('Ping Error - %r', err, exc_info=err)
 
+    def _get_bulk_buffer(self):
+        if self._bulk_buffer is None:
+            size = config.get_param('TRAFFIC_THROUGHPUT_BUFFER_SIZE',
+                                    256 * 1024)
+            self._bulk_buffer = memoryview(bytearray(size))
+        return self._bulk_buffer
+
+    async def asend_bulk(self):
+        """
+        Streams bulk data to sink server from a reused buffer. Returns
+        bytes sent, bytes received by sink, error and ping timer.
+        """
+        loop = asyncio.get_event_loop()
+        buf = self._get_bulk_buffer()
+        size = self.packet or 0
+        sent, received, error = 0, None, None
+        sock = self._new_socket()
+        sock.setblocking(False)
+        timer = PingTimer()
+        try:
+            await self._await(loop.sock_connect(sock, (self.server, self.port)))
+            timer.mark_connected()
+            await self._await(loop.sock_sendall(
+                sock, self.SINK_HEADER.pack(self.SINK_MAGIC, size)))
+            end = loop.time() + self.duration if self.duration else None
+            while not size or sent < size:
+                if end and loop.time() >= end:
+                    break
+                count = min(len(buf), size - sent) if size else len(buf)
+                await self._await(loop.sock_sendall(sock, buf[:count]))
+                sent += count
+            sock.shutdown(socket.SHUT_WR)
+            timer.mark_sent()
+            reply = await self.arecv_exactly(sock, self.SINK_REPLY.size,
+                                             timer=timer)
+            received = self.SINK_REPLY.unpack(reply)[0]
+            timer.stop()
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            error = self._error(err)
+            timer.stop()
+        finally:
+            sock.close()
+        return sent, received, error, timer
+
+    async def athroughput(self, payload, **stats):
+        sent, received, error, timer = await self.asend_bulk()
+        data = None
+        if error is None:
+            if received == sent:
+                data = payload
+            else:
+                error = "Sink received %s of %s bytes" % (received, sent)
+        elapsed = timer.end - (timer.connected or timer.start)
+        goodput = None
+        if received and elapsed > 0:
+            # Mbps
+            goodput = round(received * 8 * 1000 / elapsed, 3)
+        stats.update(timer.as_record())
+        if self.verbose:
+            log.info("Throughput to %s:%s : %s bytes, %s Mbps, error %s",
+                     self.server, self.port, received, goodput, error)
+        self._handler(payload, data, timer.latency, error,
+                      transferred=received or 0, goodput=goodput, **stats)
+
+    @staticmethod
+    def _failure(err):
+        """ Returns errno name (e.g. ECONNREFUSED) for a failure. """
+        if isinstance(err, (asyncio.TimeoutError, socket.timeout)):
+            return errno.errorcode[errno.ETIMEDOUT]
+        code = getattr(err, 'errno', None)
+        if code in errno.errorcode:
+            return errno.errorcode[code]
+        return type(err).__name__
+
+    async def aconnect_once(self, payload):
+        """
+        Opens a connection, exchanges payload and closes it. Returns
+        latency (ms) and failure (errno name), if any.
+        """
+        loop = asyncio.get_event_loop()
+        sock = self._new_socket()
+        sock.setblocking(False)
+        timer = PingTimer()
+        try:
+            await self._await(loop.sock_connect(sock, (self.server, self.port)))
+            await self._await(loop.sock_sendall(sock, payload))
+            data = await self.arecv_all(sock)
+            timer.stop()
+            if data != payload:
+                return timer.latency, 'EBADREPLY'
+            return timer.latency, None
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            return None, self._failure(err)
+        finally:
+            sock.close()
+
+    def _report_storm(self):
+        stats = self._storm
+        if not stats.sent:
+            return
+        payload = self._storm_payload
+        failed = stats.failed
+        data = None if failed else payload
+        error = None
+        if failed:
+            error = "%s of %s connections failed : %s" % (
+                failed, stats.sent, dict(stats.failures))
+        try:
+            self._handler(payload, data, stats.latency, error,
+                          **stats.as_record())
+        except Exception as err:
+            if self.verbose:
+                log.info('Ping Error - %r', err, exc_info=err)
+        stats.reset()
+
+    async def acps(self, payload, send_delay=None):
+        """ Opens a connection of CPS storm. """
+        if not self._reporter:
+            self._storm.reset()
+            self._storm_payload = payload
+            self._reporter = asyncio.ensure_future(
+                self._areport(self._report_storm))
+        self._storm.sent += 1
+        self._storm.update_send_delay(send_delay)
+        latency, failure = await self.aconnect_once(payload)
+        self._storm.add(latency, failure)
+
+    async def aping(self, payload, **stats):
+        try:
+            payload = self._prepare_payload(payload)
+            if self.mode == self.THROUGHPUT:
+                await self.athroughput(payload, **stats)
+                return
+            if self.mode == self.CPS:
+                await self.acps(payload, stats.get('send_delay'))
+                return
+            request = self._add_timestamps(payload)
+            if self.persistent:
+                data, latency, error, phases = \
+                    await self.asend_and_recv_persistent(
+                        self.frame(request), recv_method=self.arecv_frame)
+            else:
+                data, latency, error, phases = await self.asend_and_recv(
+                    request, recv_method=self.arecv_all)
+            stats.update(phases)
+            self._handler(payload, data, latency, error, **stats)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            if self.verbose:
+                log.info('Ping Error - %r', err, exc_info=err)
+
+
+class ProbeStats(object):
+
+    def __init__(self):
+        """
+        Statistics of probes of a sequence numbered probe stream sent in
+        one report window. Replies (and losses) are counted in the window
+        their probe was sent in.
+        """
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.rtt_total = 0      # in nanoseconds.
+        self.jitter = None      # Stream jitter (ns) as of last reply.
+        self.send_delay = None  # max delay (ms) of a probe behind schedule.
+        self.one_way = collections.Counter()    # sums of one way delays
+        self.timestamped = 0    # replies timestamped by server
+        self.error = None
+
+    @property
+    def outstanding(self):
+        """ Probes neither replied nor counted as lost yet. """
+        return self.sent - self.received - self.lost
+
+    def update_send_delay(self, send_delay):
+        if send_delay is not None:
+            self.send_delay = max(self.send_delay or 0, send_delay)
+
+    def add_one_way(self, one_way):
+        if one_way:
+            self.timestamped += 1
+            self.one_way.update(one_way)
+
+    @property
+    def latency(self):
+        """ Average round trip time (ms) in the window. """
+        if not self.received:
+            return 0
+        return round(self.rtt_total / self.received / NS_PER_MS, 2)
+
+    def as_record(self):
+        record = {
+            'sent': self.sent,
+            'received': self.received,
+            'lost': self.lost,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+            'jitter': round((self.jitter or 0) / NS_PER_MS, 3),
+            'send_delay': self.send_delay
+            }
+        # Averages over the window.
+        for key, total in self.one_way.items():
+            record[key] = round(total / self.timestamped, 3)
+        return record
+
 
 class UDPClient(Client):
 
-    def _create_socket(self):
+    # Probes of a persistent UDP stream carry PROBE_MAGIC, sequence number
+    # and send time (ns, client clock) ahead of payload. Server echoes
+    # datagrams back as is.
+    PROBE_MAGIC = b'LYDP'
+    PROBE_HEADER = struct.Struct('!4sQQ')
+
+    def __init__(self, *args, **kwargs):
+        super(UDPClient, self).__init__(*args, **kwargs)
+        self._stream = None         # Socket for probe stream.
+        self._reporter = None       # Coroutine reporting stream stats.
+        self._seq = 0
+        self._max_seq = -1          # Highest sequence number replied.
+        # seq : (send time, window) of probes awaiting reply and of those
+        # replied (to detect duplicates).
+        self._pending = collections.OrderedDict()
+        self._replied = collections.OrderedDict()
+        # window : ProbeStats of current and of previous windows yet to be
+        # reported, i.e. with probes awaiting reply.
+        self._windows = collections.OrderedDict()
+        self._window = 0
+        # Interarrival jitter of RFC 3550 (section 6.4.1), computed over
+        # round trip transit times, as running estimate across windows.
+        self._jitter = 0.0
+        self._transit = None
+        self._stream_payload = None
+        self._drained = None    # Future done once no probe awaits reply.
+
+    def _new_socket(self):
         """
-        Returns a simple TCP server socket.
+        Returns a simple UDP client socket.
         """
         sock_type = socket.AF_INET6 if self.ipv6 else socket.AF_INET
-        self.socket = socket.socket(sock_type, socket.SOCK_DGRAM)
-        self.socket.settimeout(self.sockettimeout)
+        sock = socket.socket(sock_type, socket.SOCK_DGRAM)
+        sock.settimeout(self.sockettimeout)
+        return sock
+
+    def _create_socket(self):
+        self.socket = self._new_socket()
 
     def send_and_recv(self, payload):
         attempts = self.attempts
-        data, latency, error = None, 0, None
+        data, latency, error, phases = None, 0, None, {}
         while attempts:
+            timer = None
             try:
                 attempts -= 1
                 self._create_socket()
-                start_time = time.time()
+                timer = PingTimer()
                 self.socket.sendto(payload, (self.server, self.port))
+                timer.mark_sent()
                 data, _ = self.socket.recvfrom(self.MAX_PAYLOAD_SIZE)
-                latency = round((time.time() - start_time) * LATENCY_RESOLUTION, 2)
+                timer.mark_first_byte()
+                timer.stop()
+                latency = timer.latency
                 if self.verbose:
                     msg = "Ping to %s:%s PASS. Payload / data - %s/%s" % (
                            self.server, self.port, payload, data)
                     log.info(msg)
                 break   # finally is still executed.
             except Exception as err:
-                error = '%s' % error
+                error = '%s' % err
                 if self.verbose:
                     msg = ("Ping to %s:%s FAIL. Payload / data - %s/%s ."
                            " ERROR - %s") % (
@@ -232,41 +1015,439 @@ class UDPClient(Client):
                         log.debug('Retrying attempt %s/%s', count, self.attempts)
             finally:
                 self.socket_close()
+                if timer:
+                    timer.end = timer.end or perf_counter_ns()
+                    phases = timer.as_record()
+
+        return data, latency, error, phases
+
+    async def asend_and_recv(self, payload):
+        """
+        Coroutine counterpart of send_and_recv(). Socket is connected to
+        the server so that plain send/recv can be awaited on the loop.
+        """
+        loop = asyncio.get_event_loop()
+        attempts = self.attempts
+        data, latency, error, phases = None, 0, None, {}
+        while attempts:
+            sock, timer = None, None
+            try:
+                attempts -= 1
+                sock = self._new_socket()
+                sock.setblocking(False)
+                timer = PingTimer()
+                sock.connect((self.server, self.port))
+                await self._await(loop.sock_sendall(sock, payload))
+                timer.mark_sent()
+                data = await self._await(loop.sock_recv(sock,
+                                                        self.MAX_PAYLOAD_SIZE))
+                timer.mark_first_byte()
+                timer.stop()
+                data, timer.one_way = self._read_timestamps(data, timer)
+                latency = timer.latency
+                if self.verbose:
+                    msg = "Ping to %s:%s PASS. Payload / data - %s/%s" % (
+                           self.server, self.port, payload, data)
+                    log.info(msg)
+                break   # finally is still executed.
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                error = self._error(err)
+                if self.verbose:
+                    msg = ("Ping to %s:%s FAIL. Payload / data - %s/%s ."
+                           " ERROR - %s") % (
+                           self.server, self.port, payload, data, error)
+                    log.info(msg)
+                    if attempts:
+                        count = self.attempts - attempts + 1
+                        log.debug('Retrying attempt %s/%s', count, self.attempts)
+            finally:
+                if sock:
+                    sock.close()
+                if timer:
+                    timer.end = timer.end or perf_counter_ns()
+                    phases = timer.as_record()
+
+        return data, latency, error, phases
+
+    def _open_stream(self, payload):
+        loop = asyncio.get_event_loop()
+        sock = self._new_socket()
+        sock.setblocking(False)
+        sock.connect((self.server, self.port))
+        loop.add_reader(sock.fileno(), self._on_stream_readable)
+        self._stream = sock
+        self._stream_payload = payload
+        self._windows[self._window] = ProbeStats()
+        self._reporter = asyncio.ensure_future(
+            self._areport(self._report_stream))
+
+    def _release(self):
+        if not self._stream:
+            return
+        asyncio.get_event_loop().remove_reader(self._stream.fileno())
+        self._stream.close()
+        self._stream = None
+        if self._reporter:
+            self._reporter.cancel()
+            self._reporter = None
+        # No more replies. Report all windows.
+        self._report_stream(final=True)
 
-        return data, latency, error
+    def _on_stream_readable(self):
+        """ Drains replies available on the stream socket. """
+        while self._stream:
+            try:
+                data = self._stream.recv(self.MAX_PAYLOAD_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as err:
+                # e.g. ICMP port unreachable reported on connected socket.
+                self._windows[self._window].error = self._error(err)
+                break
+            self._on_probe_reply(data, perf_counter_ns())
+
+    async def _adrain(self):
+        if not self._stream or not self._pending:
+            return
+        self._drained = asyncio.get_event_loop().create_future()
+        try:
+            await asyncio.wait_for(self._drained, self.sockettimeout)
+        except asyncio.TimeoutError:
+            pass    # Probes yet to be replied are lost.
+        finally:
+            self._drained = None
+
+    def _update_jitter(self, transit):
+        if self._transit is not None:
+            self._jitter += (abs(transit - self._transit) - self._jitter) / 16
+        self._transit = transit
+
+    def _on_probe_reply(self, data, arrival):
+        data, stamps = self._strip_timestamps(data)
+        hsize = self.PROBE_HEADER.size
+        if len(data) < hsize:
+            return
+        magic, seq, sent = self.PROBE_HEADER.unpack(data[:hsize])
+        if magic != self.PROBE_MAGIC:
+            return
+        if seq in self._pending:
+            self._replied[seq] = self._pending.pop(seq)
+            if not self._pending and self._drained and \
+                    not self._drained.done():
+                self._drained.set_result(None)
+            stats = self._windows[self._replied[seq][1]]
+            if data[hsize:] != self._stream_payload:
+                stats.lost += 1
+                stats.error = "Invalid reply for probe %s" % seq
+                return
+            stats.received += 1
+            stats.rtt_total += arrival - sent
+            self._update_jitter(arrival - sent)
+            stats.jitter = self._jitter
+            stats.add_one_way(self._one_way(sent, arrival, stamps))
+            if seq < self._max_seq:
+                stats.reordered += 1
+            else:
+                self._max_seq = seq
+        elif seq in self._replied:
+            stats = self._windows.get(self._replied[seq][1])
+            if stats:   # else window is reported already.
+                stats.duplicates += 1
+        # else reply of a probe already counted as lost.
+
+    def _expire_probes(self, final=False):
+        """
+        Probes not replied within socket timeout (or all of them, if
+        final) are counted as lost. Replied probes are remembered as long
+        to detect duplicates.
+        """
+        expiry = perf_counter_ns() - int(self.sockettimeout * 1e9)
+        for probes in (self._pending, self._replied):
+            while probes:
+                seq, (sent, window) = next(iter(probes.items()))
+                if sent > expiry and not final:
+                    break
+                probes.popitem(last=False)
+                if probes is self._pending:
+                    self._windows[window].lost += 1
+
+    def _report_window(self, stats):
+        if not (stats.sent or stats.received or stats.lost):
+            return
+        payload = self._stream_payload
+        data = payload if stats.received else None
+        error = stats.error
+        if not stats.received:
+            error = error or 'timed out'
+        if stats.jitter is None:
+            stats.jitter = self._jitter
+        try:
+            self._handler(payload, data, stats.latency, error,
+                          **stats.as_record())
+        except Exception as err:
+            if self.verbose:
+                log.info('Ping Error - %r', err, exc_info=err)
+
+    def _report_stream(self, final=False):
+        """
+        Ends current window and reports previous windows, in order, once
+        all of their probes are replied or counted as lost.
+        """
+        self._expire_probes(final)
+        self._window += 1
+        if not final:
+            self._windows[self._window] = ProbeStats()
+        while self._windows:
+            window, stats = next(iter(self._windows.items()))
+            if window == self._window or (stats.outstanding and not final):
+                break
+            self._windows.popitem(last=False)
+            self._report_window(stats)
+
+    def send_probe(self, payload, send_delay=None):
+        """
+        Sends next probe of the stream. Replies are matched as they
+        arrive and stats are reported once every report window.
+        """
+        if not self._stream:
+            self._open_stream(payload)
+        seq, sent = self._seq, perf_counter_ns()
+        self._seq += 1
+        self._pending[seq] = (sent, self._window)
+        stats = self._windows[self._window]
+        stats.sent += 1
+        stats.update_send_delay(send_delay)
+        try:
+            self._stream.send(self._add_timestamps(
+                self.PROBE_HEADER.pack(self.PROBE_MAGIC, seq, sent) + payload))
+        except OSError as err:
+            # Probe would eventually be counted as lost.
+            stats.error = self._error(err)
 
     def ping(self, payload):
         latency = 0
         try:
             payload = self._prepare_payload(payload)
-            data, latency, error = self.send_and_recv(payload)
-            self._handler(payload, data, latency, error)
+            data, latency, error, phases = self.send_and_recv(payload)
+            self._handler(payload, data, latency, error, **phases)
         except Exception as err:
             if self.verbose:
                 log.info('Ping Error - %r', err, exc_info=err)
 
+    async def aping(self, payload, **stats):
+        try:
+            payload = self._prepare_payload(payload)
+            if self.persistent:
+                self.send_probe(payload, stats.get('send_delay'))
+                return
+            data, latency, error, phases = await self.asend_and_recv(
+                self._add_timestamps(payload))
+            stats.update(phases)
+            self._handler(payload, data, latency, error, **stats)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            if self.verbose:
+                log.info('Ping Error - %r', err, exc_info=err)
+
+
+class HTTPResponse(object):
+
+    def __init__(self, version, status, reason, headers, body):
+        """ A parsed HTTP response. Header names are in lower case. """
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self):
+        """ True if server would keep the connection open. """
+        conn = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.0':
+            return conn == 'keep-alive'
+        return conn != 'close'
+
+
+class HTTPResponseParser(object):
+    MAX_HEADER_SIZE = 64 * 1024
+
+    def __init__(self):
+        """
+        Incremental HTTP/1.x response parser. Data is fed as received
+        from socket and complete responses are returned as soon as
+        available. Bytes of a following (pipelined) response are retained
+        for next feed. Responses must carry Content-Length unless body is
+        delimited by connection close (see close()).
+        """
+        self._buf = bytearray()
+        self._head = None   # (version, status, reason, headers, length)
+
+    def _parse_head(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        version, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise ValueError("Chunked HTTP response is not supported.")
+        length = headers.get('content-length')
+        length = int(length) if length is not None else None
+        return version, int(status), reason, headers, length
+
+    def feed(self, data):
+        """ Feeds received data and returns list of complete responses. """
+        self._buf.extend(data)
+        responses = []
+        while True:
+            if self._head is None:
+                end = self._buf.find(b'\r\n\r\n')
+                if end < 0:
+                    if len(self._buf) > self.MAX_HEADER_SIZE:
+                        raise ValueError("HTTP response header too large.")
+                    break
+                self._head = self._parse_head(bytes(self._buf[:end]))
+                del self._buf[:end + 4]
+            length = self._head[-1]
+            if length is None or len(self._buf) < length:
+                break   # Body incomplete or delimited by close.
+            responses.append(HTTPResponse(*self._head[:-1],
+                                          body=bytes(self._buf[:length])))
+            del self._buf[:length]
+            self._head = None
+        return responses
+
+    def close(self):
+        """
+        Called when server closes connection. Returns the response whose
+        body was delimited by connection close, if any.
+        """
+        if self._head is None or self._head[-1] is not None:
+            return None
+        response = HTTPResponse(*self._head[:-1], body=bytes(self._buf))
+        self._head, self._buf = None, bytearray()
+        return response
+
 
 class HTTPClient(TCPClient):
 
-    def _prepare_payload(self, payload):
-        payload = "GET /%s HTTP/1.1\r\n\r\n\r\n" % payload
+    def __init__(self, *args, pipeline=None, **kwargs):
+        """
+        HTTP client. In persistent mode, requests are sent over a keep-alive
+        connection and 'pipeline' requests are sent back to back per ping.
+        """
+        super(HTTPClient, self).__init__(*args, **kwargs)
+        # HTTP server doesn't reflect timestamps (requests aren't marked
+        # for it), so replies are never stripped of them.
+        self.timestamps = False
+        try:
+            self.pipeline = max(int(pipeline), 1)
+        except (ValueError, TypeError):
+            self.pipeline = 1
+        self._parser = None     # Response parser of persistent connection.
+
+    @property
+    def host_header(self):
+        server = '[%s]' % self.server if self.ipv6 else self.server
+        return '%s:%s' % (server, self.port)
+
+    def _prepare_payload(self, payload, keep_alive=False):
+        conn = '' if keep_alive else 'Connection: close\r\n'
+        payload = "GET /%s HTTP/1.1\r\nHost: %s\r\n%s\r\n" % (
+            payload, self.host_header, conn)
         return payload.encode('utf-8') if is_py3() else payload
 
-    def fetch(self):
-        _data = self.recv_all()
-        _data = _data.decode().splitlines()
-        if '200 OK' in str(_data[0]):
-            data = json.loads(_data[-1])['payload']
-        else:
-            data = None
-        return data
+    def _get_payload(self, response):
+        """ Returns payload echoed in response. """
+        if response is None or response.status != 200:
+            return None
+        return json.loads(response.body.decode())['payload']
+
+    def _parse_response(self, _data):
+        parser = HTTPResponseParser()
+        responses = parser.feed(_data) or [parser.close()]
+        return self._get_payload(responses[0])
+
+    def fetch(self, timer=None):
+        return self._parse_response(self.recv_all(timer=timer))
+
+    async def afetch(self, sock, timer=None):
+        return self._parse_response(await self.arecv_all(sock, timer=timer))
+
+    def _release(self):
+        super(HTTPClient, self)._release()
+        self._parser = None
+
+    async def afetch_responses(self, sock, timer=None):
+        """
+        Reads responses of pipelined requests from keep-alive connection
+        and returns payloads echoed in them.
+        """
+        loop = asyncio.get_event_loop()
+        if self._parser is None:
+            self._parser = HTTPResponseParser()
+        responses = []
+        while len(responses) < self.pipeline:
+            chunk = await self._await(loop.sock_recv(sock,
+                                                     self.MAX_PAYLOAD_SIZE))
+            if timer:
+                timer.mark_first_byte()
+            if not chunk:
+                response = self._parser.close()
+                if response is None:
+                    raise ConnectionResetError("Connection closed by server")
+                responses.append(response)
+                break
+            responses.extend(self._parser.feed(chunk))
+        if not responses[-1].keep_alive or len(responses) < self.pipeline:
+            self._release()     # Server is closing connection.
+        return [self._get_payload(response) for response in responses]
 
     def ping(self, payload):
         try:
             _payload = self._prepare_payload(payload)
-            data, latency, error = self.send_and_recv(_payload,
-                                               recv_method=self.fetch)
-            self._handler(payload, data, latency, error)
+            data, latency, error, phases = self.send_and_recv(
+                _payload, recv_method=self.fetch)
+            self._handler(payload, data, latency, error, **phases)
+        except Exception as err:
+            if self.verbose:
+                log.info('Ping Error - %r', err, exc_info=err)
+
+    async def _aping_keepalive(self, payload, **stats):
+        request = self._prepare_payload(payload, keep_alive=True)
+        data, latency, error, phases = await self.asend_and_recv_persistent(
+            request * self.pipeline, recv_method=self.afetch_responses)
+        stats.update(phases)
+        if self.pipeline == 1:
+            data = data[0] if data else None
+            self._handler(payload, data, latency, error, **stats)
+            return
+
+        # Pipelined requests are reported together.
+        received = len([d for d in data or [] if d == payload])
+        data = payload if received == self.pipeline else None
+        if data is None and error is None:
+            error = "%s of %s pipelined requests failed" % (
+                self.pipeline - received, self.pipeline)
+        self._handler(payload, data, latency, error,
+                      sent=self.pipeline, received=received, **stats)
+
+    async def aping(self, payload, **stats):
+        try:
+            if self.persistent:
+                await self._aping_keepalive(payload, **stats)
+                return
+            _payload = self._prepare_payload(payload)
+            data, latency, error, phases = await self.asend_and_recv(
+                _payload, recv_method=self.afetch)
+            stats.update(phases)
+            self._handler(payload, data, latency, error, **stats)
+        except asyncio.CancelledError:
+            raise
         except Exception as err:
             if self.verbose:
                 log.info('Ping Error - %r', err, exc_info=err)
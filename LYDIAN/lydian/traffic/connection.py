@@ -5,13 +5,19 @@
 # in the root directory of this project.
 
 import logging
+import struct
 import threading
+import time
+
+# time.time_ns is available only on python 3.7+
+time_ns = getattr(time, 'time_ns', None) or \
+    (lambda: int(time.time() * 1000000000))
 
 
 class Connection(object):
 
     # Default server parameters
-    MAX_CONNS = 20
+    MAX_CONNS = 1024     # listen backlog
     DEFAULT_TCP_SERVER_PORT = 5649
     DEFAULT_UDP_SERVER_PORT = 5648
 
@@ -23,6 +29,26 @@ class Connection(object):
     # data.
     MAX_PAYLOAD_SIZE = 4096
 
+    # Persistent connections exchange length prefixed frames. A frame is
+    # FRAME_MAGIC and payload length (network order) followed by payload.
+    # Magic lets server tell framed clients from one-shot clients.
+    FRAME_MAGIC = b'LYDF'
+    FRAME_HEADER = struct.Struct('!4sI')
+    MAX_FRAME_SIZE = 1024 * 1024
+
+    # Throughput clients stream bulk data to a sink. Stream starts with
+    # SINK_MAGIC and number of bytes to follow (0 : till client shuts
+    # down its side). Sink discards data and replies with bytes received.
+    SINK_MAGIC = b'LYDS'
+    SINK_HEADER = struct.Struct('!4sQ')
+    SINK_REPLY = struct.Struct('!Q')
+
+    # Timestamped echo. Server echoes a request (or frame payload / UDP
+    # datagram) starting with TS_MAGIC with TS_TRAILER appended : its
+    # receive and send time (ns since epoch), for one way delays.
+    TS_MAGIC = b'LYDT'
+    TS_TRAILER = struct.Struct('!QQ')
+
     def __init__(self, verbose=False):
         self.log = logging.getLogger(__name__)
         self.verbose = verbose
@@ -33,6 +59,19 @@ class Connection(object):
     def _create_socket(self):
         raise NotImplementedError("%s::_create_socket not implemented." % type(self).name)
 
+    @classmethod
+    def frame(cls, payload):
+        """ Returns payload as a frame. """
+        return cls.FRAME_HEADER.pack(cls.FRAME_MAGIC, len(payload)) + payload
+
+    @classmethod
+    def frame_length(cls, header):
+        """ Returns payload length from a frame header. """
+        magic, length = cls.FRAME_HEADER.unpack(header)
+        if magic != cls.FRAME_MAGIC or length > cls.MAX_FRAME_SIZE:
+            raise ValueError("Invalid frame header : %r" % header)
+        return length
+
     def stop(self):
         self._stop_event.set()
 
@@ -63,6 +63,21 @@ class WinHost(Target):
     HOST_TYPE = Target.WINVM
 
 
+def _set_state(obj, state, fields):
+    """
+    Sets pickled state on obj. Unknown keys (e.g. pickled by another
+    version) are skipped.
+    """
+    if isinstance(state, tuple):    # (__dict__, slots) pickled.
+        state = dict(state[0] or {}, **(state[1] or {}))
+    for key, val in state.items():
+        if key in fields:
+            setattr(obj, key, val)
+        else:
+            log.warning("Ignoring unknown field %s of %s", key,
+                        type(obj).__name__)
+
+
 class TrafficRule(object):
     ACTIVE = 'ACTIVE'
     INACTIVE = 'INACTIVE'
@@ -79,12 +94,20 @@ class TrafficRule(object):
         'port': 'int',          # port
         'connected': 'text',    # Ping expected to PASS or FAIL
         'sockettimeout': 'float',  # socket timeout
-        'interval': 'int',       # interval between ping
+        'interval': 'float',     # interval (seconds) between pings
 
         'payload': 'text',      # Payload for rule or "Dinkirk!!"
         'packet': 'text',       # Packet size for traffic.
         'tries': 'int',         # Number of tries/count of ping.
         'attempts': 'int',      # Number of attempts to fetch data from Server.
+        'persistent': 'int',    # Reuse one connection for all pings (1/0)
+        'pipeline': 'int',      # HTTP requests pipelined per ping (persistent)
+        'timestamps': 'int',    # Server timestamps replies for one way delays (1/0)
+        'mode': 'text',         # Traffic mode : ping (default) / throughput / cps
+        'duration': 'float',    # Seconds to stream for (throughput mode)
+        'concurrency': 'int',   # Connections in flight (cps mode)
+        'cps': 'float',         # Target connections per second (cps mode)
+        'workers': 'int',       # Processes serving the port (server side)
 
         'username': 'text',     # run traffic as. 'root' by default
         'state': 'text',        # ENABLED/DISABLED
@@ -107,6 +130,14 @@ class TrafficRule(object):
         'payload': 'Dinkirk'
     }
 
+    # Set on rules being run on this host. Not saved.
+    RUNTIME_FIELDS = ('src_target', 'dst_target')
+
+    # Rules are held (all of them, at primary) in memory. Slots save about
+    # 7% (python 3.11) to 21% (python 3.8) of a rule with __dict__
+    # (see utils/rules_benchmark).
+    __slots__ = tuple(SCHEMA) + RUNTIME_FIELDS
+
     def fill(self):
         """ Sets the default fields if not present."""
         for key, _ in self.SCHEMA.items():
@@ -144,13 +175,22 @@ class TrafficRule(object):
                 self.tool not in ("", None)
 
     def as_dict(self):
-        return {k: v for k, v in self.__dict__.items() if k in self.SCHEMA}
+        """ Returns {field : value} of (schema) fields set on rule. """
+        return {k: getattr(self, k) for k in self.SCHEMA if hasattr(self, k)}
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in self.__slots__
+                if hasattr(self, k)}
+
+    def __setstate__(self, state):
+        _set_state(self, state, self.__slots__)
 
     def __repr__(self):
         return '%s' % self.as_dict()
 
 
 class Record(object):
+    __slots__ = ('_id', '_timestamp')
 
     def __init__(self):
         """
@@ -163,27 +203,76 @@ class Record(object):
         return '%s' % self.toJSON()
 
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__,
+        return json.dumps(self, default=lambda o: o.as_dict(),
                           sort_keys=True, indent=4)
     @property
     def timestamp(self):
         return self._timestamp
 
+    @classmethod
+    def fields(cls):
+        """ Returns names of all the fields (slots) of record. """
+        return [x for klass in reversed(cls.__mro__)
+                for x in klass.__dict__.get('__slots__', ())]
+
     def as_dict(self):
-        return self.__dict__
+        return {k: getattr(self, k) for k in self.fields()}
+
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self, state):
+        _set_state(self, state, self.fields())
 
 
 class TrafficRecord(Record):
+    # A record is created per ping. Fields are slots, rather than
+    # __dict__ entries, to keep them small.
+    __slots__ = (
+        'source',           # ping source IP Address
+        'destination',      # ping destination IP Address
+        'protocol',         # ping traffic type (TCP/UDP/HTTP)
+        'port',             # port on server where Traffic is sent.
+        'expected',         # ping expectation (Pass/Fail : True/False)
+        'result',           # Actual result
+        'latency',          # ping latency
+        'error',            # Error Type, if any
+        'reqid',            # Request ID
+        'ruleid',           # Rule ID
+
+        # Stream stats (e.g. UDP probe stream) over the report window.
+        'sent',             # probes (or connections) sent
+        'received',         # probes (or connections) replied
+        'lost',             # probes not replied (within timeout)
+        'reordered',        # probes replied out of order
+        'duplicates',       # duplicate replies
+        'jitter',           # RFC 3550 interarrival jitter (ms)
+        # Latency phases (ms) of a ping.
+        'connect_time',     # connection handshake
+        'ttfb',             # request sent till first byte of reply
+        'total_time',       # start till reply complete
+        'send_delay',       # ping sent behind schedule by (ms)
+
+        # Throughput mode
+        'transferred',      # bytes received by sink
+        'goodput',          # Mbps
+
+        # Connections per second (CPS) mode, over the report window.
+        'cps',              # achieved connections per second
+        'failures',         # failed connections by errno (JSON)
+        'latency_p50',      # latency percentiles (ms)
+        'latency_p90',
+        'latency_p99',
+        'latency_max',
+
+        # One way delays (ms), from server timestamped replies.
+        'forward_delay',    # client to server
+        'reverse_delay',    # server to client
+        'server_time',      # server receive till reply
+        'clock_offset',     # estimated server clock offset
+    )
 
     def __init__(self):
         super(TrafficRecord, self).__init__()
-        self.source = None          # ping source IP Address
-        self.destination = None     # ping destination IP Address
-        self.protocol = None        # ping traffic type (TCP/UDP/HTTP)
-        self.port = None            # port on server where Traffic is sent.
-        self.expected = None        # ping expectation (Pass/Fail : True/False)
-        self.result = None          # Actual result
-        self.latency = None         # ping latency
-        self.error = None           # Error Type, if any
-        self.reqid = None           # Request ID
-        self.ruleid = None          # Rule ID
+        for field in self.__slots__:
+            setattr(self, field, None)
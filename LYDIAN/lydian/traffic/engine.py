@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+'''
+Event loop based engine for running traffic. A single engine (an asyncio
+event loop running in its own thread) drives every traffic client and
+server of a network namespace (or host), instead of one thread per
+traffic task. Engines are shared process wide through acquire_engine()
+and release_engine().
+'''
+
+import asyncio
+import logging
+import os
+import threading
+
+from lydian.apps import config
+from lydian.utils.common import is_linux
+if is_linux():
+    from lydian.utils import nsenter
+
+log = logging.getLogger(__name__)
+
+
+def _all_tasks(loop):
+    # asyncio.all_tasks is available only on python 3.7+
+    if hasattr(asyncio, 'all_tasks'):
+        return asyncio.all_tasks(loop)
+    return asyncio.Task.all_tasks(loop)
+
+
+def current_task():
+    # asyncio.current_task is available only on python 3.7+
+    if hasattr(asyncio, 'current_task'):
+        return asyncio.current_task()
+    return asyncio.Task.current_task()
+
+
+class TrafficEngine(object):
+
+    def __init__(self, name, namespace=None):
+        """
+        An asyncio event loop, running in a dedicated thread, which drives
+        traffic for all the rules of a target.
+
+        Parameters
+        ----------
+        name: str
+            Name of engine. Typically name of the target it runs traffic for.
+        namespace: str
+            Network namespace name. When provided, engine thread runs inside
+            this namespace so all the sockets get created in it.
+        """
+        self._name = name
+        self._namespace = namespace
+        self._loop = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def namespace(self):
+        return self._namespace
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive() and self._loop)
+
+    def _enter_namespace(self):
+        """
+        Moves engine thread into the namespace. setns is per thread so
+        rest of the process is not affected. Thread never leaves the
+        namespace.
+        """
+        nspath = os.path.join(config.get_param('NAMESPACE_DIR'),
+                              self._namespace)
+        fd = os.open(nspath, os.O_RDONLY)
+        try:
+            nsenter.setns(fd)
+        finally:
+            os.close(fd)
+
+    def _cancel_pending(self):
+        tasks = [t for t in _all_tasks(self._loop) if not t.done()]
+        for _task in tasks:
+            _task.cancel()
+        if tasks:
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+
+    def _run(self):
+        try:
+            if self._namespace:
+                self._enter_namespace()
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+        except Exception as err:
+            log.error("Error in starting traffic engine %s : %r", self.name,
+                      err, exc_info=err)
+            self._loop = None
+            return
+        finally:
+            self._ready.set()
+
+        try:
+            self._loop.run_forever()
+        finally:
+            try:
+                self._cancel_pending()
+            finally:
+                self._loop.close()
+                self._loop = None
+
+    def start(self):
+        """ Starts the engine (if not already running). """
+        with self._lock:
+            if self.is_running():
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='engine-%s' % self.name,
+                                            daemon=True)
+            self._thread.start()
+            self._ready.wait()
+            if not self._loop:
+                raise RuntimeError("Traffic engine %s failed to start." %
+                                   self.name)
+            log.info("Started traffic engine : %s", self.name)
+
+    def submit(self, coro):
+        """
+        Schedules a coroutine on engine and returns a
+        concurrent.futures.Future for its result.
+        """
+        if not self.is_running():
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def stop(self):
+        """ Stops the engine. Pending coroutines are cancelled. """
+        with self._lock:
+            if not self.is_running():
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(config.get_param('THREADS_JOIN_TIMEOUT'))
+            self._thread = None
+            log.info("Stopped traffic engine : %s", self.name)
+
+    close = stop
+
+
+class EngineRegistry(object):
+
+    def __init__(self):
+        """
+        Engines, one per network namespace (None for host), shared by all
+        the users (traffic clients, servers etc.) of the namespace. An
+        engine is stopped once its last user releases it.
+        """
+        self._engines = {}      # namespace : engine
+        self._users = {}        # namespace : number of users
+        self._lock = threading.Lock()
+
+    def acquire(self, namespace=None):
+        """ Returns engine of namespace, creating it if needed. """
+        with self._lock:
+            engine = self._engines.get(namespace)
+            if not engine:
+                name = 'ns-%s' % namespace if namespace else 'host'
+                engine = TrafficEngine(name, namespace=namespace)
+                self._engines[namespace] = engine
+                self._users[namespace] = 0
+            self._users[namespace] += 1
+            return engine
+
+    def release(self, namespace=None):
+        """ Releases engine of namespace, stopping it if unused. """
+        with self._lock:
+            if namespace not in self._users:
+                return
+            self._users[namespace] -= 1
+            if self._users[namespace] > 0:
+                return
+            del self._users[namespace]
+            engine = self._engines.pop(namespace)
+        engine.stop()
+
+
+_REGISTRY = EngineRegistry()
+acquire_engine = _REGISTRY.acquire
+release_engine = _REGISTRY.release
@@ -4,18 +4,84 @@
 # The full license information can be found in LICENSE.txt
 # in the root directory of this project.
 
+import collections
 import logging
+import math
+import multiprocessing
+import queue
+import random
+import threading
+import time
+import zlib
 
 import lydian.traffic.task as task
+from lydian.apps import config
+from lydian.traffic.engine import acquire_engine, release_engine
+from lydian.utils import parallel
 
 log = logging.getLogger(__name__)
 
 
+class AdmissionScheduler(object):
+
+    def __init__(self, ramp_window=None, max_per_sec=None):
+        """
+        Spreads start of tasks so that a burst of them (e.g. thousands of
+        rules registered together or resumed on restart) doesn't start
+        at the same moment. Each task of a burst is given a random start
+        time within ramp window and no more than max_per_sec tasks are
+        started in any second; excess ones are pushed to following
+        seconds.
+        """
+        self._ramp_window = ramp_window
+        self._max_per_sec = max_per_sec
+        self._slots = {}    # second : number of tasks starting in it.
+        self._lock = threading.Lock()
+
+    @property
+    def ramp_window(self):
+        if self._ramp_window is not None:
+            return self._ramp_window
+        return config.get_param('TRAFFIC_START_RAMP_WINDOW', 2)
+
+    @property
+    def max_per_sec(self):
+        if self._max_per_sec is not None:
+            return self._max_per_sec
+        return config.get_param('TRAFFIC_MAX_STARTS_PER_SEC', 1000)
+
+    def admit(self, ramp=False):
+        """
+        Returns delay (seconds) after which a task should start. Start is
+        spread over ramp window only if ramp (task is one of a burst).
+        """
+        now = time.monotonic()
+        start = now + random.uniform(0, (ramp and self.ramp_window) or 0)
+        max_per_sec = self.max_per_sec
+        with self._lock:
+            # Forget past seconds.
+            for second in [x for x in self._slots if x < int(now)]:
+                del self._slots[second]
+            if max_per_sec:
+                second = int(start)
+                while self._slots.get(second, 0) >= max_per_sec:
+                    second += 1
+                if second != int(start):
+                    # Random offset (jitter) within the second.
+                    start = second + random.random()
+                self._slots[second] = self._slots.get(second, 0) + 1
+        return max(start - now, 0)
+
+
 class TrafficManager(object):
     TASK_TYPE = None
 
     def __init__(self):
         self._traffic_tasks = {}
+        # Tasks of a target are driven by engine (event loop) of its
+        # namespace, which is shared with other managers.
+        self._engines = {}      # target name : (namespace, engine)
+        self._engines_lock = threading.Lock()
 
     def key(self, trule):
         raise NotImplementedError("'key' method must be implemented.")
@@ -23,9 +89,10 @@ class TrafficManager(object):
     def _create_task(self, trule):
         raise NotImplementedError("'key' method must be implemented.")
 
-    def add_task(self, trule):
+    def add_task(self, trule, ramp=False):
         """
         Relationship { Traffic Client : Traffic Rule } is 1:1.
+        ramp is True if rule is one of many added together.
         """
         key = self.key(trule)
         assert key, "Invalid ruleid"
@@ -36,14 +103,17 @@ class TrafficManager(object):
 
         task = self._create_task(trule)
         if trule.enabled:
-            task.start()    # Start the task if enabled.
+            self._start_task(task, ramp)    # Start the task if enabled.
         self._traffic_tasks[key] = task
 
+    def _start_task(self, task, ramp=False):
+        task.start()
+
     def start(self, trule):
         """ Start a Traffic task (again). """
         key = self.key(trule)
         if key in self._traffic_tasks:
-            self._traffic_tasks[key].start()
+            self._start_task(self._traffic_tasks[key])
 
     def stop(self, trule):
         """ Stop a Traffic task. """
@@ -51,26 +121,301 @@ class TrafficManager(object):
         if key in self._traffic_tasks:
             self._traffic_tasks[key].stop()
 
-    def close(self):
-        # TODO: Make it parallel, taking a lot of time.
-        for _, task in self._traffic_tasks.items():
-            task.close()
+    def start_many(self, trules):
+        """
+        Starts traffic tasks of rules. Returns {key : outcome} where
+        outcome is STARTED, RUNNING, MISSING or ERROR (see TrafficTask).
+        """
+        report = {}
+        for trule in trules:
+            key = self.key(trule)
+            _task = self._traffic_tasks.get(key)
+            if not _task:
+                report[key] = task.TrafficTask.MISSING
+            elif _task.is_running():
+                report[key] = task.TrafficTask.RUNNING
+            else:
+                try:
+                    self._start_task(_task, ramp=True)
+                    report[key] = task.TrafficTask.STARTED
+                except Exception as err:
+                    log.error("Error in starting traffic %s for rule %s : %r",
+                              self.TASK_TYPE.lower(), trule.ruleid, err)
+                    report[key] = task.TrafficTask.ERROR
+        return report
+
+    def _signal_and_join(self, tasks, signal, timeout=None):
+        """
+        Signals all the tasks first and then waits for them, all within
+        one deadline (timeout seconds, THREADS_JOIN_TIMEOUT by default),
+        rather than one per task. Returns {key : outcome}.
+        """
+        if timeout is None:
+            timeout = config.get_param('THREADS_JOIN_TIMEOUT')
+        deadline = time.monotonic() + timeout
+        report, signalled = {}, []
+        for key, _task in tasks:
+            try:
+                signal(_task)
+                signalled.append((key, _task))
+            except Exception as err:
+                log.error("Error in stopping traffic %s %s : %r",
+                          self.TASK_TYPE.lower(), key, err)
+                report[key] = task.TrafficTask.ERROR
+        for key, _task in signalled:
+            report[key] = _task.join(max(deadline - time.monotonic(), 0))
+        return report
+
+    def stop_many(self, trules, timeout=None):
+        """
+        Stops traffic tasks of rules, all within timeout. Returns
+        {key : outcome} where outcome is DONE, TIMEOUT, MISSING or ERROR.
+        """
+        report, tasks = {}, []
+        for trule in trules:
+            key = self.key(trule)
+            if key in self._traffic_tasks:
+                tasks.append((key, self._traffic_tasks[key]))
+            else:
+                report[key] = task.TrafficTask.MISSING
+        report.update(self._signal_and_join(
+            tasks, lambda x: x.stop(blocking=False), timeout))
+        return report
+
+    def close_all(self, timeout=None):
+        """
+        Closes all the traffic tasks, all within timeout, and releases
+        engines. Returns {key : outcome} (as of stop_many).
+        """
+        tasks = list(self._traffic_tasks.items())
         self._traffic_tasks = {}
+        report = self._signal_and_join(
+            tasks, lambda x: x.close(blocking=False), timeout)
+        with self._engines_lock:
+            for namespace, _ in self._engines.values():
+                release_engine(namespace)
+            self._engines = {}
+        return report
+
+    def _get_engine(self, target):
+        with self._engines_lock:
+            if target.name not in self._engines:
+                namespace = target.name if target.is_namespace() else None
+                self._engines[target.name] = (namespace,
+                                              acquire_engine(namespace))
+            return self._engines[target.name][1]
+
+    def close(self):
+        report = self.close_all()
+        failed = {k: v for k, v in report.items()
+                  if v != task.TrafficTask.DONE}
+        if failed:
+            log.error("Traffic %s tasks not closed cleanly : %s",
+                      self.TASK_TYPE.lower(), failed)
 
     def num_tasks(self):
         return len(self._traffic_tasks)
 
 
+def _client_worker(conn, record_queue, max_per_sec):
+    """
+    Runs a client worker process : a ClientManager of its own, run as
+    commanded by parent over conn, till closed (or parent goes away).
+    """
+    manager = ClientManager(record_queue, workers=1)
+    manager._admission = AdmissionScheduler(max_per_sec=max_per_sec)
+    while True:
+        try:
+            cmd, args = conn.recv()
+        except (EOFError, OSError):
+            # Parent is gone; records left in queue would never be read.
+            record_queue.cancel_join_thread()
+            cmd, args = 'close', ()
+        try:
+            result = (True, getattr(manager, cmd)(*args))
+        except Exception as err:
+            result = (False, err)
+        try:
+            conn.send(result)
+        except (EOFError, OSError):
+            pass
+        if cmd in ('close', 'close_all'):
+            break
+
+
+class ClientShard(object):
+
+    def __init__(self, ctx, index, record_queue, max_per_sec):
+        """ A client worker process and pipe to command it. """
+        self._conn, child_conn = ctx.Pipe()
+        self._lock = threading.Lock()
+        self._proc = ctx.Process(target=_client_worker,
+                                 args=(child_conn, record_queue, max_per_sec),
+                                 name='traffic-client-%d' % index,
+                                 daemon=True)
+        self._proc.start()
+        child_conn.close()
+
+    def call(self, cmd, *args):
+        """ Runs ClientManager method 'cmd' in worker and returns result. """
+        with self._lock:
+            self._conn.send((cmd, args))
+            ok, result = self._conn.recv()
+        if not ok:
+            raise result
+        return result
+
+    def close(self, timeout=None):
+        """ Closes clients of worker and returns report (see close_all). """
+        report = {}
+        try:
+            report = self.call('close_all', timeout)
+        except (EOFError, OSError) as err:
+            log.error("Client worker %s went away : %r", self._proc.name, err)
+        self._proc.join(config.get_param('THREADS_JOIN_TIMEOUT'))
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._conn.close()
+        return report
+
+
 class ClientManager(TrafficManager):
     """
     Manages Traffic Client on a host/vm.
+
+    With workers > 1, clients are run by that many (spawned) processes
+    instead, rules sharded among them by ruleid, so that they don't
+    contend for one GIL. Records of clients are sent back to this process
+    and put on record queue.
     """
     TASK_TYPE = task.TrafficTask.CLIENT
 
-    def __init__(self, record_queue):
+    def __init__(self, record_queue, workers=None):
         self._record_queue = record_queue
+        # Spreads start of clients.
+        self._admission = AdmissionScheduler()
+        self._workers = int(workers or
+                            config.get_param('TRAFFIC_CLIENT_WORKERS', 1))
+        self._shards = []           # Started on first rule.
+        self._shards_lock = threading.Lock()
+        self._worker_records = None     # Records from worker processes.
+        self._forwarder = None
         super(ClientManager, self).__init__()
 
+    def _forward_records(self):
+        """ Moves records of worker processes onto record queue. """
+        while True:
+            rec = self._worker_records.get()
+            if rec is None:
+                return
+            try:
+                self._record_queue.put(rec, block=False)
+            except queue.Full:
+                log.error("Cann't put Traffic Record %r into the queue.",
+                          rec)
+
+    def _start_shards(self):
+        """
+        Starts worker processes. Processes are spawned (not forked) as
+        this process runs many threads.
+        """
+        ctx = multiprocessing.get_context('spawn')
+        self._worker_records = ctx.Queue(
+            getattr(self._record_queue, 'maxsize', 0))
+        self._forwarder = threading.Thread(target=self._forward_records,
+                                           name='traffic-client-records',
+                                           daemon=True)
+        self._forwarder.start()
+        # Starts are limited per worker to keep the overall rate.
+        max_per_sec = self._admission.max_per_sec
+        if max_per_sec:
+            max_per_sec = int(math.ceil(max_per_sec / float(self._workers)))
+        self._shards = [ClientShard(ctx, index, self._worker_records,
+                                    max_per_sec)
+                        for index in range(self._workers)]
+        log.info("Started %d traffic client workers.", self._workers)
+
+    def _get_shard(self, trule):
+        """ Returns worker process running client of a rule. """
+        with self._shards_lock:
+            if not self._shards:
+                self._start_shards()
+        index = zlib.crc32(self.key(trule).encode()) % len(self._shards)
+        return self._shards[index]
+
+    def add_task(self, trule, ramp=False):
+        if self._workers > 1:
+            self._get_shard(trule).call('add_task', trule, ramp)
+        else:
+            super(ClientManager, self).add_task(trule, ramp)
+
+    def start(self, trule):
+        if self._workers > 1:
+            self._get_shard(trule).call('start', trule)
+        else:
+            super(ClientManager, self).start(trule)
+
+    def stop(self, trule):
+        if self._workers > 1:
+            self._get_shard(trule).call('stop', trule)
+        else:
+            super(ClientManager, self).stop(trule)
+
+    def num_tasks(self):
+        if self._shards:
+            return sum(x.call('num_tasks') for x in self._shards)
+        return super(ClientManager, self).num_tasks()
+
+    def _call_shards(self, cmd, trules, *args):
+        """
+        Runs bulk operation 'cmd' on rules in their workers, in parallel.
+        Returns merged report.
+        """
+        shard_rules = collections.OrderedDict()
+        for trule in trules:
+            shard_rules.setdefault(self._get_shard(trule), []).append(trule)
+        params = [(index, (shard, cmd, rules) + args, {})
+                  for index, (shard, rules) in enumerate(shard_rules.items())]
+        results = parallel.ThreadPool(lambda shard, *x: shard.call(*x),
+                                      params)
+        report = {}
+        for index, (_, rules) in enumerate(shard_rules.items()):
+            if index in results:
+                report.update(results[index])
+            else:   # Worker failed, error is logged.
+                report.update({self.key(x): task.TrafficTask.ERROR
+                               for x in rules})
+        return report
+
+    def start_many(self, trules):
+        if self._workers > 1:
+            return self._call_shards('start_many', trules)
+        return super(ClientManager, self).start_many(trules)
+
+    def stop_many(self, trules, timeout=None):
+        if self._workers > 1:
+            return self._call_shards('stop_many', trules, timeout)
+        return super(ClientManager, self).stop_many(trules, timeout)
+
+    def close_all(self, timeout=None):
+        with self._shards_lock:
+            shards, self._shards = self._shards, []
+        report = {}
+        if shards:
+            results = parallel.ThreadPool(
+                lambda x: x.close(timeout),
+                [(i, (x,), {}) for i, x in enumerate(shards)])
+            for result in results.values():
+                report.update(result)
+            # Workers have exited (flushing their records), so this is
+            # the last one.
+            self._worker_records.put(None)
+            self._forwarder.join(config.get_param('THREADS_JOIN_TIMEOUT'))
+            self._worker_records.close()
+            self._forwarder, self._worker_records = None, None
+        report.update(super(ClientManager, self).close_all(timeout))
+        return report
+
     def key(self, trule):
         # A client can be uniquely identified with the rule it is
         # attached to. Two clients can be alike except for the
@@ -78,7 +423,11 @@ class ClientManager(TrafficManager):
         return trule.ruleid
 
     def _create_task(self, trule):
-        return task.TrafficClientTask(self._record_queue, trule)
+        engine = self._get_engine(trule.src_target)
+        return task.TrafficClientTask(self._record_queue, trule, engine)
+
+    def _start_task(self, task, ramp=False):
+        task.start(delay=self._admission.admit(ramp))
 
 
 class ServerManager(TrafficManager):
@@ -90,10 +439,60 @@ class ServerManager(TrafficManager):
     """
     TASK_TYPE = task.TrafficTask.SERVER
 
+    def __init__(self):
+        # Rules using a server. Server is removed when no rule needs it.
+        self._server_rules = {}
+        super(ServerManager, self).__init__()
+
     def key(self, trule):
         # A server can be uniquely identified by its target host,
         # protocol and port associated.
         return (trule.dst_target.name, trule.protocol, trule.port)
 
     def _create_task(self, trule):
-        return task.TrafficServerTask(trule)
+        engine = self._get_engine(trule.dst_target)
+        return task.TrafficServerTask(trule, engine)
+
+    def add_task(self, trule, ramp=False):
+        key = self.key(trule)
+        self._server_rules.setdefault(key, set()).add(trule.ruleid)
+        if key in self._traffic_tasks:
+            return      # Server already listening for other rule(s).
+        super(ServerManager, self).add_task(trule, ramp)
+
+    def remove_task(self, trule):
+        """
+        Removes a rule from its server. Server stops listening once no
+        rule needs it.
+        """
+        key = self.key(trule)
+        ruleids = self._server_rules.get(key, set())
+        ruleids.discard(trule.ruleid)
+        if ruleids:
+            return
+        self._server_rules.pop(key, None)
+        _task = self._traffic_tasks.pop(key, None)
+        if _task:
+            _task.close()
+
+    def get_counters(self, rules=None):
+        """
+        Returns counters of all the servers (or of the ones serving any of
+        the rules, if provided), aggregated across their worker processes.
+        """
+        counters = []
+        for key, _task in list(self._traffic_tasks.items()):
+            ruleids = self._server_rules.get(key, set())
+            if rules and not ruleids.intersection(rules):
+                continue
+            target, protocol, port = key
+            record = {'target': target, 'protocol': protocol, 'port': port,
+                      'rules': sorted(ruleids)}
+            record.update(_task.get_counters())
+            counters.append(record)
+        return counters
+
+    def close_all(self, timeout=None):
+        report = super(ServerManager, self).close_all(timeout)
+        self._server_rules = {}
+        return report
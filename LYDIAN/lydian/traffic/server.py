@@ -5,30 +5,213 @@
 # in the root directory of this project.
 
 
-import http.server as hserver
+import asyncio
+import collections
+import errno
 import json
 import logging
+import multiprocessing
+import os
 import socket
 import threading
 import time
 
 from lydian.apps import config as config
-from lydian.traffic.connection import Connection
+from lydian.traffic.connection import Connection, time_ns
+from lydian.utils.common import is_linux
+if is_linux():
+    from lydian.utils import nsenter
 
 log = logging.getLogger(__name__)
 
 
+class ServerCounters(object):
+
+    FIELDS = ('accepts', 'active', 'requests', 'bytes_received',
+              'bytes_sent', 'errors', 'drops', 'ns_listen_overflows')
+    # Namespace wide values, i.e. of all listeners of the namespace (not
+    # just this server), counted since server was bound. Same for all the
+    # workers of a server.
+    NAMESPACE_FIELDS = ('ns_listen_overflows',)
+    _INDEX = {field: index for index, field in enumerate(FIELDS)}
+
+    OTHER_SOURCES = 'others'    # Sources beyond max_sources.
+    STATS_SIZE = 64 * 1024      # Size of shared snapshot of per type stats.
+
+    def __init__(self, shared=None):
+        """
+        Counters of a server. Besides the plain counters, errors are
+        counted by type and requests by source IP (upto max_sources).
+
+        shared, if provided, is storage created by shared() so that
+        counters of a worker process can be read (see read()) by its
+        parent. Per type stats are published there by publish(), so
+        parent sees them once every TRAFFIC_STATS_REPORT_INTERVAL.
+        """
+        values, self._stats = shared if shared is not None else (None, None)
+        self._values = values if values is not None else [0] * len(self.FIELDS)
+        self._errors = collections.Counter()
+        self._sources = collections.Counter()
+        self._max_sources = config.get_param('TRAFFIC_SERVER_MAX_SOURCES',
+                                             1024)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, ctx=multiprocessing):
+        return (ctx.Array('q', len(cls.FIELDS), lock=False),
+                ctx.Array('c', cls.STATS_SIZE))
+
+    def incr(self, field, count=1):
+        with self._lock:
+            self._values[self._INDEX[field]] += count
+
+    def set(self, field, value):
+        self._values[self._INDEX[field]] = value
+
+    def error(self, err):
+        """ Counts an error (exception or its name). """
+        if not isinstance(err, str):
+            err = errno.errorcode.get(getattr(err, 'errno', None),
+                                      type(err).__name__)
+        with self._lock:
+            self._values[self._INDEX['errors']] += 1
+            self._errors[err] += 1
+
+    def request(self, source, count=1):
+        """ Counts requests from a source IP. """
+        with self._lock:
+            self._values[self._INDEX['requests']] += count
+            if source not in self._sources and \
+                    len(self._sources) >= self._max_sources:
+                source = self.OTHER_SOURCES
+            self._sources[source] += count
+
+    def as_dict(self):
+        counters = dict(zip(self.FIELDS, self._values[:]))
+        with self._lock:
+            counters['errors_by_type'] = dict(self._errors)
+            counters['sources'] = dict(self._sources)
+        return counters
+
+    def publish(self):
+        """ Publishes per type stats to shared storage, if any. """
+        if self._stats is None:
+            return
+        with self._lock:
+            errors, sources = dict(self._errors), self._sources.most_common()
+        while True:
+            data = json.dumps({'errors_by_type': errors,
+                               'sources': dict(sources)}).encode()
+            if len(data) < self.STATS_SIZE or not sources:
+                break
+            sources = sources[:len(sources) // 2]   # Busiest ones fit.
+        with self._stats.get_lock():
+            self._stats.value = data[:self.STATS_SIZE - 1]
+
+    @classmethod
+    def read(cls, shared):
+        """ Returns counters published in shared storage. """
+        values, stats = shared
+        counters = dict(zip(cls.FIELDS, values[:]))
+        with stats.get_lock():
+            data = stats.value
+        try:
+            counters.update(json.loads(data.decode()) if data else {})
+        except ValueError:
+            pass    # Not published yet.
+        counters.setdefault('errors_by_type', {})
+        counters.setdefault('sources', {})
+        return counters
+
+    @classmethod
+    def aggregate(cls, counters, others):
+        """ Adds up counters of a worker (others) to counters. """
+        for field in cls.FIELDS:
+            if field in cls.NAMESPACE_FIELDS:
+                counters[field] = max(counters[field], others[field])
+            else:
+                counters[field] += others[field]
+        for field in ('errors_by_type', 'sources'):
+            merged = collections.Counter(counters[field])
+            merged.update(others[field])
+            counters[field] = dict(merged)
+        return counters
+
+
+def _proc_net_path(fname):
+    """
+    Returns path of /proc/net file of calling thread's network namespace.
+    """
+    path = os.path.join('/proc/thread-self/net', fname)
+    if not os.path.exists(path):
+        path = os.path.join('/proc/self/net', fname)
+    return path
+
+
+def read_listen_overflows():
+    """
+    Returns ListenOverflows (connections dropped as accept queue was
+    full) of calling thread's network namespace.
+    """
+    with open(_proc_net_path('netstat')) as fd:
+        lines = fd.readlines()
+    for names, values in zip(lines[::2], lines[1::2]):
+        if names.startswith('TcpExt:'):
+            stats = dict(zip(names.split()[1:], values.split()[1:]))
+            return int(stats['ListenOverflows'])
+    return None
+
+
+THREAD_NETNS = '/proc/thread-self/ns/net'
+
+
+def _call_in_netns(netns, func):
+    """
+    Calls func in network namespace of fd netns (closed after), if not
+    None. Calling thread returns to its own namespace after.
+    """
+    if netns is None:
+        return func()
+    try:
+        own = os.open(THREAD_NETNS, os.O_RDONLY)
+        try:
+            if os.fstat(own).st_ino == os.fstat(netns).st_ino:
+                return func()
+            nsenter.setns(netns)
+            try:
+                return func()
+            finally:
+                nsenter.setns(own)
+        finally:
+            os.close(own)
+    finally:
+        os.close(netns)
+
+
+def _serve_worker(server_cls, kwargs):
+    """ Runs a server worker process (blocks till terminated). """
+    server = server_cls(**kwargs)
+    server.start()
+
+
 class Server(Connection):
 
     def __init__(self, port=None, max_conns=None,
-                 handler=None, verbose=False, ipv6=False):
+                 handler=None, verbose=False, ipv6=False, workers=None,
+                 reuse_port=False, counters=None):
         """
         A basic TCP Server connection listener with default echo reply
         message handler.
+
+        With workers > 1, that many processes (this one included) serve
+        the port. Each binds it with SO_REUSEPORT and kernel balances
+        connections / datagrams among them. Their counters are
+        aggregated by get_counters().
         """
         self.host = ''   # blank on server side
         self.port = self.DEFAULT_TCP_SERVER_PORT if port is None else port
-        self.max_conns = self.MAX_CONNS if max_conns is None else max_conns
+        self.max_conns = max_conns or config.get_param('TRAFFIC_SERVER_BACKLOG',
+                                                       self.MAX_CONNS)
         self._handler = self.echo_handler if handler is None else handler
 
         super(Server, self).__init__(verbose=verbose)
@@ -37,174 +220,764 @@ class Server(Connection):
         self.socket = None
         self.ipv6 = ipv6
 
-    def echo_handler(self, payload):
-        raise NotImplementedError("Handler not implemented in %s" % self.__class__.__name__)
+        self.workers = int(workers or
+                           config.get_param('TRAFFIC_SERVER_WORKERS', 1))
+        self.reuse_port = reuse_port or self.workers > 1
+        self.counters = ServerCounters(counters)
+        self._workers = []          # (worker process, its shared counters)
+        self._last_sample = (time.monotonic(), 0)   # for rate of requests
 
+        self._loop = None           # Event loop serving, if any.
+        self._stop_waiter = None
 
-class TCPServer(Server):
+    def _set_reuse_port(self, sock):
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
-    def _create_socket(self):
+    def _start_workers(self):
         """
-        Returns a simple TCP server socket.
+        Starts worker processes serving the same port. Processes are
+        spawned (not forked) as this process runs many threads.
         """
-        sock_type = socket.AF_INET6 if self.ipv6 else socket.AF_INET
-        self.socket = socket.socket(sock_type, socket.SOCK_STREAM)
+        ctx = multiprocessing.get_context('spawn')
+        for _ in range(self.workers - 1):
+            shared = ServerCounters.shared(ctx)
+            kwargs = {
+                'port': self.port,
+                'max_conns': self.max_conns,
+                'verbose': self.verbose,
+                'ipv6': self.ipv6,
+                'workers': 1,
+                'reuse_port': True,
+                'counters': shared
+                }
+            proc = ctx.Process(target=_serve_worker,
+                               args=(type(self), kwargs), daemon=True)
+            proc.start()
+            self._workers.append((proc, shared))
+
+    async def _aoff_loop(self, func):
+        """
+        Runs blocking func (e.g. starting / stopping workers) in an
+        executor thread, so that it doesn't hold up other users of the
+        event loop. It is run in namespace of serving thread as worker
+        processes inherit it.
+        """
+        netns = None
+        if is_linux() and os.path.exists(THREAD_NETNS):
+            netns = os.open(THREAD_NETNS, os.O_RDONLY)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, _call_in_netns, netns, func)
+
+    def _stop_workers(self):
+        for proc, _ in self._workers:
+            proc.terminate()
+        for proc, _ in self._workers:
+            proc.join(config.get_param('THREADS_JOIN_TIMEOUT'))
+        # Counters of stopped workers are kept for get_counters().
+
+    def get_counters(self):
+        """
+        Returns counters aggregated across worker processes, along with
+        requests (e.g. datagrams for UDP) per second since last call.
+        """
+        counters = self.counters.as_dict()
+        for _, shared in self._workers:
+            ServerCounters.aggregate(counters, ServerCounters.read(shared))
+        counters['workers'] = 1 + len([p for p, _ in self._workers
+                                       if p.is_alive()])
+
+        now = time.monotonic()
+        last_time, last_requests = self._last_sample
+        elapsed = now - last_time
+        counters['requests_per_sec'] = round(
+            (counters['requests'] - last_requests) / elapsed, 2) \
+            if elapsed > 0 else 0
+        self._last_sample = (now, counters['requests'])
+        return counters
+
+    def _refresh_stats(self):
+        """ Refreshes counters read from kernel. """
+        pass
+
+    async def _arefresh_stats(self):
+        """
+        Periodically refreshes counters read from kernel (from serving
+        thread, so in its namespace) and publishes them for parent
+        process, if a worker.
+        """
+        interval = config.get_param('TRAFFIC_STATS_REPORT_INTERVAL', 1)
+        while True:
+            try:
+                self._refresh_stats()
+            except (OSError, IndexError, KeyError, ValueError) as err:
+                log.debug("Unable to read %s stats : %r",
+                          self.__class__.__name__, err)
+            self.counters.publish()
+            await asyncio.sleep(interval)
+
+    def echo_handler(self, payload):
+        raise NotImplementedError("Handler not implemented in %s" % self.__class__.__name__)
+
+    async def aserve(self):
+        """
+        Serves on the running event loop (e.g. of a TrafficEngine) till
+        stopped. Stop event must be cleared by caller before scheduling it.
+        """
+        raise NotImplementedError("aserve not implemented in %s" %
+                                  self.__class__.__name__)
+
+    async def _await_stop(self):
+        """ Waits till server is stopped (from any thread). """
+        loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._stop_waiter = loop.create_future()
+        try:
+            if not self.is_event_set():
+                await self._stop_waiter
+        finally:
+            self._loop, self._stop_waiter = None, None
+
+    def _wake(self):
+        if self._stop_waiter and not self._stop_waiter.done():
+            self._stop_waiter.set_result(None)
 
     def start(self):
         """
         API to start server at the requested port and other settings.
+        Blocks till server is stopped.
         """
+        loop = None
         try:
             self.clear_event()
-            # Create a socket
-            self._create_socket()
-
-            # Bind ot the port
-            self.socket.bind((self.host, self.port))
-
-            # accept call from client
-            self.socket.listen(self.max_conns)
-
-            if self.verbose:  # TODO : more stringent check
-                self.log.info(
-                    "TCP Server started on %s:%s",
-                    self.host,
-                    self.port)
-
-            while not self.is_event_set():
-                conn, addr = self.socket.accept()
-                if self.verbose:
-                    msg = "Connection request received from: %s:%s" % (addr[0], addr[1])
-                    self.log.info(msg)
-                self._handler(conn)
+            # Socket is created in the calling thread (e.g. in namespace).
+            self._listen()
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.aserve())
         except Exception as err:
-            log.error("Error in starting (TCP) server : %r", err, exc_info=err)
+            log.error("Error in starting (%s) server : %r",
+                      self.__class__.__name__, err, exc_info=err)
         finally:
-            self.close()
+            if loop:
+                loop.close()
+            self.set_event()
+            self.socket_close()
+
+    def stop(self):
+        super(Server, self).stop()
+        loop = self._loop
+        if loop and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass    # loop closed meanwhile.
+
+    def close(self):
+        # Socket is closed by the serving loop.
+        self.stop()
+
+
+# BufferedProtocol (python 3.7+) reads into a given buffer, letting sink
+# discard data without allocating it first.
+_Protocol = getattr(asyncio, 'BufferedProtocol', asyncio.Protocol)
 
-    def echo_handler(self, conn):
+
+class TCPEchoProtocol(_Protocol):
+
+    # What a connection is serving. Decided by what client sends first.
+    ECHO = 'echo'       # one-shot client. Echo a message and close.
+    FRAME = 'frame'     # persistent client. Echo frames till client closes.
+    SINK = 'sink'       # throughput client. Discard stream, reply its size.
+    DONE = 'done'
+
+    # Seconds to wait for rest of a magic before taking what a client sent
+    # (a prefix of some magic, e.g. b'L') as a one-shot message.
+    MODE_WAIT = 0.2
+
+    def __init__(self, server):
         """
-        A simple default echo message handler.
+        Serves a connection of TCPServer on event loop.
         """
-        data = conn.recv(self.MAX_PAYLOAD_SIZE)
-        conn.send(data)  # send same data back as echo
-        conn.close()    # close immediately.
+        self._server = server
+        self._transport = None
+        self._mode = None
+        self._buf = bytearray()
+        self._expected = None   # bytes expected by sink (0 : till EOF)
+        self._received = 0      # bytes received by sink
+        self._peer = None       # Client IP
+        self._stamp = None      # receive time of a timestamped request
+        self._mode_timer = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._server.connections.add(self)
+        self._server.counters.incr('accepts')
+        self._server.counters.incr('active')
+        addr = transport.get_extra_info('peername') or ('',)
+        self._peer = addr[0]
+        if self._server.verbose:
+            log.info("Connection request received from: %s:%s",
+                     addr[0], addr[1])
+
+    def connection_lost(self, exc):
+        self._cancel_mode_timer()
+        self._server.connections.discard(self)
+        self._server.counters.incr('active', -1)
+        if exc:
+            self._server.counters.error(exc)
+        self._transport = None
+
+    def _write(self, data):
+        self._server.counters.incr('bytes_sent', len(data))
+        self._transport.write(data)
+
+    def close(self):
+        if self._transport:
+            self._transport.close()
+
+    def pause_writing(self):
+        # Peer isn't reading echoes. Stop reading till it catches up.
+        self._transport.pause_reading()
+
+    def resume_writing(self):
+        self._transport.resume_reading()
+
+    def _get_mode(self):
+        server = self._server
+        magics = (server.FRAME_MAGIC, server.SINK_MAGIC, server.TS_MAGIC)
+        head = bytes(self._buf[:len(server.FRAME_MAGIC)])
+        if head == server.FRAME_MAGIC:
+            return self.FRAME
+        if head == server.SINK_MAGIC:
+            return self.SINK
+        if head == server.TS_MAGIC:
+            self._stamp = time_ns()
+            return self.ECHO
+        if len(head) < len(server.FRAME_MAGIC) and \
+                any(magic.startswith(head) for magic in magics):
+            return None     # Can't tell yet.
+        return self.ECHO
+
+    def _cancel_mode_timer(self):
+        if self._mode_timer:
+            self._mode_timer.cancel()
+            self._mode_timer = None
+
+    def _on_mode_wait(self):
+        # One-shot clients don't half close. Echo what came.
+        self._mode_timer = None
+        if self._mode is None and self._transport:
+            self._echo()
+
+    def data_received(self, data):
+        self._server.counters.incr('bytes_received', len(data))
+        if self._mode == self.SINK and self._expected is not None:
+            self._sink(len(data))   # Discard.
+            return
+        if self._mode == self.DONE:
+            return
+        self._buf.extend(data)
+        if self._mode is None:
+            self._mode = self._get_mode()
+            if self._mode is None:
+                if not self._mode_timer:
+                    self._mode_timer = asyncio.get_event_loop().call_later(
+                        self.MODE_WAIT, self._on_mode_wait)
+                return
+            self._cancel_mode_timer()
+
+        if self._mode == self.ECHO:
+            self._echo()
+        elif self._mode == self.FRAME:
+            self._echo_frames()
+        elif self._mode == self.SINK:
+            self._start_sink()
+
+    def get_buffer(self, sizehint):
+        # Buffer is shared by all connections of the server. Data read into
+        # it is consumed before loop reads from another connection.
+        return self._server.recv_buffer
+
+    def buffer_updated(self, nbytes):
+        if self._mode == self.SINK and self._expected is not None:
+            self._server.counters.incr('bytes_received', nbytes)
+            self._sink(nbytes)      # Discard.
+            return
+        self.data_received(bytes(self._server.recv_buffer[:nbytes]))
+
+    def eof_received(self):
+        if self._mode is None and self._buf:
+            self._echo()
+        elif self._mode == self.SINK and self._expected is not None:
+            self._sink_reply()
+        return False    # close connection.
+
+    def _echo(self):
+        self._cancel_mode_timer()
+        self._mode = self.DONE
+        self._server.counters.request(self._peer)
+        if self._stamp:
+            self._buf.extend(self._server.TS_TRAILER.pack(self._stamp,
+                                                          time_ns()))
+        self._write(bytes(self._buf))       # send same data back
+        self._transport.close()             # close immediately.
+
+    def _echo_frames(self):
+        server = self._server
+        hsize = server.FRAME_HEADER.size
+        received = None
+        while len(self._buf) >= hsize:
+            try:
+                size = hsize + server.frame_length(bytes(self._buf[:hsize]))
+            except ValueError as err:
+                if server.verbose:
+                    log.info("Persistent connection error : %r", err)
+                server.counters.error('bad_frame')
+                self._mode = self.DONE
+                self._transport.close()
+                return
+            if len(self._buf) < size:
+                break
+            server.counters.request(self._peer)
+            if self._buf[hsize:hsize + len(server.TS_MAGIC)] == \
+                    server.TS_MAGIC:
+                received = received or time_ns()
+                trailer = server.TS_TRAILER.pack(received, time_ns())
+                self._write(server.frame(bytes(self._buf[hsize:size]) +
+                                         trailer))
+            else:
+                self._write(bytes(self._buf[:size]))  # echo frame
+            del self._buf[:size]
+
+    def _start_sink(self):
+        hsize = self._server.SINK_HEADER.size
+        if len(self._buf) < hsize:
+            return
+        _, self._expected = self._server.SINK_HEADER.unpack(
+            bytes(self._buf[:hsize]))
+        count = len(self._buf) - hsize
+        self._buf = bytearray()
+        self._sink(count)
+
+    def _sink(self, count):
+        self._received += count
+        if self._expected and self._received >= self._expected:
+            self._sink_reply()
+
+    def _sink_reply(self):
+        self._mode = self.DONE
+        self._server.counters.request(self._peer)
+        self._write(self._server.SINK_REPLY.pack(self._received))
+        self._transport.close()
 
 
-class UDPServer(Server):
+class TCPServer(Server):
+
+    def __init__(self, *args, **kwargs):
+        """
+        TCP Server serving all its connections from an event loop
+        (selectors / epoll based), so a slow or stalled client doesn't
+        hold up others.
+        """
+        super(TCPServer, self).__init__(*args, **kwargs)
+        self.connections = set()
+        self._overflows_base = None     # ListenOverflows when bound.
+        self.recv_buffer = memoryview(bytearray(self.MAX_FRAME_SIZE))
 
     def _create_socket(self):
         """
         Returns a simple TCP server socket.
         """
         sock_type = socket.AF_INET6 if self.ipv6 else socket.AF_INET
-        self.socket = socket.socket(sock_type, socket.SOCK_DGRAM)
+        self.socket = socket.socket(sock_type, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._set_reuse_port(self.socket)
+
+    def _refresh_stats(self):
+        overflows = read_listen_overflows()
+        if overflows is None:
+            return
+        if self._overflows_base is None:
+            self._overflows_base = overflows
+        self.counters.set('ns_listen_overflows',
+                          overflows - self._overflows_base)
+
+    def echo_handler(self):
+        """
+        Returns (asyncio) protocol serving a connection with default echo
+        behavior. A custom handler, if any, must be a protocol factory.
+        """
+        return TCPEchoProtocol(self)
 
-    def start(self):
+    def _listen(self):
+        self._create_socket()
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.max_conns)
+        self.socket.setblocking(False)
+        try:
+            # Namespace wide and since boot. Overflows are counted from here.
+            self._overflows_base = read_listen_overflows()
+        except (OSError, KeyError, ValueError) as err:
+            log.debug("Unable to read listen overflows : %r", err)
+
+    async def aserve(self):
         """
-        API to start server at the requested port and other settings.
+        Serves connections on the running event loop till stopped.
         """
+        loop = asyncio.get_event_loop()
+        if not self.socket:
+            self._listen()
         try:
-            self.clear_event()
-            # Create a socket
-            self._create_socket()
+            server = await loop.create_server(self._handler, sock=self.socket)
+        except (Exception, asyncio.CancelledError):
+            self.socket_close()
+            raise
+        if self.verbose:  # TODO : more stringent check
+            self.log.info("%s started on %s:%s", self.__class__.__name__,
+                          self.host, self.port)
+        stats = asyncio.ensure_future(self._arefresh_stats())
+        try:
+            if self.workers > 1:
+                await self._aoff_loop(self._start_workers)
+            await self._await_stop()
+        finally:
+            stats.cancel()
+            if self._workers:
+                await self._aoff_loop(self._stop_workers)
+            server.close()
+            for conn in list(self.connections):
+                conn.close()
+            self.socket = None      # closed along with server.
+            self.set_event()
 
-            # Bind at the port
-            self.socket.bind((self.host, self.port))
 
-            if self.verbose:  # TODO : more stringent check
-                self.log.info("UDP Server started on %s:%s", self.host, self.port)
+class UDPServer(Server):
 
-            while not self.is_event_set():
-                data, addr = self.socket.recvfrom(self.MAX_PAYLOAD_SIZE)
-                if self.verbose:
-                    msg = "Connection request received from: %s:%s" % (addr[0], addr[1])
-                    self.log.info(msg)
-                self._handler(data, addr)
-        except Exception as err:
-            log.error("Error in starting (UDP) server : %r", err, exc_info=err)
-        finally:
-            self.close()
+    MAX_DATAGRAM_SIZE = 65535
+
+    def __init__(self, *args, **kwargs):
+        """
+        UDP Server echoing datagrams from event loop. Datagrams are read
+        into a preallocated buffer, in batches on every readiness event.
+        """
+        super(UDPServer, self).__init__(*args, **kwargs)
+        self.recv_buffer = memoryview(bytearray(self.MAX_DATAGRAM_SIZE))
+        self._batch = config.get_param('TRAFFIC_UDP_RECV_BATCH', 64)
+
+    def _create_socket(self):
+        """
+        Returns a simple UDP server socket.
+        """
+        sock_type = socket.AF_INET6 if self.ipv6 else socket.AF_INET
+        self.socket = socket.socket(sock_type, socket.SOCK_DGRAM)
+        self._set_reuse_port(self.socket)
+        for option, param in ((socket.SO_RCVBUF, 'TRAFFIC_UDP_RCVBUF'),
+                              (socket.SO_SNDBUF, 'TRAFFIC_UDP_SNDBUF')):
+            size = config.get_param(param, 0)
+            if not size:
+                continue    # System default.
+            try:
+                self.socket.setsockopt(socket.SOL_SOCKET, option, size)
+            except OSError as err:
+                log.warning("Unable to set %s to %s : %r", param, size, err)
+
+    def _listen(self):
+        self._create_socket()
+        self.socket.bind((self.host, self.port))
+        self.socket.setblocking(False)
 
     def echo_handler(self, data, addr):
         """
         A simple default echo message handler.
         """
+        if self.verbose:
+            msg = "Connection request received from: %s:%s" % (addr[0], addr[1])
+            self.log.info(msg)
         if data:
-            self.socket.sendto(data, addr)  # send same data back as echo
-
+            if data[:len(self.TS_MAGIC)] == self.TS_MAGIC:
+                received = time_ns()
+                data = bytes(data) + self.TS_TRAILER.pack(received, time_ns())
+            try:
+                self.socket.sendto(data, addr)  # send same data back as echo
+                self.counters.incr('bytes_sent', len(data))
+            except OSError as err:
+                # e.g. send buffer full. Client sees it as a loss.
+                self.counters.error(err)
+
+    def _on_readable(self):
+        """ Drains upto a batch of datagrams from socket. """
+        sock, buf = self.socket, self.recv_buffer
+        sources, nbytes = {}, 0
+        try:
+            for _ in range(self._batch):
+                size, addr = sock.recvfrom_into(buf)
+                sources[addr[0]] = sources.get(addr[0], 0) + 1
+                nbytes += size
+                self._handler(buf[:size], addr)
+        except (BlockingIOError, InterruptedError):
+            pass    # Drained.
+        except OSError as err:
+            self.counters.error(err)
+            if self.verbose:
+                log.info("UDP Server error : %r", err)
+        finally:
+            for source, count in sources.items():
+                self.counters.request(source, count)
+            self.counters.incr('bytes_received', nbytes)
 
-try:
-    _HTTPServer = hserver.ThreadingHTTPServer
-except AttributeError:
-    import socketserver
-    class _HTTPServer(socketserver.ThreadingMixIn, hserver.HTTPServer):
-        pass
+    def _refresh_stats(self):
+        """
+        Reads datagrams dropped by kernel (e.g. receive buffer full) on
+        server socket from /proc/net/udp.
+        """
+        inode = str(os.fstat(self.socket.fileno()).st_ino)
+        with open(_proc_net_path('udp6' if self.ipv6 else 'udp')) as fd:
+            next(fd)    # header
+            for line in fd:
+                fields = line.split()
+                if fields[9] == inode:
+                    self.counters.set('drops', int(fields[-1]))
+                    return
+
+    async def aserve(self):
+        """
+        Serves datagrams on the running event loop till stopped.
+        """
+        loop = asyncio.get_event_loop()
+        if not self.socket:
+            self._listen()
+        fileno = self.socket.fileno()
+        loop.add_reader(fileno, self._on_readable)
+        stats = asyncio.ensure_future(self._arefresh_stats())
+        if self.verbose:  # TODO : more stringent check
+            self.log.info("UDP Server started on %s:%s", self.host, self.port)
+        try:
+            if self.workers > 1:
+                await self._aoff_loop(self._start_workers)
+            await self._await_stop()
+        finally:
+            stats.cancel()
+            loop.remove_reader(fileno)
+            if self._workers:
+                await self._aoff_loop(self._stop_workers)
+            self.socket_close()
+            self.set_event()
 
 
-class _HTTPServerV6(_HTTPServer):
-    address_family = socket.AF_INET6
+class HTTPProtocol(asyncio.Protocol):
 
+    MAX_HEADER_SIZE = 64 * 1024
+    BYTES_ENDPOINT = '/bytes/'
+    REASONS = {200: 'OK', 400: 'Bad Request', 413: 'Payload Too Large',
+               431: 'Request Header Fields Too Large',
+               501: 'Not Implemented'}
 
-class HTTPServer(Server):
+    def __init__(self, server):
+        """
+        Serves a (HTTP/1.1, keep-alive) connection of HTTPServer on event
+        loop. Pipelined requests are answered in order.
+        """
+        self._server = server
+        self._transport = None
+        self._buf = bytearray()
+        self._discard = 0       # Request body bytes yet to be discarded.
+        self._pending = 0       # Response body bytes yet to be written.
+        self._keepalive = True
+        self._paused = False
+        self._closing = False
+        self._peer = None       # Client IP
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._server.connections.add(self)
+        self._server.counters.incr('accepts')
+        self._server.counters.incr('active')
+        self._peer = (transport.get_extra_info('peername') or ('',))[0]
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            # Headers and body are separate writes. Don't let Nagle hold
+            # the body back on a kept alive connection.
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def connection_lost(self, exc):
+        self._server.connections.discard(self)
+        self._server.counters.incr('active', -1)
+        if exc:
+            self._server.counters.error(exc)
+        self._transport = None
+
+    def close(self):
+        if self._transport:
+            self._transport.close()
+
+    def pause_writing(self):
+        # Peer isn't reading responses. Stop reading till it catches up.
+        self._paused = True
+        self._transport.pause_reading()
+
+    def resume_writing(self):
+        self._paused = False
+        self._transport.resume_reading()
+        self._pump()
+
+    def data_received(self, data):
+        self._server.counters.incr('bytes_received', len(data))
+        if self._closing:
+            return
+        self._buf.extend(data)
+        if not self._pending:
+            self._process()
+
+    def _process(self):
+        """ Serves complete requests received so far. """
+        while not (self._closing or self._pending):
+            if self._discard:
+                count = min(self._discard, len(self._buf))
+                del self._buf[:count]
+                self._discard -= count
+                if self._discard:
+                    return
+            end = self._buf.find(b'\r\n\r\n')
+            if end < 0:
+                if len(self._buf) > self.MAX_HEADER_SIZE:
+                    self._error(431)
+                return
+            head = bytes(self._buf[:end])
+            del self._buf[:end + 4]
+            self._handle(head)
+
+    def _parse_head(self, head):
+        lines = head.decode('latin-1').split('\r\n')
+        method, path, version = lines[0].split(' ')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return method, path, version, headers
+
+    def _handle(self, head):
+        try:
+            method, path, version, headers = self._parse_head(head)
+            if not version.startswith('HTTP/1.'):
+                raise ValueError("Unsupported version %s" % version)
+            self._discard = int(headers.get('content-length', 0))
+            if self._discard < 0:
+                raise ValueError("Invalid Content-Length")
+        except ValueError:
+            self._error(400)
+            return
+        if 'transfer-encoding' in headers:
+            self._error(501)    # Chunked requests are not supported.
+            return
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keepalive = connection == 'keep-alive'
+        else:
+            keepalive = connection != 'close'
+
+        self._server.counters.request(self._peer)
+        if self._server.verbose:
+            log.info("HTTP request %s %s from: %s", method, path, self._peer)
+        if method not in ('GET', 'HEAD'):
+            self._error(501)
+            return
+        self._respond(path, method == 'HEAD', keepalive)
+
+    def _respond(self, path, head_only, keepalive):
+        server = self._server
+        if path.startswith(self.BYTES_ENDPOINT):
+            try:
+                size = int(path[len(self.BYTES_ENDPOINT):])
+            except ValueError:
+                size = -1
+            if size < 0:
+                self._error(400)
+                return
+            if size > server.max_response_size:
+                self._error(413)
+                return
+            self._write_head(200, size, 'application/octet-stream',
+                             keepalive)
+            if not head_only:
+                self._pending = size
+        else:
+            response = bytes(json.dumps({
+                'status': 200,
+                'payload': path[1:]     # Return the path as response.
+                }), 'utf-8')
+            self._write_head(200, len(response), 'application/json',
+                             keepalive)
+            if not head_only:
+                self._transport.write(response)
+                server.counters.incr('bytes_sent', len(response))
+        self._keepalive = keepalive
+        if self._pending:
+            self._pump()
+        elif not keepalive:
+            self._close_after_write()
+
+    def _pump(self):
+        """
+        Writes pending (/bytes/) body as long as peer keeps reading, then
+        serves requests pipelined meanwhile.
+        """
+        chunk = self._server.body_chunk
+        while self._pending and not self._paused and self._transport:
+            count = min(self._pending, len(chunk))
+            self._transport.write(chunk[:count])
+            self._server.counters.incr('bytes_sent', count)
+            self._pending -= count
+        if self._pending or not self._transport:
+            return
+        if not self._keepalive:
+            self._close_after_write()
+        else:
+            self._process()
+
+    def _write_head(self, status, length, ctype, keepalive):
+        head = ('HTTP/1.1 %s %s\r\n'
+                'Content-type: %s\r\n'
+                'Access-Control-Allow-Origin: *\r\n'
+                'Content-Length: %s\r\n'
+                '%s\r\n') % (status, self.REASONS[status], ctype, length,
+                              '' if keepalive else 'Connection: close\r\n')
+        head = head.encode('latin-1')
+        self._transport.write(head)
+        self._server.counters.incr('bytes_sent', len(head))
+
+    def _error(self, status):
+        """ Replies with an error and closes connection. """
+        self._server.counters.error('http_%s' % status)
+        self._write_head(status, 0, 'text/plain', False)
+        self._close_after_write()
+
+    def _close_after_write(self):
+        # Transport closes once buffered responses are written.
+        self._closing = True
+        self._buf = bytearray()
+        self._transport.close()
+
+
+class HTTPServer(TCPServer):
     """
     Basic HTTP Server
-    """
-    BLOCKING_WAIT_TIME = 3
-
-    class _HTTPRequestHandler(hserver.SimpleHTTPRequestHandler):
 
-        def log_message(self, format, *args):
-            pass  # Log disabled.
-
-        def _set_headers(self):
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-
-        def do_HEAD(self):
-            self._set_headers()
-
-        def do_GET(self):
-            self.send_response(200)
-            self._set_headers()
-            response = json.dumps({
-                'status': 200,
-                'payload': self.path[1:]    # Return the path as response.
-                })
-
-            self.wfile.write(bytes(response, 'utf-8'))
+    Speaks HTTP/1.1 (with keep-alive) over TCPServer's event loop. GET
+    replies with the path (without leading '/') as payload in a JSON.
+    GET /bytes/<n> replies with n bytes of body.
+    """
+    WRITE_CHUNK_SIZE = 64 * 1024
 
     def __init__(self, *args, **kwargs):
         super(HTTPServer, self).__init__(*args, **kwargs)
-        self.verbose = kwargs.get('verbose', False)
-        if self.verbose:
-            self.handler = hserver.SimpleHTTPRequestHandler
-        else:
-            self.handler =  self._HTTPRequestHandler
-
-        self._Server = _HTTPServerV6 if self.ipv6 else _HTTPServer
-        self.httpd = None
-        self._thread = None
-        self.clear_event()
-
-    def start(self, blocking=True):
-        """ Starts HTTP Server. """
-        self.httpd = self._Server(("", self.port), self.handler)
-        self._thread = threading.Thread(target=self.httpd.serve_forever,
-                                        daemon=True)
-        self._thread.start()
-        if blocking:
-            # TCP / UDP server are blocking by default. blocking is set
-            # on by default here to match that behavior.
-            self._thread.join()
+        self.max_response_size = config.get_param(
+            'TRAFFIC_HTTP_MAX_RESPONSE_SIZE', 1024 * 1024 * 1024)
+        # /bytes/ responses are written from this chunk.
+        self.body_chunk = memoryview(b'x' * self.WRITE_CHUNK_SIZE)
 
-    def stop(self):
-        """ Stops HTTP Server. """
-        self.set_event()
-        if self.httpd:
-            self.httpd.shutdown()
-            self.httpd.server_close()
-        if self._thread:
-            self._thread.join(config.get_param('THREADS_JOIN_TIMEOUT'))
-        self._thread, self.httpd = None, None
+    def echo_handler(self):
+        """
+        Returns (asyncio) protocol serving a HTTP connection.
+        """
+        return HTTPProtocol(self)
@@ -4,18 +4,17 @@
 # The full license information can be found in LICENSE.txt
 # in the root directory of this project.
 
+import asyncio
+import concurrent.futures
 import logging
-import os
 import queue
-import threading
 
 from lydian.apps import config as config
 from lydian.traffic.core import TrafficRecord
+from lydian.traffic.engine import current_task
 from lydian.traffic.client import TCPClient, UDPClient, HTTPClient
 from lydian.traffic.server import TCPServer, UDPServer, HTTPServer
-from lydian.utils.common import is_ipv6_address, is_linux
-if is_linux():
-    from lydian.utils.nsenter import Namespace
+from lydian.utils.common import is_ipv6_address
 
 
 log = logging.getLogger(__name__)
@@ -25,14 +24,27 @@ class TrafficTask(object):
 
     CLIENT = 'CLIENT'
     SERVER = 'SERVER'
-    LINUX_NS_DIR = '/var/run/netns/'
 
-    def __init__(self, trule):
+    # Outcomes of bulk operations (see TrafficManager), per task.
+    STARTED = 'started'
+    RUNNING = 'running'     # already
+    DONE = 'done'           # stopped / closed
+    TIMEOUT = 'timeout'     # didn't finish in time
+    ERROR = 'error'
+    MISSING = 'missing'     # no such task
+
+    def __init__(self, trule, engine):
+        """
+        Traffic task (client / server) of a rule. Task is not run in a
+        thread of its own but is driven by the (event loop) engine of its
+        target.
+        """
         self._task = None
-        self._type = None
         self._trule = trule   # Traffic Rule
-        self._task_thread = None
-        self._ns_task_iter = None   # used only in NS Tasks
+        self._engine = engine
+        self._future = None   # Task coroutine running on engine.
+        self._atask = None    # and its asyncio task, once running.
+        self._cancelled = False
         self._create_task()
 
     def is_client(self):
@@ -49,6 +61,10 @@ class TrafficTask(object):
     def traffic_rule(self):
         return self._trule
 
+    @property
+    def engine(self):
+        return self._engine
+
     def _create_task(self):
         if self.target.is_vmhost():
             self._create_vmhost_task()
@@ -69,48 +85,101 @@ class TrafficTask(object):
     def _create_container_task(self):
         raise NotImplementedError("_create_container_task")
 
-    def _ns_task_helper(self, ns_name, func):
-        with Namespace(os.path.join(self.LINUX_NS_DIR,ns_name), 'net'):
-            yield func()
+    def _run(self, **kwargs):
+        """ Returns coroutine which runs the task on engine. """
+        raise NotImplementedError("_run")
 
-    def start(self, blocking=False):
+    async def _arun(self, **kwargs):
+        if self._cancelled:
+            return      # Cancelled before it got to run.
+        self._atask = current_task()
+        try:
+            return await self._run(**kwargs)
+        finally:
+            self._atask = None
+
+    def start(self, blocking=False, **kwargs):
+        if self.is_running():
+            log.info("Traffic %s already running for rule : %s",
+                     self._type.lower(), self._trule.ruleid)
+            return
+        # Reset here, not in the coroutine, so that a stop / close before
+        # it gets to run on engine isn't lost.
+        self._task.clear_event()
+        self._atask, self._cancelled = None, False
+        self._future = self._engine.submit(self._arun(**kwargs))
         if blocking:
-            self._task.start()
+            self._future.result()
+
+    def _cancel_on_loop(self):
+        if self._atask:
+            self._atask.cancel()
         else:
-            self._task_thread = threading.Thread(target=self._task.start,
-                                                 daemon=True)
-            self._task_thread.start()
+            self._cancelled = True
+
+    def _cancel(self):
+        """
+        Cancels task coroutine on engine. Its future is done (see join)
+        only once coroutine has finished cleaning up.
+        """
+        loop = self._engine.loop
+        if not self.is_running() or not loop:
+            return
+        try:
+            loop.call_soon_threadsafe(self._cancel_on_loop)
+        except RuntimeError:
+            pass    # Engine stopped meanwhile.
+
+    def join(self, timeout=None):
+        """
+        Waits (upto timeout seconds) for task coroutine on engine to
+        finish. Returns outcome : DONE, TIMEOUT or ERROR.
+        """
+        future, self._future = self._future, None
+        if not future:
+            return self.DONE
+        try:
+            future.result(timeout)
+        except concurrent.futures.CancelledError:
+            pass
+        except concurrent.futures.TimeoutError:
+            return self.TIMEOUT
+        except Exception as err:
+            log.error("Error in traffic %s for rule %s : %r",
+                      self._type.lower(), self._trule.ruleid, err)
+            return self.ERROR
+        return self.DONE
 
     def _join_thread(self):
-        if self._task_thread:
-            self._task_thread.join(config.get_param('THREADS_JOIN_TIMEOUT'))
-            self._task_thread = None
-
-    def stop(self):
+        """ Waits for task coroutine on engine to finish. """
+        return self.join(config.get_param('THREADS_JOIN_TIMEOUT'))
+
+    def stop(self, blocking=True):
+        """
+        Stops task. If not blocking, it is only signalled to stop and
+        join() waits for it.
+        """
         self._task.stop()
-        self._join_thread()
+        self._cancel()
+        if blocking:
+            self._join_thread()
 
-    def close(self):
+    def close(self, blocking=True):
         self._task.close()
-        self._join_thread()
-        if self._ns_task_iter:
-            # release resources.
-            try:
-                next(self._ns_task_iter)
-            except StopIteration:
-                pass    # expected.
-            self._ns_task_iter = None
+        self._cancel()
+        if blocking:
+            self._join_thread()
 
     def is_running(self):
-        return not self._task.stopped()
+        return bool(self._future and not self._future.done())
 
 
 class TrafficClientTask(TrafficTask):
 
-    def __init__(self, record_queue, trule):
+    def __init__(self, record_queue, trule, engine):
         self._record_queue = record_queue
         self._type = self.CLIENT
-        super(TrafficClientTask, self).__init__(trule)
+        super(TrafficClientTask, self).__init__(trule, engine)
 
     @property
     def target(self):
@@ -120,6 +189,17 @@ class TrafficClientTask(TrafficTask):
     def record_queue(self):
         return self._record_queue
 
+    async def _run(self, delay=None):
+        if delay:
+            await asyncio.sleep(delay)
+        await self._task.arun()
+
+    def start(self, blocking=False, delay=None):
+        """
+        Starts client on engine, after delay (seconds), if provided.
+        """
+        super(TrafficClientTask, self).start(blocking=blocking, delay=delay)
+
     def _get_client(self):
         kwargs = {}
         kwargs['server'] = self.traffic_rule.dst
@@ -136,12 +216,21 @@ class TrafficClientTask(TrafficTask):
         kwargs['interval'] = getattr(self.traffic_rule, 'interval', None)
         kwargs['verbose'] = getattr(self.traffic_rule, 'verbose', None)
         kwargs['attempts'] = getattr(self.traffic_rule, 'attempts', None)
+        kwargs['persistent'] = getattr(self.traffic_rule, 'persistent', None)
+        kwargs['timestamps'] = getattr(self.traffic_rule, 'timestamps', None)
 
         if self.traffic_rule.is_TCP():
+            kwargs['mode'] = getattr(self.traffic_rule, 'mode', None)
+            kwargs['packet'] = getattr(self.traffic_rule, 'packet', None)
+            kwargs['duration'] = getattr(self.traffic_rule, 'duration', None)
+            kwargs['concurrency'] = getattr(self.traffic_rule, 'concurrency',
+                                            None)
+            kwargs['cps'] = getattr(self.traffic_rule, 'cps', None)
             return TCPClient(**kwargs)
         elif self.traffic_rule.is_UDP():
             return UDPClient(**kwargs)
         elif self.traffic_rule.is_HTTP():
+            kwargs['pipeline'] = getattr(self.traffic_rule, 'pipeline', None)
             return HTTPClient(**kwargs)
         else:
             msg = "LYDIAN: Unsupported protocol on rule %s" % self._trule
@@ -151,11 +240,11 @@ class TrafficClientTask(TrafficTask):
         self._task = self._get_client()
 
     def _create_namspace_task(self):
-        self._ns_task_iter = self._ns_task_helper(self.target.name,
-                                                  self._get_client)
-        self._task = next(self._ns_task_iter)
+        # Engine for a namespace target runs inside the namespace, so
+        # sockets of the client are created in it.
+        self._task = self._get_client()
 
-    def ping_handler(self, payload, data, latency, error=None):
+    def ping_handler(self, payload, data, latency, error=None, **stats):
         try:
             rec = TrafficRecord()
             rec.source = self._trule.src
@@ -169,6 +258,8 @@ class TrafficClientTask(TrafficTask):
             rec.latency = latency
             if not rec.result:
                 rec.error = '%s' % error
+            for key, val in stats.items():
+                setattr(rec, key, val)
             # log.info("Traffic: %r", rec)
             self.record_queue.put(rec, block=False, timeout=2)
         except queue.Full as err:
@@ -178,9 +269,13 @@ class TrafficClientTask(TrafficTask):
 
 class TrafficServerTask(TrafficTask):
 
-    def __init__(self, trule):
+    def __init__(self, trule, engine):
+        """
+        Traffic server for a rule. Servers of a target share its engine,
+        which owns all their listening sockets.
+        """
         self._type = self.SERVER
-        super(TrafficServerTask, self).__init__(trule)
+        super(TrafficServerTask, self).__init__(trule, engine)
 
     @property
     def target(self):
@@ -189,12 +284,13 @@ class TrafficServerTask(TrafficTask):
     def _get_server(self):
         port = self._trule.port
         ipv6 = is_ipv6_address(self._trule.dst)
+        workers = getattr(self._trule, 'workers', None)
         if self._trule.is_TCP():
-            return TCPServer(port=port, ipv6=ipv6)
+            return TCPServer(port=port, ipv6=ipv6, workers=workers)
         elif self._trule.is_UDP():
-            return UDPServer(port=port, ipv6=ipv6)
+            return UDPServer(port=port, ipv6=ipv6, workers=workers)
         elif self._trule.is_HTTP():
-            return HTTPServer(port=port, ipv6=ipv6)
+            return HTTPServer(port=port, ipv6=ipv6, workers=workers)
         else:
             msg = "LYDIAN: Unsupported protocol on rule %s" % self._trule
             raise NotImplementedError(msg)
@@ -203,6 +299,12 @@ class TrafficServerTask(TrafficTask):
         self._task = self._get_server()
 
     def _create_namspace_task(self):
-        self._ns_task_iter = self._ns_task_helper(self.target.name,
-                                                  self._get_server)
-        self._task = next(self._ns_task_iter)
+        # Engine for a namespace target runs inside the namespace, so
+        # listening sockets of the server are created in it.
+        self._task = self._get_server()
+
+    def _run(self):
+        return self._task.aserve()
+
+    def get_counters(self):
+        return self._task.get_counters()
@@ -38,6 +38,23 @@ def is_py3():
     return platform.python_version().startswith('3')
 
 
+def parse_size(size):
+    """
+    Returns size in bytes. Size can have a K, M or G suffix (binary
+    multiples) e.g. '64K', '10M'.
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    size = str(size).strip().upper().rstrip('B')
+    multiplier = 1
+    if size and size[-1] in units:
+        multiplier = units[size[-1]]
+        size = size[:-1]
+    nbytes = int(float(size) * multiplier)
+    if nbytes < 0:
+        raise ValueError("Invalid size : %s" % size)
+    return nbytes
+
+
 def get_mgmt_ifname():
     """" Management Interface name for current platform """
     if is_linux():
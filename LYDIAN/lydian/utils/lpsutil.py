@@ -5,17 +5,24 @@
 # in the root directory of this project.
 '''
 Alternative / backup implementation of psutil methods consumed in lydian.
+On linux, data is read through netlink and /proc, without forking
+processes.
 '''
 import collections
 import json
+import logging
 import os
 import socket
 import struct
+import threading
+import time
 
 
 from lydian.apps.console import Console
 from lydian.utils import common
 
+log = logging.getLogger(__name__)
+
 POSIX = ('LINUX', 'ESX')
 
 if common.is_linux():
@@ -30,6 +37,9 @@ else:
 if OS_TYPE in POSIX:
     import fcntl
 
+if OS_TYPE == 'LINUX':
+    from lydian.utils import netlink
+
 
 def get_ipv4_address(ifname, ipv6=False):
     """
@@ -101,6 +111,14 @@ class snicaddr(object):
 
 
 def _net_if_addrs_linux():
+    try:
+        return netlink.net_if_addrs()
+    except OSError as err:
+        log.error("Unable to get addresses through netlink : %r", err)
+    return _net_if_addrs_ip()
+
+
+def _net_if_addrs_ip():
     result = collections.defaultdict(list)
     ifnames = os.listdir('/sys/class/net/')
 
@@ -158,7 +176,146 @@ def net_if_addrs():
     else:
         return None
 
-# TODO : Following need to be implemented.
+# Same fields as of psutil's (except for virtual_memory, only common ones).
+svmem = collections.namedtuple('svmem', ['total', 'available', 'percent',
+                                         'used', 'free'])
+addr = collections.namedtuple('addr', ['ip', 'port'])
+sconn = collections.namedtuple('sconn', ['fd', 'family', 'type', 'laddr',
+                                         'raddr', 'status', 'pid'])
+pconn = collections.namedtuple('pconn', ['fd', 'family', 'type', 'laddr',
+                                         'raddr', 'status'])
+
+CONN_NONE = 'NONE'
+TCP_STATUSES = {
+    '01': 'ESTABLISHED', '02': 'SYN_SENT', '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1', '05': 'FIN_WAIT2', '06': 'TIME_WAIT', '07': 'CLOSE',
+    '08': 'CLOSE_WAIT', '09': 'LAST_ACK', '0A': 'LISTEN', '0B': 'CLOSING',
+}
+# /proc/net file : (family, type)
+PROC_NET_INET = {
+    'tcp': (socket.AF_INET, socket.SOCK_STREAM),
+    'tcp6': (socket.AF_INET6, socket.SOCK_STREAM),
+    'udp': (socket.AF_INET, socket.SOCK_DGRAM),
+    'udp6': (socket.AF_INET6, socket.SOCK_DGRAM),
+}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if OS_TYPE == 'LINUX' else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if OS_TYPE == 'LINUX' else 4096
+
+
+def _read_cpu_times():
+    """ Returns (busy, total) cpu time (ticks) of system. """
+    with open('/proc/stat') as fd:
+        # cpu user nice system idle iowait irq softirq steal guest ...
+        fields = [int(x) for x in fd.readline().split()[1:]]
+    # guest times are already accounted in user / nice.
+    total = sum(fields[:8])
+    idle = sum(fields[3:5])
+    return total - idle, total
+
+
+class _CPUPercent(object):
+
+    def __init__(self, read_times):
+        """
+        CPU utilization since last call, as psutil does with no interval.
+        First call returns 0.
+        """
+        self._read_times = read_times
+        self._last = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        busy, total = self._read_times()
+        with self._lock:
+            last, self._last = self._last, (busy, total)
+        if not last or total <= last[1]:
+            return 0.0
+        return (busy - last[0]) * 100.0 / (total - last[1])
+
+
+_cpu_percent = _CPUPercent(_read_cpu_times) if OS_TYPE == 'LINUX' else None
+
+
+def _read_meminfo():
+    """ Returns {field : bytes} of /proc/meminfo. """
+    meminfo = {}
+    with open('/proc/meminfo') as fd:
+        for line in fd:
+            fields = line.split()
+            if len(fields) >= 2:
+                meminfo[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    return meminfo
+
+
+def _virtual_memory_linux():
+    meminfo = _read_meminfo()
+    total = meminfo['MemTotal']
+    free = meminfo.get('MemFree', 0)
+    available = meminfo.get('MemAvailable')
+    if available is None:   # Older kernels.
+        available = free + meminfo.get('Buffers', 0) + \
+            meminfo.get('Cached', 0)
+    used = total - free - meminfo.get('Buffers', 0) - \
+        meminfo.get('Cached', 0) - meminfo.get('SReclaimable', 0)
+    used = used if used >= 0 else total - free
+    percent = (total - available) * 100.0 / total if total else 0.0
+    return svmem(total, available, round(percent, 1), used, free)
+
+
+def _decode_address(family, value):
+    """ Returns addr of /proc/net address (hex, in host byte order). """
+    ip, port = value.split(':')
+    raw = bytes.fromhex(ip)
+    # Address is of 32 bit words in host byte order.
+    words = struct.unpack('=%dI' % (len(raw) // 4), raw)
+    ip = socket.inet_ntop(family, struct.pack('!%dI' % len(words), *words))
+    return addr(ip, int(port, 16))
+
+
+def _read_inet_connections(inodes=None):
+    """
+    Returns [(inode, family, type, laddr, raddr, status)] of inet
+    sockets (of given inodes, if provided).
+    """
+    conns = []
+    for fname, (family, _type) in PROC_NET_INET.items():
+        try:
+            with open(os.path.join('/proc/net', fname)) as fd:
+                lines = fd.readlines()[1:]
+        except (IOError, OSError):
+            continue    # e.g. IPv6 disabled.
+        for line in lines:
+            fields = line.split()
+            inode = int(fields[9])
+            if inodes is not None and inode not in inodes:
+                continue
+            status = TCP_STATUSES.get(fields[3], CONN_NONE) \
+                if _type == socket.SOCK_STREAM else CONN_NONE
+            laddr = _decode_address(family, fields[1])
+            raddr = _decode_address(family, fields[2])
+            # Listening / unconnected sockets have no remote address.
+            raddr = raddr if raddr.port else ()
+            conns.append((inode, family, _type, laddr, raddr, status))
+    return conns
+
+
+def _socket_inodes(pid):
+    """ Returns {inode : fd} of sockets opened by process. """
+    inodes = {}
+    fd_dir = '/proc/%s/fd' % pid
+    try:
+        fds = os.listdir(fd_dir)
+    except (IOError, OSError):
+        return inodes
+    for fd in fds:
+        try:
+            link = os.readlink(os.path.join(fd_dir, fd))
+        except (IOError, OSError):
+            continue    # Closed meanwhile.
+        if link.startswith('socket:['):
+            inodes[int(link[8:-1])] = int(fd)
+    return inodes
 
 
 class Dummy(object):
@@ -170,32 +327,64 @@ dummy = Dummy()
 
 def cpu_percent():
     """ returns system CPU Percentage utilization """
-    return 0
+    if OS_TYPE != 'LINUX':
+        return 0
+    return _cpu_percent()
 
 
 def virtual_memory():
     """ returns system virtual memory percentage utilization """
-    return dummy
+    if OS_TYPE != 'LINUX':
+        return dummy
+    return _virtual_memory_linux()
 
 
 def net_connections():
     """ returns number of system connections open """
-    return []
+    if OS_TYPE != 'LINUX':
+        return []
+    return [sconn(-1, *conn[1:], pid=None)
+            for conn in _read_inet_connections()]
 
 
 class Process(object):
 
     def __init__(self, pid):
         self._pid = pid
+        self._cpu_percent = _CPUPercent(self._read_cpu_times) \
+            if OS_TYPE == 'LINUX' else None
+
+    def _read_cpu_times(self):
+        """ Returns (busy, elapsed) time (ticks) of process. """
+        with open('/proc/%s/stat' % self._pid) as fd:
+            data = fd.read()
+        # Fields after command (which may have spaces), from state on.
+        fields = data[data.rindex(')') + 2:].split()
+        busy = int(fields[11]) + int(fields[12])     # utime + stime
+        return busy, time.monotonic() * CLOCK_TICKS
 
     def cpu_percent(self):
-        return 0
+        """ CPU utilization (of a CPU) since last call. """
+        if OS_TYPE != 'LINUX':
+            return 0
+        return self._cpu_percent()
 
     def memory_percent(self):
-        return 0
+        """ Resident memory as percentage of total memory. """
+        if OS_TYPE != 'LINUX':
+            return 0
+        with open('/proc/%s/statm' % self._pid) as fd:
+            rss = int(fd.read().split()[1]) * PAGE_SIZE
+        return rss * 100.0 / _read_meminfo()['MemTotal']
 
     def connections(self):
-        return []
+        if OS_TYPE != 'LINUX':
+            return []
+        inodes = _socket_inodes(self._pid)
+        if not inodes:
+            return []
+        return [pconn(inodes[conn[0]], *conn[1:])
+                for conn in _read_inet_connections(inodes)]
 
 
 if __name__ == '__main__':
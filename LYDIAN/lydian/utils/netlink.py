@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+'''
+Minimal rtnetlink (linux) client to query links and addresses of a
+network namespace without forking processes or entering namespaces for
+longer than creating a socket.
+
+>>> from lydian.utils import netlink
+>>> netlink.net_if_addrs('/var/run/netns/testns')
+{'lo': [IfAddr(family=2, address='127.0.0.1', netmask='255.0.0.0', ...)]}
+'''
+import collections
+import ipaddress
+import logging
+import os
+import socket
+import struct
+
+from lydian.utils import nsenter
+
+log = logging.getLogger(__name__)
+
+NETLINK_ROUTE = 0
+
+# Message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+RTM_NEWNSID = 88
+RTM_GETNSID = 90
+
+# Flags
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+# Attributes
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+NETNSA_NSID = 1
+NETNSA_FD = 3
+
+RT_SCOPE_LINK = 253
+
+# Multicast groups (bitmask, for bind) of link / address events.
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+NLMSG_HEADER = struct.Struct('=LHHLL')      # len, type, flags, seq, pid
+RTATTR_HEADER = struct.Struct('=HH')        # len, type
+IFINFOMSG = struct.Struct('=BxHiII')        # family, type, index, flags, change
+IFADDRMSG = struct.Struct('=BBBBI')         # family, prefixlen, flags, scope, index
+RTGENMSG = struct.Struct('=Bxxx')           # family
+
+RECV_SIZE = 64 * 1024
+
+# Same fields as psutil's snicaddr.
+IfAddr = collections.namedtuple('IfAddr', ['family', 'address', 'netmask',
+                                           'broadcast', 'ptp'])
+
+
+class NetlinkError(OSError):
+    pass
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _attrs(data, offset):
+    """ Returns {type : value} of rtattrs in data from offset. """
+    attrs = {}
+    while offset + RTATTR_HEADER.size <= len(data):
+        length, _type = RTATTR_HEADER.unpack_from(data, offset)
+        if length < RTATTR_HEADER.size:
+            break
+        attrs[_type] = data[offset + RTATTR_HEADER.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _attr(_type, value):
+    length = RTATTR_HEADER.size + len(value)
+    return RTATTR_HEADER.pack(length, _type) + value + \
+        b'\0' * (_align(length) - length)
+
+
+def netns_socket(nspath=None):
+    """
+    Returns a rtnetlink socket of network namespace at nspath (of calling
+    thread if not provided). Socket stays bound to the namespace it is
+    created in, so calling thread is in the namespace only while the
+    socket is created.
+    """
+    if not nspath:
+        return socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+    orig_fd = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+        ns_fd = os.open(nspath, os.O_RDONLY)
+        try:
+            nsenter.setns(ns_fd)
+            try:
+                return socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                     NETLINK_ROUTE)
+            finally:
+                nsenter.setns(orig_fd)
+        finally:
+            os.close(ns_fd)
+    finally:
+        os.close(orig_fd)
+
+
+def event_socket(nspath=None,
+                 groups=RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR):
+    """
+    Returns a (non blocking) rtnetlink socket of namespace at nspath
+    subscribed to link / address events. Events are just to be drained
+    (see drain_events) and namespace rediscovered.
+    """
+    sock = netns_socket(nspath)
+    try:
+        sock.bind((0, groups))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def drain_events(sock):
+    """
+    Reads all pending events off an event socket. Returns number of
+    messages read. Raises OSError (ENOBUFS) if events were lost.
+    """
+    count = 0
+    while True:
+        try:
+            data = sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return count
+        if not data:
+            return count
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length = NLMSG_HEADER.unpack_from(data, offset)[0]
+            if length < NLMSG_HEADER.size:
+                break
+            offset += _align(length)
+            count += 1
+
+
+def _request(sock, msg_type, payload, flags=NLM_F_REQUEST):
+    """ Sends a request and yields (type, message) of its replies. """
+    seq = 1
+    msg = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), msg_type,
+                            flags, seq, 0) + payload
+    sock.sendto(msg, (0, 0))
+    while True:
+        data = sock.recv(RECV_SIZE)
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            length, _type, _, _seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if length < NLMSG_HEADER.size:
+                return
+            body = data[offset + NLMSG_HEADER.size:offset + length]
+            offset += _align(length)
+            if _seq != seq:
+                continue
+            if _type == NLMSG_DONE:
+                return
+            if _type == NLMSG_ERROR:
+                code = -struct.unpack_from('=i', body)[0]
+                if code:
+                    raise NetlinkError(code, os.strerror(code))
+                return      # ACK
+            yield _type, body
+            if not flags & NLM_F_DUMP:
+                return
+
+
+def get_links(sock):
+    """ Returns {index : name} of links. """
+    links = {}
+    payload = IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+    for _type, body in _request(sock, RTM_GETLINK, payload,
+                                NLM_F_REQUEST | NLM_F_DUMP):
+        if _type != RTM_NEWLINK:
+            continue
+        _, _, index, _, _ = IFINFOMSG.unpack_from(body)
+        name = _attrs(body, IFINFOMSG.size).get(IFLA_IFNAME)
+        if name:
+            links[index] = name.rstrip(b'\0').decode()
+    return links
+
+
+def _netmask(family, prefixlen):
+    network = ipaddress.IPv4Network if family == socket.AF_INET else \
+        ipaddress.IPv6Network
+    zero = '0.0.0.0' if family == socket.AF_INET else '::'
+    return str(network('%s/%s' % (zero, prefixlen)).netmask)
+
+
+def get_addresses(sock, links=None):
+    """
+    Returns {interface name : [IfAddr]} of IPv4 / IPv6 addresses, named
+    and formatted as psutil.net_if_addrs() does.
+    """
+    links = links if links is not None else get_links(sock)
+    result = collections.defaultdict(list)
+    payload = IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+    for _type, body in _request(sock, RTM_GETADDR, payload,
+                                NLM_F_REQUEST | NLM_F_DUMP):
+        if _type != RTM_NEWADDR:
+            continue
+        family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(body)
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        attrs = _attrs(body, IFADDRMSG.size)
+        # IFA_ADDRESS is peer address on point to point links.
+        raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+        if not raw:
+            continue
+        address = socket.inet_ntop(family, raw)
+        name = links.get(index, str(index))
+        if family == socket.AF_INET6 and scope == RT_SCOPE_LINK:
+            address = '%s%%%s' % (address, name)
+        if IFA_LABEL in attrs:
+            name = attrs[IFA_LABEL].rstrip(b'\0').decode()
+        broadcast = attrs.get(IFA_BROADCAST)
+        ptp = None
+        if IFA_LOCAL in attrs and IFA_ADDRESS in attrs and \
+                attrs[IFA_LOCAL] != attrs[IFA_ADDRESS]:
+            ptp = socket.inet_ntop(family, attrs[IFA_ADDRESS])
+        result[name].append(IfAddr(
+            family, address, _netmask(family, prefixlen),
+            socket.inet_ntop(family, broadcast) if broadcast else None, ptp))
+    return dict(result)
+
+
+def get_nsid(sock, nspath):
+    """
+    Returns id of namespace at nspath, as seen from namespace of sock,
+    None if not assigned (same as shown by 'ip netns list').
+    """
+    fd = os.open(nspath, os.O_RDONLY)
+    try:
+        payload = RTGENMSG.pack(socket.AF_UNSPEC) + \
+            _attr(NETNSA_FD, struct.pack('=I', fd))
+        for _type, body in _request(sock, RTM_GETNSID, payload):
+            if _type != RTM_NEWNSID:
+                continue
+            nsid = _attrs(body, RTGENMSG.size).get(NETNSA_NSID)
+            if nsid is not None:
+                nsid = struct.unpack('=i', nsid)[0]
+                return nsid if nsid >= 0 else None
+    finally:
+        os.close(fd)
+    return None
+
+
+def net_if_addrs(nspath=None):
+    """
+    Returns addresses (see get_addresses) of network namespace at nspath
+    (of calling thread if not provided).
+    """
+    sock = netns_socket(nspath)
+    try:
+        return get_addresses(sock)
+    finally:
+        sock.close()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+'''
+Watches network changes (linux) : links / addresses of host and of named
+network namespaces (through netlink events) and namespaces coming and
+going (through inotify on namespace directory), so that only what changed
+is rediscovered.
+'''
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import selectors
+import struct
+import threading
+import time
+
+from lydian.apps import config
+from lydian.utils import netlink
+
+log = logging.getLogger(__name__)
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+INOTIFY_EVENT = struct.Struct('=iIII')  # wd, mask, cookie, len
+
+
+class Inotify(object):
+
+    def __init__(self, path, mask=IN_CREATE | IN_DELETE | IN_MOVED_FROM |
+                 IN_MOVED_TO):
+        """ Non blocking inotify watch on a directory. """
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err), path)
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """ Returns [(mask, name)] of pending events. """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except (BlockingIOError, InterruptedError):
+                return events
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode()
+                offset += length
+                events.append((mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class NetworkWatcher(object):
+
+    HOST = None     # Key of host in changes.
+    MAX_RETRIES = 20    # Attempts to watch a new namespace.
+
+    def __init__(self, callback, debounce=None):
+        """
+        Watches host and namespaces in a thread. Changes seen within
+        debounce (seconds) are coalesced and reported as
+        callback(host, namespaces) where host is True if host links /
+        addresses changed and namespaces is set of names of namespaces
+        which changed, were added or removed.
+        """
+        self._callback = callback
+        self._debounce = debounce if debounce is not None else \
+            config.get_param('NETWORK_WATCH_DEBOUNCE', 0.05)
+        self._ns_dir = config.get_param('NAMESPACE_DIR')
+        self._selector = None
+        self._inotify = None    # on namespace directory (or its parent)
+        self._inotify_path = None
+        self._sockets = {}      # namespace (None for host) : event socket
+        self._host = False      # pending changes
+        self._namespaces = set()
+        self._retries = {}      # namespace : attempts to watch it.
+        self._deadline = None
+        self._wakeup = None     # pipe to wake watcher thread up.
+        self._stop_event = threading.Event()
+        self._stop_event.set()      # stopped until started
+        self._thread = None
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def _watch_namespace(self, ns_name):
+        """ Subscribes to events of namespace (None for host). """
+        if ns_name in self._sockets:
+            return True
+        nspath = os.path.join(self._ns_dir, ns_name) if ns_name else None
+        try:
+            sock = netlink.event_socket(nspath)
+        except OSError as err:
+            # e.g. namespace file is created but not mounted yet.
+            log.debug("Unable to watch namespace %s : %r", ns_name, err)
+            return False
+        self._sockets[ns_name] = sock
+        self._selector.register(sock, selectors.EVENT_READ, ns_name)
+        return True
+
+    def _unwatch_namespace(self, ns_name):
+        sock = self._sockets.pop(ns_name, None)
+        if sock:
+            self._selector.unregister(sock)
+            sock.close()
+
+    def _changed(self, ns_name=HOST):
+        if ns_name is self.HOST:
+            self._host = True
+        else:
+            self._namespaces.add(ns_name)
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self._debounce
+
+    def _watch_ns_dir(self, report=False):
+        """
+        Watches namespace directory or, till it is created (e.g. by first
+        'ip netns add'), its parent. Directory is left to the system to
+        create. Namespaces in directory are watched (and reported as
+        changed, if report).
+        """
+        exists = os.path.isdir(self._ns_dir)
+        path = self._ns_dir if exists else \
+            os.path.dirname(self._ns_dir.rstrip('/'))
+        try:
+            self._inotify = Inotify(path)
+        except OSError as err:
+            log.warning("Unable to watch %s for namespaces : %r", path, err)
+            return
+        self._inotify_path = path
+        self._selector.register(self._inotify, selectors.EVENT_READ,
+                                'inotify')
+        if not exists:
+            if os.path.isdir(self._ns_dir):     # Created meanwhile.
+                self._unwatch_ns_dir()
+                self._watch_ns_dir(report)
+            return
+        for ns_name in os.listdir(self._ns_dir):
+            if report:
+                self._changed(ns_name)  # Watched (or retried) on flush.
+            else:
+                self._watch_namespace(ns_name)
+
+    def _unwatch_ns_dir(self):
+        if self._inotify:
+            self._selector.unregister(self._inotify)
+            self._inotify.close()
+        self._inotify, self._inotify_path = None, None
+
+    def _on_namespace_dir(self):
+        events = self._inotify.read()
+        if self._inotify_path != self._ns_dir:
+            # Watching parent till namespace directory is created.
+            name = os.path.basename(self._ns_dir.rstrip('/'))
+            if any(x == name and mask & (IN_CREATE | IN_MOVED_TO)
+                   for mask, x in events):
+                self._unwatch_ns_dir()
+                self._watch_ns_dir(report=True)
+            return
+        for mask, ns_name in events:
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._unwatch_namespace(ns_name)
+            self._changed(ns_name)
+
+    def _on_netlink(self, ns_name):
+        sock = self._sockets.get(ns_name)
+        if not sock:
+            return      # Unwatched while handling same events.
+        try:
+            netlink.drain_events(sock)
+        except OSError as err:
+            if err.errno != errno.ENOBUFS:
+                raise
+            # Events were lost. Namespace is rediscovered anyway.
+        self._changed(ns_name)
+
+    def _flush(self):
+        """ Reports coalesced changes. """
+        host, namespaces = self._host, self._namespaces
+        self._host, self._namespaces, self._deadline = False, set(), None
+        for ns_name in list(namespaces):
+            if not os.path.exists(os.path.join(self._ns_dir, ns_name)) or \
+                    self._watch_namespace(ns_name):
+                self._retries.pop(ns_name, None)
+                continue
+            # Not ready (mounted) yet, so not reported. Retried with next
+            # report, for a while, and then on its next inotify event.
+            namespaces.discard(ns_name)
+            self._retries[ns_name] = self._retries.get(ns_name, 0) + 1
+            if self._retries[ns_name] < self.MAX_RETRIES:
+                self._changed(ns_name)
+            else:
+                log.error("Unable to watch namespace %s", ns_name)
+                self._retries.pop(ns_name)
+        if not host and not namespaces:
+            return
+        try:
+            self._callback(host, namespaces)
+        except Exception as err:
+            log.error("Error in handling network changes : %r", err,
+                      exc_info=err)
+
+    def _setup(self):
+        self._selector = selectors.DefaultSelector()
+        rfd, wfd = os.pipe()
+        self._wakeup = (rfd, wfd)
+        self._selector.register(rfd, selectors.EVENT_READ, 'wakeup')
+        self._watch_namespace(self.HOST)
+        self._watch_ns_dir()
+
+    def _teardown(self):
+        for ns_name in list(self._sockets):
+            self._unwatch_namespace(ns_name)
+        if self._selector:
+            self._unwatch_ns_dir()
+        for fd in self._wakeup or ():
+            os.close(fd)
+        self._selector.close()
+        self._wakeup, self._selector = None, None
+
+    def _run(self):
+        try:
+            self._setup()
+            while not self._stop_event.is_set():
+                timeout = None
+                if self._deadline is not None:
+                    timeout = max(self._deadline - time.monotonic(), 0)
+                for key, _ in self._selector.select(timeout):
+                    if key.data == 'wakeup':
+                        os.read(key.fd, 64)
+                    elif key.data == 'inotify':
+                        self._on_namespace_dir()
+                    else:
+                        self._on_netlink(key.data)
+                if self._deadline is not None and \
+                        time.monotonic() >= self._deadline:
+                    self._flush()
+        except Exception as err:
+            log.error("Network watcher stopped on error : %r", err,
+                      exc_info=err)
+        finally:
+            self._teardown()
+            self._stop_event.set()
+
+    def start(self):
+        if not self.stopped():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='network-watcher', daemon=True)
+        self._thread.start()
+        log.info("Started network watcher.")
+
+    def stop(self):
+        if self.stopped():
+            return
+        self._stop_event.set()
+        wakeup = self._wakeup
+        if wakeup:
+            try:
+                os.write(wakeup[1], b'x')
+            except OSError:
+                pass
+        if self._thread:
+            self._thread.join(config.get_param('THREADS_JOIN_TIMEOUT'))
+            self._thread = None
+        log.info("Stopped network watcher.")
+
+    close = stop
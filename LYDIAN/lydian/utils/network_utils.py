@@ -7,14 +7,15 @@
 from collections import defaultdict
 import logging
 import multiprocessing
+import os
 import platform
 import re
-import subprocess
 
 if "Linux" in platform.uname():  # noqa
-    from lydian.utils import nsenter
+    from lydian.utils import netlink, nsenter
 
 import lydian.common.errors as errors
+from lydian.utils import parallel
 
 try:
     import psutil
@@ -64,8 +65,30 @@ class Namespace(object):
                              [self.name, self.id, [interface.as_dict() for
                                                    interface in self.interfaces]])))
 
+    @property
+    def path(self):
+        return os.path.join(config.get_param('NAMESPACE_DIR'), self.name)
+
     def discover_interfaces(self):
-        ns_path = '/var/run/netns/%s' % self.name
+        """
+        Discovers interfaces through a netlink socket created inside the
+        namespace. Falls back to psutil in a child process (in namespace).
+        """
+        try:
+            addrs = netlink.net_if_addrs(self.path)
+        except OSError as err:
+            log.warning("Netlink discovery failed for namespace %s : %r",
+                        self.name, err)
+            addrs = self._discover_addrs_psutil()
+        self._interface_list = []
+        for name, snics in list(addrs.items()):
+            for nic in [snic for snic in snics if snic.family in INTERFACE_FAMILY]:
+                self._interface_list.append(Interface(
+                    name, nic.address, nic.family,
+                    nic.netmask, nic.broadcast))
+
+    def _discover_addrs_psutil(self):
+        ns_path = self.path
         manager = multiprocessing.Manager()
         return_dict = manager.dict()
         with nsenter.namespace(ns_path, 'net'):
@@ -73,11 +96,7 @@ class Namespace(object):
                 target=get_interfaces_in_namespace, args=(return_dict,))
             process.start()
             process.join()
-        for name, snics in list(return_dict['result'].items()):
-            for nic in [snic for snic in snics if snic.family in INTERFACE_FAMILY]:
-                self._interface_list.append(Interface(
-                    name, nic.address, nic.family,
-                    nic.netmask, nic.broadcast))
+        return return_dict['result']
 
 
 class NamespaceManager(object):
@@ -93,26 +112,82 @@ class NamespaceManager(object):
         self._linux_distro = "Linux" in platform.uname()
         self.discover_namespaces()
 
-    def discover_namespaces(self):
-        if self._linux_distro:
-            ns_list = subprocess.check_output(["ip", "netns", "list"])
-            if not ns_list:
-                return
-            for ns in ns_list.decode().rstrip().split("\n"):
-                ns_name, ns_id = None, None
+    def _get_nsids(self, ns_names):
+        """ Returns {namespace : id (as in 'ip netns list')}. """
+        nsids = {}
+        sock = netlink.netns_socket()
+        try:
+            ns_dir = config.get_param('NAMESPACE_DIR')
+            for ns_name in ns_names:
                 try:
-                    lindex = ns.index(' ')
-                    ns_name = ns[:lindex]
-                    ns_id = re.findall('[0-9]+', ns[lindex:])[0]
-                except Exception as err:
-                    log.error(
-                        "Cannot parse Namespace info for %s - %r", ns, err, exc_info=err)
-                    continue
-
-                _ns = Namespace(ns_name, ns_id)
-                self._namespace_map[ns_name] = _ns
-                interfaces = _ns.interfaces
-                self._namespace_interface_map[ns_name] = interfaces
+                    nsid = netlink.get_nsid(sock, os.path.join(ns_dir, ns_name))
+                except OSError as err:
+                    log.error("Cannot get id of Namespace %s - %r", ns_name, err)
+                    nsid = None
+                nsids[ns_name] = str(nsid) if nsid is not None else None
+        finally:
+            sock.close()
+        return nsids
+
+    def discover_namespaces(self):
+        """
+        Discovers namespaces (named ones, as 'ip netns list' shows) and
+        their interfaces, in parallel, from this process.
+        """
+        if not self._linux_distro:
+            return
+        ns_dir = config.get_param('NAMESPACE_DIR')
+        try:
+            ns_names = sorted(os.listdir(ns_dir))
+        except FileNotFoundError:
+            ns_names = []   # No namespace created yet.
+        nsids = self._get_nsids(ns_names)
+
+        params = [(ns_name, (ns_name, nsids[ns_name]), {})
+                  for ns_name in ns_names]
+        workers = config.get_param('NAMESPACE_DISCOVERY_WORKERS', 8)
+        namespaces = parallel.ThreadPool(Namespace, params, workers=workers) \
+            if params else {}
+
+        namespace_map, namespace_interface_map = {}, {}
+        for ns_name in ns_names:
+            _ns = namespaces.get(ns_name)
+            if not _ns:
+                continue    # Error is logged by ThreadPool.
+            namespace_map[ns_name] = _ns
+            namespace_interface_map[ns_name] = _ns.interfaces
+        self._namespace_map = namespace_map
+        self._namespace_interface_map = namespace_interface_map
+
+    def update_namespaces(self, ns_names):
+        """
+        Rediscovers only the given namespaces (e.g. reported changed by
+        network watcher). The ones which no longer exist are removed.
+        """
+        if not self._linux_distro or not ns_names:
+            return
+        ns_dir = config.get_param('NAMESPACE_DIR')
+        present = [x for x in ns_names
+                   if os.path.exists(os.path.join(ns_dir, x))]
+        nsids = self._get_nsids(present)
+        params = [(ns_name, (ns_name, nsids[ns_name]), {})
+                  for ns_name in present]
+        workers = config.get_param('NAMESPACE_DISCOVERY_WORKERS', 8)
+        namespaces = parallel.ThreadPool(Namespace, params, workers=workers) \
+            if params else {}
+
+        namespace_map = dict(self._namespace_map)
+        namespace_interface_map = dict(self._namespace_interface_map)
+        for ns_name in ns_names:
+            _ns = namespaces.get(ns_name)
+            if _ns:
+                namespace_map[ns_name] = _ns
+                namespace_interface_map[ns_name] = _ns.interfaces
+            else:
+                namespace_map.pop(ns_name, None)
+                namespace_interface_map.pop(ns_name, None)
+        self._namespace_map = namespace_map
+        self._namespace_interface_map = namespace_interface_map
 
     def get_namespace_interface_map(self):
         return self._namespace_interface_map
@@ -199,13 +274,15 @@ class InterfaceManager(object):
         self.discover_interfaces()
 
     def discover_interfaces(self):
-        self._interface_map = defaultdict(list)
+        interface_map = defaultdict(list)
         addrs = psutil.net_if_addrs()
         for name, snics in list(addrs.items()):
             for nic in [snic for snic in snics if snic.family in INTERFACE_FAMILY]:
-                self._interface_map[name].append(
+                interface_map[name].append(
                     Interface(name, nic.address, nic.family, nic.netmask,
                               nic.broadcast))
+        # Replaced at once as it is rediscovered on changes, while in use.
+        self._interface_map = interface_map
 
     def get_all_interfaces(self):
         """
@@ -36,11 +36,13 @@ import ctypes.util
 import logging
 import os
 import errno
+import threading
 
 logger = logging.getLogger(__name__)
 LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
 VALID_NAMESPACES = frozenset(['ipc', 'mnt', 'net', 'pid', 'user', 'uts'])
 OPENED_FDS = {}
+_FDS_LOCK = threading.Lock()    # Guards OPENED_FDS.
 
 
 def setns(fd):
@@ -56,14 +58,12 @@ def fdopen(path):
     Open a read-only fd to <path> if not present in OPENED_FDS.
     If present, directly yields the file descriptor.
     """
-    global OPENED_FDS
-    if path in OPENED_FDS:
-        fd = OPENED_FDS[path]
-        yield fd
-    else:
-        fd = os.open(path, os.O_RDONLY)
-        OPENED_FDS[path] = fd
-        yield fd
+    with _FDS_LOCK:
+        fd = OPENED_FDS.get(path)
+        if fd is None:
+            fd = os.open(path, os.O_RDONLY)
+            OPENED_FDS[path] = fd
+    yield fd
 
 
 def fdcloseall():
@@ -71,9 +71,10 @@ def fdcloseall():
     Closes all the file descriptors opened and recorded in OPENED_FDS.
     """
     global OPENED_FDS
-    for fd in OPENED_FDS.values():
-        os.close(fd)
-    OPENED_FDS = {}
+    with _FDS_LOCK:
+        for fd in OPENED_FDS.values():
+            os.close(fd)
+        OPENED_FDS = {}
 
 
 @contextlib.contextmanager
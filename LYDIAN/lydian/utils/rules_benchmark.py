@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+'''
+Measures memory taken by traffic rules (as held by RulesApp) and traffic
+records.
+
+USAGE:
+---------
+# Memory of 100K and 500K rules (and as many records).
+$ python -mlydian.utils.rules_benchmark 100000 500000
+'''
+
+import argparse
+import gc
+import pickle
+import tracemalloc
+import uuid
+
+from lydian.traffic.core import TrafficRule, TrafficRecord
+
+
+def make_rule(index):
+    """ Returns a rule as Podium creates it from an intent. """
+    trule = TrafficRule()
+    trule.reqid = '%s' % uuid.uuid4()
+    trule.ruleid = '%s' % uuid.uuid4()
+    trule.src = '10.%d.%d.%d' % (index >> 16 & 0xff, index >> 8 & 0xff,
+                                 index & 0xff)
+    trule.dst = '11.%d.%d.%d' % (index >> 16 & 0xff, index >> 8 & 0xff,
+                                 index & 0xff)
+    trule.port = 5000 + index % 1000
+    trule.protocol = 'TCP'
+    trule.connected = True
+    trule.fill()
+    return trule
+
+
+def make_record(trule):
+    """ Returns a record as a ping reports it. """
+    rec = TrafficRecord()
+    rec.source = trule.src
+    rec.destination = trule.dst
+    rec.protocol = trule.protocol
+    rec.port = trule.port
+    rec.expected = True
+    rec.result = True
+    rec.reqid = trule.reqid
+    rec.ruleid = trule.ruleid
+    rec.latency = 0.5
+    return rec
+
+
+def measure(func):
+    """ Returns (result, bytes allocated) of func(). """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def run(count):
+    rules, rules_size = measure(
+        lambda: {x.ruleid: x for x in (make_rule(i) for i in range(count))})
+    # Rules are mostly shared (uuid, IP) strings. Charge only the objects.
+    objects_size = sum(x.__sizeof__() for x in rules.values())
+    records, records_size = measure(
+        lambda: [make_record(x) for x in rules.values()])
+    pickled = len(pickle.dumps(list(rules.values())[:1000])) // 1000
+
+    mb = 1024.0 * 1024
+    print("%d rules : %.1f MB (%.1f MB in rule objects, %d bytes / rule, "
+          "%d bytes pickled)" % (count, rules_size / mb, objects_size / mb,
+                                 rules_size // count, pickled))
+    print("%d records : %.1f MB (%d bytes / record)" % (
+        count, records_size / mb, records_size // count))
+    del rules, records
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('counts', nargs='*', type=int,
+                        default=[100000, 500000],
+                        help="Number of rules to measure for")
+    args = parser.parse_args()
+    for count in args.counts:
+        run(count)
+
+
+if __name__ == '__main__':
+    main()
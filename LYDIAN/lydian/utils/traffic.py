@@ -85,7 +85,7 @@ def main():
         _print("Invalid host/port")
         raise
 
-    def ping_handler(payload, data, latency, error=None):
+    def ping_handler(payload, data, latency, error=None, **stats):
         if is_py3:
             try:
                 payload = payload.decode()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import asyncio
+import collections
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.traffic.client import HTTPClient, HTTPResponseParser, \
+    PingTimer, TCPClient, UDPClient     # noqa: E402
+from lydian.traffic.server import HTTPServer, TCPServer    # noqa: E402
+from lydian.utils.common import parse_size      # noqa: E402
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(server):
+    """ Starts server in a thread and waits for it to listen. """
+    thread = threading.Thread(target=server.start, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', server.port), 1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return thread
+
+
+def run_client(client, tries):
+    """ Runs client for tries pings on an event loop. """
+    loop = asyncio.new_event_loop()
+    try:
+        client.clear_event()
+        loop.run_until_complete(client.arun(tries=tries))
+    finally:
+        loop.close()
+
+
+class TCPClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TCPServer(port=free_port())
+        self.thread = start_server(self.server)
+        self.pings = []
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+
+    def _handler(self, payload, data, latency, error=None, **stats):
+        self.pings.append((payload, data, latency, error, stats))
+
+    def _check_phases(self, stats):
+        for phase in ('connect_time', 'ttfb', 'total_time'):
+            self.assertIsInstance(stats[phase], float)
+            self.assertGreaterEqual(stats[phase], 0)
+        self.assertLessEqual(stats['connect_time'], stats['total_time'])
+        self.assertLessEqual(stats['ttfb'], stats['total_time'])
+
+    def test_phases(self):
+        client = TCPClient('127.0.0.1', self.server.port, payload='phases',
+                           handler=self._handler, interval=0.01)
+        run_client(client, 3)
+        client.start(tries=2)     # Blocking pings too.
+        self.assertEqual(len(self.pings), 5)
+        for payload, data, latency, error, stats in self.pings:
+            self.assertEqual(data, payload)
+            self.assertIsNone(error)
+            self._check_phases(stats)
+            self.assertAlmostEqual(latency, stats['total_time'], delta=0.01)
+
+    def test_persistent(self):
+        """ Framed pings reuse one connection, reopened when needed. """
+        client = TCPClient('127.0.0.1', self.server.port, payload='frame',
+                           handler=self._handler, persistent=1,
+                           interval=0.01)
+        while not self.server.get_counters()['accepts']:
+            time.sleep(0.01)    # Probe of start_server is counted.
+        accepts = self.server.get_counters()['accepts']
+        run_client(client, 3)
+        self.assertEqual(self.server.get_counters()['accepts'] - accepts, 1)
+        client._release()
+        run_client(client, 2)
+        client._release()
+        self.assertEqual(self.server.get_counters()['accepts'] - accepts, 2)
+        self.assertEqual([(x[1], x[3]) for x in self.pings],
+                         [(b'frame', None)] * 5)
+        # Only pings which opened the connection include connect time.
+        connected = [x[4].get('connect_time') is not None
+                     for x in self.pings]
+        self.assertEqual(connected, [True, False, False, True, False])
+
+    def test_timer(self):
+        timer = PingTimer()
+        time.sleep(0.01)
+        timer.mark_connected()
+        timer.mark_sent()
+        time.sleep(0.02)
+        timer.mark_first_byte()
+        timer.mark_first_byte()     # Only first one counts.
+        time.sleep(0.01)
+        timer.stop()
+        stats = timer.as_record()
+        self.assertGreaterEqual(stats['connect_time'], 10)
+        self.assertGreaterEqual(stats['ttfb'], 20)
+        self.assertLess(stats['ttfb'], 30)
+        self.assertGreaterEqual(stats['total_time'], 40)
+        self.assertEqual(timer.latency, round(stats['total_time'], 2))
+
+    def test_open_loop(self):
+        """ Pings are sent on schedule while earlier ones time out. """
+        sink = socket.socket()
+        sink.bind(('127.0.0.1', 0))
+        sink.listen(16)     # Connects, but never replies.
+        self.addCleanup(sink.close)
+        client = TCPClient('127.0.0.1', sink.getsockname()[1],
+                           handler=self._handler, interval=0.1,
+                           sockettimeout=1)
+        start = time.time()
+        run_client(client, 5)
+        elapsed = time.time() - start
+        self.assertLess(elapsed, 2)     # not 5 timeouts one after other.
+        self.assertEqual(len(self.pings), 5)
+        for _, data, _, error, stats in self.pings:
+            self.assertEqual(error, 'timed out')
+            self.assertLess(stats['send_delay'], 50)
+
+    def test_throughput(self):
+        client = TCPClient('127.0.0.1', self.server.port, payload='bulk',
+                           handler=self._handler, interval=0.01,
+                           mode='throughput', packet='2M')
+        run_client(client, 2)
+        self.assertEqual(len(self.pings), 2)
+        for payload, data, _, error, stats in self.pings:
+            self.assertEqual((data, error), (payload, None))
+            self.assertEqual(stats['transferred'], 2 * 1024 * 1024)
+            self.assertGreater(stats['goodput'], 0)
+
+    def test_throughput_duration(self):
+        client = TCPClient('127.0.0.1', self.server.port, payload='bulk',
+                           handler=self._handler, mode='throughput',
+                           duration=0.2)
+        run_client(client, 1)
+        _, data, _, error, stats = self.pings[0]
+        self.assertIsNone(error)
+        self.assertGreater(stats['transferred'], 0)
+        self.assertGreaterEqual(stats['total_time'], 200)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('64K'), 64 * 1024)
+        self.assertEqual(parse_size('1.5mb'), 3 * 512 * 1024)
+        self.assertEqual(parse_size(100), 100)
+        with self.assertRaises(ValueError):
+            parse_size('-1K')
+
+    def test_cps(self):
+        client = TCPClient('127.0.0.1', self.server.port, payload='storm',
+                           handler=self._handler, mode='cps', cps=200,
+                           concurrency=4)
+        run_client(client, 50)
+        stats = [x[4] for x in self.pings]
+        self.assertEqual(sum(x['sent'] for x in stats), 50)
+        self.assertEqual(sum(x['received'] for x in stats), 50)
+        for _, data, latency, error, stat in self.pings:
+            self.assertEqual((data, error), (b'storm', None))
+            self.assertIsNone(stat['failures'])
+            self.assertLessEqual(stat['latency_p50'], stat['latency_p99'])
+            self.assertLessEqual(stat['latency_p99'], stat['latency_max'])
+
+    def test_cps_failures(self):
+        client = TCPClient('127.0.0.1', free_port(), payload='storm',
+                           handler=self._handler, mode='cps', concurrency=8)
+        run_client(client, 20)
+        stats = [x[4] for x in self.pings]
+        self.assertEqual(sum(x['sent'] for x in stats), 20)
+        self.assertEqual(sum(x['received'] for x in stats), 0)
+        failures = collections.Counter()
+        for stat in stats:
+            failures.update(json.loads(stat['failures']))
+        self.assertEqual(failures, {'ECONNREFUSED': 20})
+        self.assertTrue(all(x[3] for x in self.pings))
+
+
+class UDPProbeStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.settimeout(2)
+        self.reports = []
+        self.client = UDPClient('127.0.0.1', self.server.getsockname()[1],
+                                handler=self._handler, persistent=1,
+                                sockettimeout=5)
+
+    def tearDown(self):
+        self.client._release()
+        self.loop.run_until_complete(asyncio.sleep(0))  # reporter cancelled.
+        self.server.close()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def _handler(self, payload, data, latency, error=None, **stats):
+        self.reports.append(stats)
+
+    def _send(self, count):
+        probes = []
+        for _ in range(count):
+            self.client.send_probe(b'probe')
+            probes.append(self.server.recvfrom(1024))
+        return probes
+
+    def _echo(self, probes):
+        for data, addr in probes:
+            self.server.sendto(data, addr)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+
+    def test_late_replies(self):
+        """ Replies are counted in window their probe was sent in. """
+        late = self._send(9)
+        self.client._report_stream()
+        self.assertEqual(self.reports, [])  # Waits for replies.
+
+        self._echo(late + late[:1])     # and a duplicate.
+        self._echo(self._send(1))
+        self.client._report_stream()
+
+        self.assertEqual([(x['sent'], x['received'], x['lost'],
+                           x['duplicates']) for x in self.reports],
+                         [(9, 9, 0, 1), (1, 1, 0, 0)])
+
+    def test_delayed_echo(self):
+        """ Finite stream waits for replies of its last probes. """
+        def echo():
+            try:
+                while True:
+                    data, addr = self.server.recvfrom(1024)
+                    threading.Timer(0.02, self.server.sendto,
+                                    (data, addr)).start()
+            except OSError:
+                pass    # closed.
+        threading.Thread(target=echo, daemon=True).start()
+        client = UDPClient('127.0.0.1', self.server.getsockname()[1],
+                           handler=self._handler, persistent=1,
+                           sockettimeout=2, interval=0.01)
+        run_client(client, 5)
+        self.assertEqual(sum(x['sent'] for x in self.reports), 5)
+        self.assertEqual(sum(x['received'] for x in self.reports), 5)
+        self.assertEqual(sum(x['lost'] for x in self.reports), 0)
+
+    def test_lost(self):
+        """ Probes without reply are lost when stream is closed. """
+        self._send(3)
+        self.client._release()
+        self.assertEqual([(x['sent'], x['received'], x['lost'])
+                          for x in self.reports], [(3, 0, 3)])
+
+
+class HTTPResponseParserTest(unittest.TestCase):
+
+    RESPONSE = (b'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n'
+                b'Content-Length: 5\r\n\r\nhello')
+
+    def test_byte_by_byte(self):
+        parser = HTTPResponseParser()
+        responses = []
+        for index in range(len(self.RESPONSE)):
+            responses += parser.feed(self.RESPONSE[index:index + 1])
+        self.assertEqual(len(responses), 1)
+        response = responses[0]
+        self.assertEqual((response.version, response.status, response.reason),
+                         ('HTTP/1.1', 200, 'OK'))
+        self.assertEqual(response.headers['content-type'], 'text/plain')
+        self.assertEqual(response.body, b'hello')
+        self.assertTrue(response.keep_alive)
+
+    def test_pipelined(self):
+        parser = HTTPResponseParser()
+        responses = parser.feed(self.RESPONSE * 2 + self.RESPONSE[:10])
+        self.assertEqual([x.body for x in responses], [b'hello'] * 2)
+        responses = parser.feed(self.RESPONSE[10:])
+        self.assertEqual([x.body for x in responses], [b'hello'])
+
+    def test_close_delimited(self):
+        parser = HTTPResponseParser()
+        self.assertEqual(parser.feed(b'HTTP/1.0 404 Not Found\r\n\r\nno'),
+                         [])
+        self.assertEqual(parser.feed(b'ne'), [])
+        response = parser.close()
+        self.assertEqual((response.status, response.body), (404, b'none'))
+        self.assertFalse(response.keep_alive)
+        self.assertIsNone(parser.close())
+
+    def test_chunked(self):
+        parser = HTTPResponseParser()
+        with self.assertRaises(ValueError):
+            parser.feed(b'HTTP/1.1 200 OK\r\n'
+                        b'Transfer-Encoding: chunked\r\n\r\n')
+
+
+class HTTPClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(port=free_port())
+        self.thread = start_server(self.server)
+        self.pings = []
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+
+    def _handler(self, payload, data, latency, error=None, **stats):
+        self.pings.append((payload, data, latency, error))
+
+    def test_timestamps(self):
+        """ HTTP pings work (without one way delays) with timestamps. """
+        payload = 'HTTP-ping-with-a-long-payload'
+        client = HTTPClient('127.0.0.1', self.server.port, payload=payload,
+                            handler=self._handler, timestamps=1,
+                            interval=0.01)
+        run_client(client, 3)
+        self.assertEqual(len(self.pings), 3)
+        for sent, data, latency, error in self.pings:
+            self.assertEqual(data, sent)
+            self.assertGreater(latency, 0)
+            self.assertIsNone(error)
+
+    def test_keep_alive(self):
+        """ Pipelined requests of all pings go over one connection. """
+        client = HTTPClient('127.0.0.1', self.server.port, payload='keep',
+                            handler=self._handler, persistent=1, pipeline=3,
+                            interval=0.01)
+        while not self.server.get_counters()['accepts']:
+            time.sleep(0.01)    # Probe of start_server is counted.
+        accepts = self.server.get_counters()['accepts']
+        run_client(client, 4)
+        client._release()
+        self.assertEqual([(x[1], x[3]) for x in self.pings],
+                         [('keep', None)] * 4)
+        counters = self.server.get_counters()
+        self.assertEqual(counters['accepts'] - accepts, 1)
+        self.assertEqual(counters['requests'], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import os
+import pickle
+import tempfile
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.traffic.core import TrafficRecord, TrafficRule  # noqa: E402
+
+
+class TrafficRuleTest(unittest.TestCase):
+
+    def test_pickle(self):
+        trule = TrafficRule()
+        trule.ruleid, trule.port = 'rule', 5000
+        trule.fill()
+        copy = pickle.loads(pickle.dumps(trule))
+        self.assertEqual(copy.as_dict(), trule.as_dict())
+        self.assertFalse(hasattr(copy, '__dict__'))
+
+    def test_unknown_state(self):
+        """ State of another version, with unknown keys, is accepted. """
+        trule = TrafficRule()
+        trule.__setstate__({'ruleid': 'rule', 'frequency': 10})
+        self.assertEqual(trule.ruleid, 'rule')
+        self.assertFalse(hasattr(trule, 'frequency'))
+
+        rec = TrafficRecord()
+        rec.__setstate__(({'ruleid': 'rule', 'retries': 3}, None))
+        self.assertEqual(rec.ruleid, 'rule')
+        self.assertFalse(hasattr(rec, 'retries'))
+
+
+if __name__ == '__main__':
+    unittest.main()
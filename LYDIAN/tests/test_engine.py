@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.traffic import engine as engines    # noqa: E402
+
+TEST_NS = 'lydian-engine-test'
+
+
+class TrafficEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = engines.TrafficEngine('test')
+
+    def tearDown(self):
+        self.engine.stop()
+
+    def test_submit(self):
+        async def add(x, y):
+            await asyncio.sleep(0)
+            return x + y
+
+        self.assertEqual(self.engine.submit(add(1, 2)).result(5), 3)
+        self.assertTrue(self.engine.is_running())
+
+    def test_concurrent(self):
+        """ Coroutines run together on engine thread. """
+        threads = set()
+
+        async def nap():
+            threads.add(threading.current_thread().name)
+            await asyncio.sleep(0.3)
+
+        start = time.time()
+        futures = [self.engine.submit(nap()) for _ in range(20)]
+        for future in futures:
+            future.result(5)
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(threads, {'engine-test'})
+
+    def test_stop_cancels_pending(self):
+        future = self.engine.submit(asyncio.sleep(60))
+        self.engine.stop()
+        self.assertTrue(future.cancelled())
+        self.assertFalse(self.engine.is_running())
+
+    @unittest.skipUnless(os.geteuid() == 0 and shutil.which('ip'),
+                         "needs root and iproute2")
+    def test_namespace(self):
+        """ Engine of a namespace runs (creates sockets) in it. """
+        subprocess.check_call(['ip', 'netns', 'add', TEST_NS])
+        self.addCleanup(subprocess.call, ['ip', 'netns', 'del', TEST_NS])
+        engine = engines.TrafficEngine('ns', namespace=TEST_NS)
+        self.addCleanup(engine.stop)
+
+        async def netns():
+            return os.stat('/proc/thread-self/ns/net').st_ino
+
+        self.assertEqual(engine.submit(netns()).result(5),
+                         os.stat('/var/run/netns/%s' % TEST_NS).st_ino)
+        # Rest of the process stays in its namespace.
+        self.assertNotEqual(os.stat('/proc/thread-self/ns/net').st_ino,
+                            os.stat('/var/run/netns/%s' % TEST_NS).st_ino)
+
+
+class EngineRegistryTest(unittest.TestCase):
+
+    def test_shared(self):
+        registry = engines.EngineRegistry()
+        engine = registry.acquire()
+        self.assertIs(registry.acquire(), engine)
+        self.assertIsNot(registry.acquire('other'), engine)
+        engine.start()
+        registry.release()
+        self.assertTrue(engine.is_running())    # Still used.
+        registry.release()
+        self.assertFalse(engine.is_running())
+        self.assertIsNot(registry.acquire(), engine)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import os
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.utils import lpsutil    # noqa: E402
+
+
+@unittest.skipUnless(lpsutil.OS_TYPE == 'LINUX', "reads linux /proc")
+class LPSUtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(4)
+        self.addCleanup(self.listener.close)
+        self.port = self.listener.getsockname()[1]
+
+    def test_decode_address(self):
+        little = sys.byteorder == 'little'
+        self.assertEqual(lpsutil._decode_address(
+            socket.AF_INET, '0100007F:1F90' if little else '7F000001:1F90'),
+            ('127.0.0.1', 8080))
+        self.assertEqual(lpsutil._decode_address(
+            socket.AF_INET6, '000000000000000000000000%s:0050' % (
+                '01000000' if little else '00000001')),
+            ('::1', 80))
+
+    def test_net_connections(self):
+        conns = [x for x in lpsutil.net_connections()
+                 if x.laddr == ('127.0.0.1', self.port)]
+        self.assertEqual(len(conns), 1)
+        conn = conns[0]
+        self.assertEqual((conn.family, conn.type, conn.raddr, conn.status),
+                         (socket.AF_INET, socket.SOCK_STREAM, (), 'LISTEN'))
+
+    def test_process_connections(self):
+        client = socket.create_connection(('127.0.0.1', self.port))
+        self.addCleanup(client.close)
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind(('127.0.0.1', 0))
+        self.addCleanup(udp.close)
+        conns = {x.fd: x for x in lpsutil.Process(os.getpid()).connections()}
+        self.assertEqual(conns[self.listener.fileno()].status, 'LISTEN')
+        conn = conns[client.fileno()]
+        self.assertEqual(conn.raddr, ('127.0.0.1', self.port))
+        self.assertEqual(conn.status, 'ESTABLISHED')
+        conn = conns[udp.fileno()]
+        self.assertEqual((conn.type, conn.laddr, conn.status),
+                         (socket.SOCK_DGRAM, udp.getsockname(), 'NONE'))
+
+    def test_virtual_memory(self):
+        mem = lpsutil.virtual_memory()
+        self.assertEqual(mem.total, os.sysconf('SC_PHYS_PAGES') *
+                         os.sysconf('SC_PAGE_SIZE'))
+        self.assertLessEqual(mem.available, mem.total)
+        self.assertLessEqual(mem.used, mem.total)
+        self.assertTrue(0 <= mem.percent <= 100)
+
+    def test_cpu_percent(self):
+        times = iter([(10, 100), (60, 200), (60, 200)])
+        cpu_percent = lpsutil._CPUPercent(lambda: next(times))
+        self.assertEqual(cpu_percent(), 0)      # First call.
+        self.assertEqual(cpu_percent(), 50)
+        self.assertEqual(cpu_percent(), 0)      # No time elapsed.
+
+    def test_process(self):
+        proc = lpsutil.Process(os.getpid())
+        proc.cpu_percent()
+        end = time.time() + 0.3
+        while time.time() < end:
+            pass    # Keep CPU busy.
+        self.assertGreater(proc.cpu_percent(), 10)
+        self.assertTrue(0 < proc.memory_percent() < 100)
+
+    def test_net_if_addrs(self):
+        addrs = lpsutil.net_if_addrs()
+        self.assertIn('127.0.0.1', [x.address for x in addrs['lo']])
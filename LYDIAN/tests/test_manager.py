@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import collections
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.traffic.core import NSHost     # noqa: E402
+from lydian.traffic.manager import AdmissionScheduler, \
+    ClientManager, ServerManager       # noqa: E402
+from lydian.traffic.task import TrafficTask     # noqa: E402
+from test_task import _free_port, accepts, make_rule     # noqa: E402
+
+
+class AdmissionSchedulerTest(unittest.TestCase):
+
+    def test_single_start_not_delayed(self):
+        admission = AdmissionScheduler(ramp_window=60, max_per_sec=1000)
+        for _ in range(10):
+            self.assertEqual(admission.admit(), 0)
+
+    def test_ramp(self):
+        admission = AdmissionScheduler(ramp_window=2, max_per_sec=1000)
+        delays = [admission.admit(ramp=True) for _ in range(100)]
+        self.assertTrue(all(0 <= x <= 2 for x in delays))
+        self.assertGreater(max(delays), min(delays))
+
+    def test_max_per_sec(self):
+        admission = AdmissionScheduler(ramp_window=0, max_per_sec=3)
+        now = time.monotonic()
+        starts = [int(now + admission.admit()) for _ in range(10)]
+        per_sec = collections.Counter(starts)
+        self.assertLessEqual(max(per_sec.values()), 3)
+        self.assertEqual(len(per_sec), 4)
+
+
+class ClientManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = queue.Queue()
+        self.manager = ClientManager(self.records, workers=1)
+        self.manager._admission = AdmissionScheduler(ramp_window=60)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_add_task_starts_at_once(self):
+        """ A rule added on its own isn't ramped. """
+        port = _free_port()     # Nothing listens, ping fails quickly.
+        self.manager.add_task(make_rule(port, tries=1, sockettimeout=1))
+        rec = self.records.get(timeout=5)
+        self.assertEqual(rec.port, port)
+
+    def test_start_many_ramped(self):
+        trules = [make_rule(_free_port(), tries=1, sockettimeout=1,
+                            state='INACTIVE') for _ in range(20)]
+        for trule in trules:
+            self.manager.add_task(trule)
+        report = self.manager.start_many(trules)
+        self.assertEqual(set(report.values()), {'started'})
+        # Starts are spread over ramp window (a minute), not done at once.
+        time.sleep(1)
+        self.assertLess(self.records.qsize(), len(trules))
+
+
+class SlowTask(object):
+
+    def __init__(self):
+        """ Task which takes all of the given timeout to finish. """
+        self.signalled = False
+
+    def stop(self, blocking=True):
+        self.signalled = True
+
+    close = stop
+
+    def join(self, timeout=None):
+        assert self.signalled
+        time.sleep(timeout)
+        return TrafficTask.TIMEOUT
+
+
+class TeardownTest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = queue.Queue()
+        self.manager = ClientManager(self.records, workers=1)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_stop_many(self):
+        trules = [make_rule(_free_port(), tries=0, interval=0.05)
+                  for _ in range(5)]
+        for trule in trules:
+            self.manager.add_task(trule)
+        self.records.get(timeout=5)
+        report = self.manager.stop_many(trules + [make_rule(1)], timeout=5)
+        self.assertEqual(report, dict({x.ruleid: 'done' for x in trules},
+                                      **{'rule-1': 'missing'}))
+        self.assertEqual(self.manager.num_tasks(), 5)
+        self.assertEqual(self.manager.close_all(timeout=5),
+                         {x.ruleid: 'done' for x in trules})
+        self.assertEqual(self.manager.num_tasks(), 0)
+
+    def test_one_deadline(self):
+        """ Tasks slow to stop are waited for within one timeout. """
+        tasks = {'rule-%d' % x: SlowTask() for x in range(5)}
+        self.manager._traffic_tasks = dict(tasks)
+        start = time.monotonic()
+        report = self.manager.close_all(timeout=0.5)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(report, {x: 'timeout' for x in tasks})
+
+
+class ServerManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = ServerManager()
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_counters(self):
+        port = _free_port()
+        first, second = make_rule(port), make_rule(port)
+        second.ruleid = 'other'
+        self.manager.add_task(first)
+        self.manager.add_task(second)   # Shares server of first.
+        other = make_rule(_free_port())
+        self.manager.add_task(other)
+        deadline = time.time() + 5
+        while not accepts(port) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.manager.num_tasks(), 2)
+
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            counters = self.manager.get_counters(['other'])
+            if counters[0]['accepts']:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(counters), 1)
+        record = counters[0]
+        self.assertEqual((record['target'], record['protocol'],
+                          record['port'], record['rules']),
+                         ('localhost', 'TCP', port, ['other', first.ruleid]))
+        self.assertGreaterEqual(record['accepts'], 1)
+        self.assertEqual(record['workers'], 1)
+        self.assertEqual(len(self.manager.get_counters()), 2)
+
+
+@unittest.skipUnless(os.geteuid() == 0 and shutil.which('ip'),
+                     "needs root and iproute2")
+class NamespaceTrafficTest(unittest.TestCase):
+
+    NAMESPACE = 'lydian-manager-test'
+
+    def setUp(self):
+        subprocess.check_call(['ip', 'netns', 'add', self.NAMESPACE])
+        self.addCleanup(subprocess.call,
+                        ['ip', 'netns', 'del', self.NAMESPACE])
+        subprocess.check_call(['ip', '-n', self.NAMESPACE, 'link', 'set',
+                               'lo', 'up'])
+        self.records = queue.Queue()
+        self.clients = ClientManager(self.records, workers=1)
+        self.servers = ServerManager()
+
+    def test_shared_engine(self):
+        """ Clients and servers of a namespace run on its one engine. """
+        port = _free_port()
+        trule = make_rule(port, tries=3, interval=0.01)
+        trule.src_target = trule.dst_target = NSHost(self.NAMESPACE)
+        try:
+            self.servers.add_task(trule)
+            time.sleep(0.2)
+            self.clients.add_task(trule)
+            recs = [self.records.get(timeout=5) for _ in range(3)]
+            self.assertTrue(all(x.result for x in recs))
+            # Server listens in namespace, not on host.
+            self.assertFalse(accepts(port))
+            engine = self.clients._engines[self.NAMESPACE][1]
+            self.assertIs(self.servers._engines[self.NAMESPACE][1], engine)
+            self.assertEqual(engine.namespace, self.NAMESPACE)
+        finally:
+            self.clients.close()
+            self.servers.close()
+        self.assertFalse(engine.is_running())
+
+
+class ShardedClientManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = queue.Queue()
+        self.manager = ClientManager(self.records, workers=2)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_sharded(self):
+        """ Clients run in worker processes and records come back. """
+        trules = [make_rule(_free_port(), tries=1, sockettimeout=1,
+                            state='INACTIVE') for _ in range(6)]
+        for trule in trules:
+            self.manager.add_task(trule)
+        self.assertEqual(self.manager.num_tasks(), 6)
+        self.assertEqual(len(self.manager._shards), 2)
+        self.assertTrue(all(x.call('num_tasks')
+                            for x in self.manager._shards))
+
+        report = self.manager.start_many(trules + [make_rule(1)])
+        self.assertEqual(report, dict({x.ruleid: 'started' for x in trules},
+                                      **{'rule-1': 'missing'}))
+        recs = [self.records.get(timeout=10) for _ in trules]
+        self.assertEqual(sorted(x.ruleid for x in recs),
+                         sorted(x.ruleid for x in trules))
+
+        report = self.manager.close_all(timeout=5)
+        self.assertEqual(report, {x.ruleid: 'done' for x in trules})
+        self.assertEqual(self.manager.num_tasks(), 0)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import errno
+import json
+import os
+import re
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.utils import netlink    # noqa: E402
+from lydian.utils.network_utils import NamespaceManager     # noqa: E402
+
+TEST_NS = 'lydian-netlink-test'
+
+
+def can_add_namespace():
+    return os.geteuid() == 0 and shutil.which('ip')
+
+
+def ip(*args):
+    subprocess.check_call(('ip',) + args)
+
+
+def _message(_type, body, seq=1):
+    length = netlink.NLMSG_HEADER.size + len(body)
+    return netlink.NLMSG_HEADER.pack(length, _type, 0, seq, 0) + body + \
+        b'\0' * (netlink._align(length) - length)
+
+
+class FakeSocket(object):
+
+    def __init__(self, *replies):
+        """ Netlink socket replying with given datagrams. """
+        self.replies = list(replies)
+        self.requests = []
+
+    def sendto(self, data, addr):
+        self.requests.append(data)
+
+    def recv(self, size):
+        return self.replies.pop(0)
+
+
+class NetlinkParserTest(unittest.TestCase):
+
+    LINKS = {2: 'eth0'}
+
+    def _addr(self, family, prefixlen, scope, attrs):
+        body = netlink.IFADDRMSG.pack(family, prefixlen, 0, scope, 2)
+        for _type, value in attrs:
+            body += netlink._attr(_type, value)
+        return _message(netlink.RTM_NEWADDR, body)
+
+    def test_addresses(self):
+        v4 = socket.inet_aton('10.1.2.3')
+        v6 = socket.inet_pton(socket.AF_INET6, 'fe80::1')
+        peer = socket.inet_aton('10.1.2.9')
+        sock = FakeSocket(
+            self._addr(socket.AF_INET, 24, 0, [
+                (netlink.IFA_ADDRESS, v4), (netlink.IFA_LOCAL, v4),
+                (netlink.IFA_BROADCAST, socket.inet_aton('10.1.2.255')),
+                (netlink.IFA_LABEL, b'eth0:1\0')]) +
+            self._addr(socket.AF_INET6, 64, netlink.RT_SCOPE_LINK, [
+                (netlink.IFA_ADDRESS, v6)]),
+            # Replies can span datagrams.
+            self._addr(socket.AF_INET, 32, 0, [
+                (netlink.IFA_ADDRESS, peer), (netlink.IFA_LOCAL, v4)]) +
+            _message(netlink.NLMSG_DONE, b'\0' * 4))
+        addrs = netlink.get_addresses(sock, self.LINKS)
+        self.assertEqual(addrs, {
+            'eth0:1': [netlink.IfAddr(socket.AF_INET, '10.1.2.3',
+                                      '255.255.255.0', '10.1.2.255', None)],
+            'eth0': [netlink.IfAddr(socket.AF_INET6, 'fe80::1%eth0',
+                                    'ffff:ffff:ffff:ffff::', None, None),
+                     netlink.IfAddr(socket.AF_INET, '10.1.2.3',
+                                    '255.255.255.255', None, '10.1.2.9')]})
+        self.assertEqual(len(sock.requests), 1)
+
+    def test_links(self):
+        body = netlink.IFINFOMSG.pack(socket.AF_UNSPEC, 0, 7, 0, 0) + \
+            netlink._attr(netlink.IFLA_IFNAME, b'veth7\0')
+        sock = FakeSocket(_message(netlink.RTM_NEWLINK, body) +
+                          _message(netlink.NLMSG_DONE, b'\0' * 4))
+        self.assertEqual(netlink.get_links(sock), {7: 'veth7'})
+
+    def test_error(self):
+        sock = FakeSocket(_message(netlink.NLMSG_ERROR,
+                                   struct.pack('=i', -errno.EPERM)))
+        with self.assertRaises(netlink.NetlinkError) as ctx:
+            netlink.get_links(sock)
+        self.assertEqual(ctx.exception.errno, errno.EPERM)
+
+    def test_other_replies_skipped(self):
+        """ Replies of other requests (sequence) are skipped. """
+        body = netlink.IFINFOMSG.pack(socket.AF_UNSPEC, 0, 3, 0, 0) + \
+            netlink._attr(netlink.IFLA_IFNAME, b'stale\0')
+        sock = FakeSocket(_message(netlink.RTM_NEWLINK, body, seq=9) +
+                          _message(netlink.NLMSG_DONE, b'\0' * 4))
+        self.assertEqual(netlink.get_links(sock), {})
+
+
+class NetIfAddrsTest(unittest.TestCase):
+
+    @unittest.skipUnless(shutil.which('ip'), "needs iproute2")
+    def test_host(self):
+        """ Addresses of host are same as 'ip addr' shows. """
+        expected = set()
+        for link in json.loads(subprocess.check_output(['ip', '-j', 'addr'])):
+            for addr in link.get('addr_info', []):
+                if addr['family'] in ('inet', 'inet6'):
+                    expected.add(addr['local'].split('%')[0])
+        found = set(x.address.split('%')[0]
+                    for addrs in netlink.net_if_addrs().values()
+                    for x in addrs)
+        self.assertEqual(found, expected)
+
+
+@unittest.skipUnless(can_add_namespace(), "needs root and iproute2")
+class NamespaceTest(unittest.TestCase):
+
+    def setUp(self):
+        ip('netns', 'add', TEST_NS)
+        self.addCleanup(subprocess.call, ['ip', 'netns', 'del', TEST_NS])
+        ip('link', 'add', 'lyd-nl0', 'type', 'veth', 'peer', 'name',
+           'lyd-nl1')
+        self.addCleanup(subprocess.call, ['ip', 'link', 'del', 'lyd-nl0'],
+                        stderr=subprocess.DEVNULL)
+        ip('link', 'set', 'lyd-nl1', 'netns', TEST_NS)
+        ip('-n', TEST_NS, 'addr', 'add', '10.251.0.2/24', 'brd', '+',
+           'dev', 'lyd-nl1')
+        self.nspath = os.path.join('/var/run/netns', TEST_NS)
+
+    def test_net_if_addrs(self):
+        addrs = netlink.net_if_addrs(self.nspath)
+        self.assertEqual(addrs['lyd-nl1'], [netlink.IfAddr(
+            socket.AF_INET, '10.251.0.2', '255.255.255.0', '10.251.0.255',
+            None)])
+        # Host is not affected by namespace.
+        self.assertNotIn('lyd-nl1', netlink.net_if_addrs())
+
+    def test_nsid(self):
+        """ Id of namespace is same as 'ip netns list' shows. """
+        sock = netlink.netns_socket()
+        self.addCleanup(sock.close)
+        output = subprocess.check_output(['ip', 'netns', 'list']).decode()
+        nsid = re.search(r'^%s \(id: (\d+)\)' % TEST_NS, output, re.M)
+        self.assertEqual(netlink.get_nsid(sock, self.nspath),
+                         int(nsid.group(1)))
+
+    def test_namespace_manager(self):
+        manager = NamespaceManager()
+        self.assertIn(TEST_NS, manager.get_all_namespaces())
+        addresses = [x.address for x in
+                     manager.get_namespace_interface_map()[TEST_NS]]
+        self.assertIn('10.251.0.2', addresses)
+        subprocess.check_call(['ip', 'netns', 'del', TEST_NS])
+        manager.update_namespaces([TEST_NS])
+        self.assertNotIn(TEST_NS, manager.get_all_namespaces())
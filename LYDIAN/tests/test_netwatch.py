@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.utils.netwatch import NetworkWatcher    # noqa: E402
+
+TEST_NS = 'lydian-netwatch-test'
+
+
+def can_add_namespace():
+    return os.geteuid() == 0 and shutil.which('ip') and \
+        shutil.which('mount')
+
+
+class NetworkWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ns_dir = os.path.join(self.tmpdir, 'netns')
+        self.changes = queue.Queue()
+        self.watcher = NetworkWatcher(
+            lambda host, namespaces: self.changes.put((host, namespaces)),
+            debounce=0.01)
+        self.watcher._ns_dir = self.ns_dir
+        self.mounts = []
+
+    def tearDown(self):
+        self.watcher.stop()
+        for path in self.mounts:
+            subprocess.call(['umount', path])
+        shutil.rmtree(self.tmpdir)
+
+    def _changes(self, timeout):
+        """ Returns (host, namespaces) changes reported within timeout. """
+        host, namespaces = False, set()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                _host, _namespaces = self.changes.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            host, namespaces = host or _host, namespaces | _namespaces
+        return host, namespaces
+
+    def _namespaces(self, timeout):
+        """ Returns namespaces reported within timeout. """
+        return self._changes(timeout)[1]
+
+    def test_missing_dir_not_created(self):
+        self.watcher.start()
+        time.sleep(0.2)
+        self.assertFalse(os.path.exists(self.ns_dir))
+
+    @unittest.skipUnless(can_add_namespace(), "needs root and iproute2")
+    def test_dir_created_later(self):
+        """ Namespace directory created after start is watched. """
+        subprocess.check_call(['ip', 'netns', 'add', TEST_NS])
+        self.addCleanup(subprocess.call, ['ip', 'netns', 'del', TEST_NS])
+        self.watcher.start()
+        time.sleep(0.2)
+        os.mkdir(self.ns_dir)
+        nspath = os.path.join(self.ns_dir, 'ns1')
+        open(nspath, 'w').close()
+        subprocess.check_call(['mount', '--bind',
+                               os.path.join('/var/run/netns', TEST_NS),
+                               nspath])
+        self.mounts.append(nspath)
+        self.assertIn('ns1', self._namespaces(2))
+
+    def test_unmounted_namespace_not_reported(self):
+        """ Namespace file which is never mounted is dropped. """
+        os.mkdir(self.ns_dir)
+        self.watcher.start()
+        time.sleep(0.2)
+        open(os.path.join(self.ns_dir, 'ns2'), 'w').close()
+        timeout = NetworkWatcher.MAX_RETRIES * 0.01 + 1
+        self.assertNotIn('ns2', self._namespaces(timeout))
+        self.assertNotIn('ns2', self.watcher._retries)
+        # Reported once it is removed.
+        os.remove(os.path.join(self.ns_dir, 'ns2'))
+        self.assertIn('ns2', self._namespaces(1))
+
+    @unittest.skipUnless(can_add_namespace(), "needs root and iproute2")
+    def test_link_changes(self):
+        """ Links moved between host and a namespace are reported. """
+        subprocess.check_call(['ip', 'netns', 'add', TEST_NS])
+        self.addCleanup(subprocess.call, ['ip', 'netns', 'del', TEST_NS])
+        self.watcher._ns_dir = '/var/run/netns'
+        self.watcher.start()
+        time.sleep(0.2)
+        self._changes(0.2)      # e.g. of other tests.
+        subprocess.check_call(['ip', 'link', 'add', 'lyd-nw0', 'type',
+                               'veth', 'peer', 'name', 'lyd-nw1'])
+        self.addCleanup(subprocess.call, ['ip', 'link', 'del', 'lyd-nw0'],
+                        stderr=subprocess.DEVNULL)
+        host, _ = self._changes(0.5)
+        self.assertTrue(host)
+        subprocess.check_call(['ip', 'link', 'set', 'lyd-nw1', 'netns',
+                               TEST_NS])
+        self.assertIn(TEST_NS, self._namespaces(0.5))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.apps.recorder import TrafficRecorder    # noqa: E402
+from lydian.traffic.core import TrafficRecord   # noqa: E402
+
+# Traffic table as created by older versions.
+OLD_TRAFFIC_TABLE = '''CREATE TABLE traffic (timestamp text, reqid text,
+    ruleid text, source text, destination text, protocol text, port text,
+    expected text, result text, latency float, error text)'''
+
+
+class TrafficRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_file = os.path.join(os.environ['SQL30_DB_DIR'], 'traffic.db')
+        if os.path.exists(self.db_file):
+            os.remove(self.db_file)
+
+    def test_old_schema(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute(OLD_TRAFFIC_TABLE)
+        conn.commit()
+        conn.close()
+
+        recorder = TrafficRecorder(db_file=self.db_file)
+        recorder.get_config = lambda param: True    # recording enabled.
+        rec = TrafficRecord()
+        rec.reqid, rec.ruleid, rec.source = 'req', 'rule', '10.0.0.1'
+        rec.latency, rec.sent, rec.received = 0.5, 10, 9
+        recorder.write(rec)
+
+        conn = sqlite3.connect(self.db_file)
+        row = conn.execute('SELECT ruleid, source, latency, sent, received '
+                           'FROM traffic').fetchone()
+        conn.close()
+        self.assertEqual(row, ('rule', '10.0.0.1', 0.5, 10, 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.apps.rules import RulesApp      # noqa: E402
+from lydian.traffic.core import TrafficRule     # noqa: E402
+
+# Rules table as created by older versions.
+OLD_RULES_TABLE = '''CREATE TABLE rules (ruleid text PRIMARY KEY,
+    reqid text, src text, dst text, protocol text, port int, connected text,
+    sockettimeout float, interval int, payload text, packet text, tries int,
+    attempts int, username text, state text, src_host text, dst_host text,
+    purpose text, target text, tool text)'''
+
+
+class RulesAppTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db_file = os.path.join(os.environ['SQL30_DB_DIR'], 'rules.db')
+        if os.path.exists(self.db_file):
+            os.remove(self.db_file)
+
+    def _rule(self, ruleid, **kwargs):
+        trule = TrafficRule()
+        trule.ruleid = ruleid
+        trule.reqid = 'req'
+        trule.src = '10.0.0.1'
+        trule.dst = '10.0.0.2'
+        trule.protocol = 'TCP'
+        trule.port = 5000
+        for key, val in kwargs.items():
+            setattr(trule, key, val)
+        trule.fill()
+        return trule
+
+    def test_old_schema(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute(OLD_RULES_TABLE)
+        conn.execute("INSERT INTO rules (ruleid, reqid, src, port, state) "
+                     "VALUES ('old', 'req', '10.0.0.1', 5000, 'ACTIVE')")
+        conn.commit()
+        conn.close()
+
+        app = RulesApp(db_file=self.db_file)
+        self.assertEqual(app.get('old').port, 5000)
+        app.add(self._rule('new', persistent=1, mode='cps', workers=2))
+        app.disable('old')
+
+        app = RulesApp(db_file=self.db_file)
+        self.assertEqual(set(app.rules), {'old', 'new'})
+        self.assertEqual(app.get('new').persistent, 1)
+        self.assertEqual(app.get('new').mode, 'cps')
+        self.assertEqual(app.get('new').workers, 2)
+        self.assertEqual(app.get_ruleids(state=RulesApp.INACTIVE), {'old'})
+
+    def test_unset_fields(self):
+        """ Fields not set on a rule are saved as NULL. """
+        trule = TrafficRule()
+        trule.ruleid, trule.reqid, trule.state = 'rule', 'req', 'ACTIVE'
+        RulesApp(db_file=self.db_file).add(trule)
+
+        conn = sqlite3.connect(self.db_file)
+        row = conn.execute("SELECT tool, payload FROM rules").fetchone()
+        conn.close()
+        self.assertEqual(row, (None, None))
+        app = RulesApp(db_file=self.db_file)
+        self.assertIsNone(app.get('rule').tool)
+        self.assertFalse(app.get('rule').external)
+
+    def test_save_upserts(self):
+        """ Saving rules updates existing rows and inserts new ones. """
+        app = RulesApp(db_file=self.db_file)
+        app.add_rules([self._rule('r1', port=5001), self._rule('r2')])
+        app.save_to_db([self._rule('r1', port=6001, state='INACTIVE'),
+                        self._rule('r3')])
+
+        conn = sqlite3.connect(self.db_file)
+        rows = conn.execute("SELECT ruleid, port, state FROM rules "
+                            "ORDER BY ruleid").fetchall()
+        conn.close()
+        self.assertEqual(rows, [('r1', 6001, 'INACTIVE'),
+                                ('r2', 5000, 'ACTIVE'),
+                                ('r3', 5000, 'ACTIVE')])
+
+    def test_unknown_column(self):
+        """ Columns unknown to rules (e.g. of other versions) are skipped. """
+        conn = sqlite3.connect(self.db_file)
+        conn.execute(OLD_RULES_TABLE.replace('tool text', 'tool text, '
+                                             'frequency int'))
+        conn.execute("INSERT INTO rules (ruleid, reqid, frequency) "
+                     "VALUES ('old', 'req', 10)")
+        conn.commit()
+        conn.close()
+
+        app = RulesApp(db_file=self.db_file)
+        self.assertEqual(app.get('old').reqid, 'req')
+        self.assertFalse(hasattr(app.get('old'), 'frequency'))
+
+    def test_indexes(self):
+        app = RulesApp(db_file=self.db_file)
+        app.add_rules([
+            self._rule('r1', state='ACTIVE'),
+            self._rule('r2', src='10.0.0.3', state='ACTIVE'),
+            self._rule('r3', state='INACTIVE'),
+            self._rule('o1', reqid='other', state='ACTIVE')])
+        self.assertEqual(app.get_ruleids(reqid='req'), {'r1', 'r2', 'r3'})
+        self.assertEqual(app.get_ruleids(reqid='req', state='ACTIVE'),
+                         {'r1', 'r2'})
+        self.assertEqual(app.get_ruleids(reqid='none'), set())
+        self.assertEqual(sorted(x.ruleid for x in
+                                app.get_rules(src='10.0.0.1')),
+                         ['o1', 'r1', 'r3'])
+        groups = app.group_ruleids('src', reqid='req')
+        self.assertEqual({k: sorted(v) for k, v in groups.items()},
+                         {'10.0.0.1': ['r1', 'r3'], '10.0.0.3': ['r2']})
+
+        app.disable('r1')
+        app.enable('r3')
+        self.assertEqual(app.get_ruleids(reqid='req', state='ACTIVE'),
+                         {'r2', 'r3'})
+        app.add(self._rule('r2', src='10.0.0.1', state='ACTIVE'))  # Update.
+        self.assertEqual(app.get_ruleids(src='10.0.0.3'), set())
+        app.delete_rules(['r2', 'o1'])
+        self.assertEqual(app.get_ruleids(state='ACTIVE'), {'r3'})
+        self.assertNotIn('other', app._indexes['reqid'])
+
+        # Rebuilt on load.
+        app = RulesApp(db_file=self.db_file)
+        self.assertEqual(app.get_ruleids(reqid='req'), {'r1', 'r3'})
+        self.assertEqual(app.get_ruleids(state='INACTIVE'), {'r1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
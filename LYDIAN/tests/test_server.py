@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.traffic.client import HTTPResponseParser    # noqa: E402
+from lydian.traffic.server import HTTPServer, ServerCounters, \
+    TCPServer, UDPServer      # noqa: E402
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TCPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.port = _free_port()
+        self.server = TCPServer(port=self.port)
+        self.thread = threading.Thread(target=self.server.start, daemon=True)
+        self.thread.start()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+
+    def _ping(self, payload):
+        """ One-shot ping : send, without half close, and read echo. """
+        sock = socket.create_connection(('127.0.0.1', self.port), 2)
+        try:
+            sock.sendall(payload)
+            data = b''
+            while True:
+                chunk = sock.recv(1024)
+                if not chunk:
+                    return data
+                data += chunk
+        finally:
+            sock.close()
+
+    def test_echo(self):
+        self.assertEqual(self._ping(b'Rampur!!'), b'Rampur!!')
+
+    def test_echo_magic_prefix(self):
+        """ Payloads which are prefixes of a magic are echoed too. """
+        for payload in (b'L', b'LY', b'LYD'):
+            self.assertEqual(self._ping(payload), payload)
+
+    def test_concurrent(self):
+        """ Connections are served together, idle ones don't block. """
+        idle = socket.create_connection(('127.0.0.1', self.port), 2)
+        self.addCleanup(idle.close)
+        socks = [socket.create_connection(('127.0.0.1', self.port), 2)
+                 for _ in range(50)]
+        for index, sock in enumerate(socks):
+            sock.sendall(b'ping-%d' % index)
+        for index, sock in enumerate(socks):
+            data = b''
+            while True:
+                chunk = sock.recv(1024)
+                if not chunk:
+                    break
+                data += chunk
+            sock.close()
+            self.assertEqual(data, b'ping-%d' % index)
+
+
+class UDPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = UDPServer(port=_free_port())
+        self.thread = threading.Thread(target=self.server.start, daemon=True)
+        self.thread.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(2)
+        self.addCleanup(self.sock.close)
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+
+    def _wait_bound(self):
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind(('', self.server.port))
+            except OSError:
+                return      # Bound by server.
+            finally:
+                sock.close()
+            time.sleep(0.01)
+
+    def _echo(self, payload):
+        self.sock.sendto(payload, ('127.0.0.1', self.server.port))
+        return self.sock.recv(65535)
+
+    def test_echo(self):
+        self._wait_bound()
+        self.assertEqual(self._echo(b'Rampur!!'), b'Rampur!!')
+
+    def test_burst(self):
+        """ Datagrams sent together (read in batches) are all echoed. """
+        self._wait_bound()
+        payloads = [('%04d' % x).encode() * (x % 16 + 1) for x in range(100)]
+        for payload in payloads:
+            self.sock.sendto(payload, ('127.0.0.1', self.server.port))
+        replies = [self.sock.recv(65535) for _ in payloads]
+        self.assertEqual(sorted(replies), sorted(payloads))
+        # Counted once a batch is handled.
+        deadline = time.time() + 2
+        while self.server.get_counters()['requests'] < 100 and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        counters = self.server.get_counters()
+        self.assertEqual(counters['requests'], 100)
+        self.assertEqual(counters['bytes_received'],
+                         sum(len(x) for x in payloads))
+        self.assertEqual(counters['sources'], {'127.0.0.1': 100})
+
+    def test_max_datagram(self):
+        self._wait_bound()
+        payload = b'x' * 65507      # Largest UDP (IPv4) payload.
+        self.assertEqual(self._echo(payload), payload)
+
+
+
+class HTTPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.port = _free_port()
+        self.server = HTTPServer(port=self.port)
+        self.thread = threading.Thread(target=self.server.start, daemon=True)
+        self.thread.start()
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                self.sock = socket.create_connection(('127.0.0.1', self.port),
+                                                     2)
+                break
+            except OSError:
+                time.sleep(0.05)
+        self.addCleanup(self.sock.close)
+
+    def tearDown(self):
+        self.server.stop()
+        self.thread.join(5)
+
+    def _exchange(self, request, count):
+        """
+        Sends request(s) and returns count responses and whether server
+        closed connection.
+        """
+        self.sock.sendall(request)
+        parser, responses = HTTPResponseParser(), []
+        while len(responses) < count:
+            data = self.sock.recv(64 * 1024)
+            if not data:
+                response = parser.close()
+                return responses + ([response] if response else []), True
+            responses += parser.feed(data)
+        return responses, False
+
+    def test_pipelined(self):
+        request = b'GET /one HTTP/1.1\r\nHost: x\r\n\r\n' \
+                  b'GET /two HTTP/1.1\r\nHost: x\r\n\r\n'
+        responses, _ = self._exchange(request, 2)
+        self.assertEqual([json.loads(x.body.decode())['payload']
+                          for x in responses], ['one', 'two'])
+        self.assertTrue(all(x.keep_alive for x in responses))
+        # Connection is kept alive.
+        responses, _ = self._exchange(
+            b'GET /three HTTP/1.1\r\nHost: x\r\n\r\n', 1)
+        self.assertEqual(json.loads(responses[0].body.decode())['payload'],
+                         'three')
+
+    def test_bytes(self):
+        size = 3 * HTTPServer.WRITE_CHUNK_SIZE + 7
+        responses, _ = self._exchange(
+            ('GET /bytes/%d HTTP/1.1\r\n\r\n' % size).encode(), 1)
+        self.assertEqual(len(responses[0].body), size)
+
+    def test_head(self):
+        """ HEAD is replied without body. """
+        self.sock.sendall(b'HEAD /bytes/10 HTTP/1.1\r\n\r\n'
+                          b'GET /after HTTP/1.1\r\nConnection: close\r\n\r\n')
+        data = b''
+        while True:
+            chunk = self.sock.recv(1024)
+            if not chunk:
+                break
+            data += chunk
+        head, _, rest = data.partition(b'\r\n\r\n')
+        self.assertIn(b'Content-Length: 10', head)
+        self.assertTrue(rest.startswith(b'HTTP/1.1 200 OK'))
+        self.assertTrue(rest.endswith(b'"payload": "after"}'))
+
+    def test_close(self):
+        responses, closed = self._exchange(
+            b'GET /bye HTTP/1.1\r\nConnection: close\r\n\r\n', 2)
+        self.assertEqual(len(responses), 1)
+        self.assertTrue(closed)
+
+    def test_http10(self):
+        _, closed = self._exchange(b'GET /old HTTP/1.0\r\n\r\n', 2)
+        self.assertTrue(closed)
+
+    def test_errors(self):
+        responses, closed = self._exchange(
+            b'POST /x HTTP/1.1\r\nContent-Length: 0\r\n\r\n', 2)
+        self.assertEqual([x.status for x in responses], [501])
+        self.assertTrue(closed)
+        self.sock = socket.create_connection(('127.0.0.1', self.port), 2)
+        self.addCleanup(self.sock.close)
+        responses, closed = self._exchange(b'garbage\r\n\r\n', 2)
+        self.assertEqual([x.status for x in responses], [400])
+        self.assertTrue(closed)
+        errors = self.server.get_counters()['errors_by_type']
+        self.assertEqual(errors, {'http_501': 1, 'http_400': 1})
+
+
+
+class ServerCountersTest(unittest.TestCase):
+
+    def test_counts(self):
+        counters = ServerCounters()
+        counters._max_sources = 2
+        for source in ('10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.3'):
+            counters.request(source)
+        counters.error(ConnectionResetError(104, 'reset'))
+        counters.error('http_400')
+        counters.incr('bytes_received', 100)
+        stats = counters.as_dict()
+        self.assertEqual(stats['requests'], 4)
+        self.assertEqual(stats['errors'], 2)
+        self.assertEqual(stats['bytes_received'], 100)
+        self.assertEqual(stats['sources'], {'10.0.0.1': 2, '10.0.0.2': 1,
+                                            ServerCounters.OTHER_SOURCES: 1})
+        self.assertEqual(stats['errors_by_type'],
+                         {'ECONNRESET': 1, 'http_400': 1})
+
+    def test_shared(self):
+        """ Counters of a worker are read and aggregated by parent. """
+        shared = ServerCounters.shared()
+        worker = ServerCounters(shared)
+        worker.request('10.0.0.1', 3)
+        worker.error('EPIPE')
+        worker.set('ns_listen_overflows', 5)
+        self.assertEqual(ServerCounters.read(shared)['sources'], {})
+        worker.publish()
+
+        parent = ServerCounters()
+        parent.request('10.0.0.1')
+        parent.set('ns_listen_overflows', 4)
+        counters = ServerCounters.aggregate(parent.as_dict(),
+                                            ServerCounters.read(shared))
+        self.assertEqual(counters['requests'], 4)
+        self.assertEqual(counters['errors'], 1)
+        self.assertEqual(counters['sources'], {'10.0.0.1': 4})
+        self.assertEqual(counters['errors_by_type'], {'EPIPE': 1})
+        # Namespace wide, not added up.
+        self.assertEqual(counters['ns_listen_overflows'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
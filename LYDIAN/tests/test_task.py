@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# Copyright (c) 2020-2021 VMware, Inc. All Rights Reserved.
+# SPDX-License-Identifier: BSD-2 License
+# The full license information can be found in LICENSE.txt
+# in the root directory of this project.
+
+import asyncio
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Keep databases (params.db too) of tests out of working directory.
+os.environ.setdefault('SQL30_DB_DIR', tempfile.mkdtemp())
+
+from lydian.traffic import engine as engines    # noqa: E402
+from lydian.traffic.core import TrafficRule, VMHost     # noqa: E402
+from lydian.traffic.server import TCPServer     # noqa: E402
+from lydian.traffic.task import TrafficClientTask, \
+    TrafficServerTask     # noqa: E402
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def make_rule(port, protocol='TCP', **kwargs):
+    trule = TrafficRule()
+    trule.ruleid = 'rule-%s' % port
+    trule.reqid = 'req'
+    trule.src = trule.dst = '127.0.0.1'
+    trule.port = port
+    trule.protocol = protocol
+    trule.connected = 1
+    for key, val in kwargs.items():
+        setattr(trule, key, val)
+    trule.fill()
+    trule.src_target = trule.dst_target = VMHost('localhost')
+    return trule
+
+
+def accepts(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), 0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def udp_bound(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(('', port))
+        return False
+    except OSError:
+        return True
+    finally:
+        sock.close()
+
+
+class TrafficTaskTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = engines.acquire_engine()
+
+    def tearDown(self):
+        engines.release_engine()
+
+    def test_server(self):
+        port = _free_port()
+        task = TrafficServerTask(make_rule(port), self.engine)
+        task.start()
+        deadline = time.time() + 5
+        while not accepts(port) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(accepts(port))
+        task.close(blocking=False)
+        self.assertEqual(task.join(5), task.DONE)
+        self.assertFalse(accepts(port))
+
+    def test_server_close_at_start(self):
+        """ Server closed before it got to run on engine, stays closed. """
+        for _ in range(20):
+            port = _free_port()
+            task = TrafficServerTask(make_rule(port), self.engine)
+            task.start()
+            task.close(blocking=False)
+            self.assertEqual(task.join(5), task.DONE)
+            self.assertFalse(accepts(port))
+
+    def test_udp_server_close_at_start(self):
+        for _ in range(20):
+            port = _free_port()
+            task = TrafficServerTask(make_rule(port, 'UDP'), self.engine)
+            task.start()
+            task.close(blocking=False)
+            self.assertEqual(task.join(5), task.DONE)
+            self.assertFalse(udp_bound(port))
+
+    def test_server_workers(self):
+        """ Workers are started / stopped without holding up engine. """
+        gaps, threads = [], set()
+
+        async def heartbeat():
+            last = time.time()
+            while True:
+                await asyncio.sleep(0.01)
+                gaps.append(time.time() - last)
+                last = time.time()
+
+        def slowed(func):
+            def wrapper(server):
+                threads.add(threading.current_thread().name)
+                time.sleep(0.3)     # e.g. a busy host.
+                return func(server)
+            return wrapper
+
+        beat = self.engine.submit(heartbeat())
+        port = _free_port()
+        task = TrafficServerTask(make_rule(port, workers=3), self.engine)
+        with mock.patch.object(TCPServer, '_start_workers',
+                               slowed(TCPServer._start_workers)), \
+                mock.patch.object(TCPServer, '_stop_workers',
+                                  slowed(TCPServer._stop_workers)):
+            try:
+                task.start()
+                deadline = time.time() + 10
+                while task.get_counters()['workers'] < 3 and \
+                        time.time() < deadline:
+                    time.sleep(0.05)
+                self.assertEqual(task.get_counters()['workers'], 3)
+                self.assertTrue(accepts(port))
+                task.close(blocking=False)
+                self.assertEqual(task.join(10), task.DONE)
+                self.assertFalse(accepts(port))
+                self.assertEqual(task.get_counters()['workers'], 1)
+            finally:
+                beat.cancel()
+        self.assertNotIn('engine-host', threads)
+        self.assertLess(max(gaps), 0.2)
+
+    def test_clients(self):
+        """ Clients of all the protocols ping servers on engine. """
+        records = queue.Queue()
+        tasks = []
+        for protocol in ('TCP', 'UDP', 'HTTP'):
+            port = _free_port()
+            server = TrafficServerTask(make_rule(port, protocol),
+                                       self.engine)
+            server.start()
+            tasks.append(server)
+            time.sleep(0.2)
+            client = TrafficClientTask(
+                records, make_rule(port, protocol, tries=3, interval=0.01),
+                self.engine)
+            client.start()
+            tasks.append(client)
+        try:
+            recs = [records.get(timeout=5) for _ in range(9)]
+        finally:
+            for task in reversed(tasks):
+                task.close()
+        self.assertTrue(all(x.result for x in recs))
+        self.assertEqual(sorted(set(x.protocol for x in recs)),
+                         ['HTTP', 'TCP', 'UDP'])
+
+    def test_client_stop_at_start(self):
+        records = queue.Queue()
+        task = TrafficClientTask(records, make_rule(_free_port(), tries=0),
+                                 self.engine)
+        task.start()
+        task.stop(blocking=False)
+        self.assertEqual(task.join(5), task.DONE)
+        self.assertFalse(task.is_running())
+
+
+if __name__ == '__main__':
+    unittest.main()